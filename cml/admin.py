@@ -8,8 +8,45 @@ from .models import *
 @admin.register(Exchange)
 class ExchangeAdmin(admin.ModelAdmin):
 
-    list_display = ('exchange_type', 'timestamp', 'user', 'filename')
-    readonly_fields = ('exchange_type', 'timestamp', 'user', 'filename')
+    list_display = ('exchange_type', 'timestamp', 'user', 'filename', 'status',
+                    'duration', 'file_size', 'error_count')
+    list_filter = ('exchange_type', 'status', 'user')
+    date_hierarchy = 'timestamp'
+    readonly_fields = ('exchange_type', 'timestamp', 'user', 'filename', 'status',
+                       'duration', 'file_size', 'item_counts', 'error_count')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+
+    list_display = ('filename', 'status', 'created', 'updated', 'user', 'reported')
+    list_filter = ('status', )
+    readonly_fields = ('filename', 'status', 'message', 'created', 'updated', 'user', 'reported')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ExportWatermark)
+class ExportWatermarkAdmin(admin.ModelAdmin):
+
+    # clear exported_until to export all the orders again
+    list_display = ('user', 'exported_until', 'pending', 'updated')
+    readonly_fields = ('user', 'pending', 'updated')
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(StoredImage)
+class StoredImageAdmin(admin.ModelAdmin):
+
+    list_display = ('filename', 'digest', 'size', 'updated')
+    search_fields = ('filename', 'digest')
+    readonly_fields = ('filename', 'digest', 'size', 'updated')
 
     def has_add_permission(self, request):
         return False
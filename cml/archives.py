@@ -0,0 +1,128 @@
+from __future__ import absolute_import
+
+import glob
+import logging
+import os
+import shutil
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from .conf import settings
+from .images import store_image
+from .utils.files import make_temp_file
+
+__all__ = (
+    'find_archive_member',
+    'get_import_source',
+    'extract_images',
+    'extract_images_in_background',
+    'wait_for_extraction',
+    'remove_archives',
+)
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+# futures of the extractions still running in this process
+_pending = set()
+
+
+def _get_archive_paths():
+    paths = glob.glob(os.path.join(settings.CML_UPLOAD_ROOT, '*.zip'))
+    # the latest upload wins if several archives have the member
+    return sorted(paths, key=os.path.getmtime, reverse=True)
+
+
+def find_archive_member(filename):
+    """
+    Returns ``(archive path, member name)`` of the uploaded zip archive
+    holding ``filename``, in any directory of the archive, or None.
+    """
+    for archive_path in _get_archive_paths():
+        try:
+            with zipfile.ZipFile(archive_path) as archive:
+                for name in archive.namelist():
+                    if name == filename or os.path.basename(name) == filename:
+                        return archive_path, name
+        except zipfile.BadZipFile:
+            logger.error(f'Bad zip archive {archive_path}')
+    return None
+
+
+def get_import_source(filename):
+    """
+    Returns ``(file path, archive member or None)`` to import ``filename``
+    from, a file uploaded as is or a member of an uploaded zip archive.
+    """
+    file_path = os.path.join(settings.CML_UPLOAD_ROOT, filename)
+    if not os.path.exists(file_path):
+        found = find_archive_member(filename)
+        if found is not None:
+            return found
+    return file_path, None
+
+
+def extract_images(archive_path):
+    """
+    Extracts every member of the archive except the xml documents to its
+    CML_CATALOG_FILE_DOWNLOAD_PATH directory, as if it was uploaded alone.
+    """
+    with zipfile.ZipFile(archive_path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            filename = os.path.basename(info.filename)
+            extension = os.path.splitext(filename)[1].lower()
+            if extension == '.xml':
+                continue
+            if settings.CML_HASHED_IMAGES:
+                with archive.open(info) as member:
+                    store_image(filename, member)
+                continue
+            download_path = settings.CML_CATALOG_FILE_DOWNLOAD_PATH[extension]
+            os.makedirs(download_path, exist_ok=True)
+            fd, temp_path = make_temp_file(download_path, suffix='.part')
+            try:
+                with os.fdopen(fd, 'wb') as f, archive.open(info) as member:
+                    shutil.copyfileobj(member, f, settings.CML_UPLOAD_CHUNK_SIZE)
+                os.replace(temp_path, os.path.join(download_path, filename))
+            except BaseException:
+                os.remove(temp_path)
+                raise
+
+
+def _extract_images(archive_path):
+    try:
+        extract_images(archive_path)
+    except Exception as e:
+        logger.error(f'Can\'t extract images from {archive_path}: {repr(e)}')
+
+
+def extract_images_in_background(archive_path):
+    """
+    Extracts the images in a process wide thread, returns the future.
+    """
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='cml-images')
+    future = _executor.submit(_extract_images, archive_path)
+    _pending.add(future)
+    future.add_done_callback(_pending.discard)
+    return future
+
+
+def wait_for_extraction(timeout=None):
+    """
+    Waits for the images of the archives uploaded to this process to be
+    extracted, so an import started meanwhile finds them.
+    """
+    if _pending:
+        wait(list(_pending), timeout=timeout)
+
+
+def remove_archives():
+    for archive_path in _get_archive_paths():
+        try:
+            os.remove(archive_path)
+        except OSError:
+            logger.error(f'Can\'t delete archive {archive_path}')
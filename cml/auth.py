@@ -5,8 +5,65 @@ from __future__ import absolute_import
 import base64
 
 import six
-from django.contrib.auth import authenticate, login
+from django.contrib.auth import HASH_SESSION_KEY, SESSION_KEY, authenticate, load_backend, login
+from django.core.cache import caches
 from django.http import HttpResponse
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .conf import settings
+
+
+def _get_cache_key(username, password):
+    digest = salted_hmac('cml.auth.credentials', f'{username}:{password}',
+                         algorithm='sha256').hexdigest()
+    return f'cml:auth:{digest}'
+
+
+def _get_password_digest(user):
+    # changes with the password hash, so a changed password is checked again
+    return salted_hmac('cml.auth.password', user.password, algorithm='sha256').hexdigest()
+
+
+def authenticate_cached(request, username, password):
+    """
+    Authenticates the user like authenticate() but keeps a verified login
+    for CML_AUTH_CACHE_TIMEOUT seconds, so the password hash isn't computed
+    again for every request of an exchange. The cache key is a keyed digest
+    of the credentials, the cached login is dropped when the password of
+    the user changes.
+    """
+    timeout = settings.CML_AUTH_CACHE_TIMEOUT
+    if not timeout:
+        return authenticate(request, username=username, password=password)
+    cache = caches[settings.CML_AUTH_CACHE_ALIAS]
+    key = _get_cache_key(username, password)
+    cached = cache.get(key)
+    if cached is not None:
+        user_pk, backend_path, password_digest = cached
+        user = load_backend(backend_path).get_user(user_pk)
+        if user is not None and constant_time_compare(
+                _get_password_digest(user), password_digest):
+            user.backend = backend_path
+            return user
+        cache.delete(key)
+    user = authenticate(request, username=username, password=password)
+    if user is not None:
+        cache.set(key, (user.pk, user.backend, _get_password_digest(user)), timeout)
+    return user
+
+
+def is_logged_in(request, user):
+    """
+    Returns True if the session of the request is already authenticated
+    for the user.
+    """
+    session = getattr(request, 'session', None)
+    if session is None:
+        return False
+    return (
+        session.get(SESSION_KEY) == user._meta.pk.value_to_string(user) and
+        constant_time_compare(session.get(HASH_SESSION_KEY, str()), user.get_session_auth_hash())
+    )
 
 
 def view_or_basicauth(view, request, test_func, realm=str(),
@@ -33,10 +90,11 @@ def view_or_basicauth(view, request, test_func, realm=str(),
                     uname, passwd = base64.b64decode(auth[1]).split(':')  # NOQA
                 else:
                     uname, passwd = base64.b64decode(auth[1]).decode('utf-8').split(':')
-                user = authenticate(username=uname, password=passwd)
+                user = authenticate_cached(request, uname, passwd)
                 if user is not None:
                     if user.is_active:
-                        login(request, user)
+                        if not is_logged_in(request, user):
+                            login(request, user)
                         request.user = user
                         if test_func(request.user):
                             return view(request, *args, **kwargs)
@@ -0,0 +1,224 @@
+from __future__ import absolute_import
+
+import importlib
+import logging
+
+from .conf import settings
+
+__all__ = (
+    'BaseXMLBackend',
+    'StdlibXMLBackend',
+    'LxmlXMLBackend',
+    'get_backend',
+)
+
+logger = logging.getLogger(__name__)
+
+
+class BaseXMLBackend(object):
+    """
+    Parser engine used by the import. ``iterparse`` drives the streaming
+    import, ``parse`` and ``select`` the whole tree one.
+    """
+
+    name = None
+
+    def __init__(self):
+        self._selectors = {}
+
+    @staticmethod
+    def qualify(path, namespace):
+        if not namespace:
+            return path
+        return '/'.join(
+            '{%s}%s' % (namespace, tag) for tag in path.split('/'))
+
+    def parse(self, source):
+        raise NotImplementedError
+
+    def iterparse(self, source, paths):
+        """
+        Yields ``(path, element)`` pairs for the elements at one of ``paths``
+        (tuples of qualified tags below the root element) and for the
+        top level elements, as soon as they are closed. Once iteration is
+        resumed the yielded element is cleared and detached together with
+        everything parsed outside of the requested paths.
+        """
+        raise NotImplementedError
+
+    def tostring(self, element):
+        """
+        Serializes a single element, used to send elements to other
+        processes.
+        """
+        raise NotImplementedError
+
+    def fromstring(self, data):
+        raise NotImplementedError
+
+    def compile_path(self, qualified_path):
+        """
+        Returns a callable selecting the elements at ``qualified_path``
+        relative to the given element.
+        """
+        raise NotImplementedError
+
+    def select(self, path, tree, namespace=None):
+        if namespace is None:
+            namespace = settings.CML_DOC_XMLNS
+        key = (namespace, path)
+        selector = self._selectors.get(key)
+        if selector is None:
+            selector = self._selectors[key] = self.compile_path(
+                self.qualify(path, namespace))
+        if hasattr(tree, 'getroot'):
+            tree = tree.getroot()
+        return selector(tree)
+
+
+class StdlibXMLBackend(BaseXMLBackend):
+
+    name = 'stdlib'
+
+    def __init__(self):
+        super(StdlibXMLBackend, self).__init__()
+        from xml.etree import ElementTree
+        self.etree = ElementTree
+
+    def parse(self, source):
+        return self.etree.parse(source)
+
+    def iterparse(self, source, paths):
+        path = ()
+        elements = []
+        capturing = False
+        for event, element in self.etree.iterparse(source, events=('start', 'end')):
+            if event == 'start':
+                if elements:
+                    path += (element.tag, )
+                    if path in paths:
+                        capturing = True
+                elements.append(element)
+                continue
+
+            elements.pop()
+            if not elements:
+                break
+            handled = path in paths
+            if handled or len(path) == 1:
+                yield path, element
+            if handled:
+                capturing = False
+            if not capturing:
+                # everything before the current element has already been
+                # dropped, so removing it from the parent is cheap
+                element.clear()
+                elements[-1].remove(element)
+            path = path[:-1]
+
+    def tostring(self, element):
+        return self.etree.tostring(element, encoding='utf-8')
+
+    def fromstring(self, data):
+        return self.etree.fromstring(data)
+
+    def compile_path(self, qualified_path):
+        def selector(element):
+            return element.findall(qualified_path)
+        return selector
+
+
+class LxmlXMLBackend(BaseXMLBackend):
+
+    name = 'lxml'
+
+    def __init__(self):
+        super(LxmlXMLBackend, self).__init__()
+        from lxml import etree
+        self.etree = etree
+
+    def _get_parser_options(self):
+        # exchange files are uploaded by authenticated 1C users and may
+        # exceed libxml2 default limits, entities are never needed
+        return dict(huge_tree=True, resolve_entities=False, no_network=True)
+
+    def parse(self, source):
+        return self.etree.parse(
+            source, self.etree.XMLParser(**self._get_parser_options()))
+
+    def iterparse(self, source, paths):
+        # every event is needed to drop the sections outside of ``paths``,
+        # filtering with tag= leaves them in the tree until the end
+        path = ()
+        depth = 0
+        capturing = False
+        for event, element in self.etree.iterparse(
+                source, events=('start', 'end'), **self._get_parser_options()):
+            if event == 'start':
+                if depth:
+                    path += (element.tag, )
+                    if path in paths:
+                        capturing = True
+                depth += 1
+                continue
+
+            depth -= 1
+            if not depth:
+                break
+            handled = path in paths
+            if handled or len(path) == 1:
+                yield path, element
+            if handled:
+                capturing = False
+            if not capturing:
+                element.clear(keep_tail=True)
+                # the preceding siblings, comments included, are processed
+                parent = element.getparent()
+                while element.getprevious() is not None:
+                    del parent[0]
+            path = path[:-1]
+
+    def tostring(self, element):
+        return self.etree.tostring(
+            element, encoding='utf-8', xml_declaration=False, with_tail=False)
+
+    def fromstring(self, data):
+        return self.etree.fromstring(
+            data, self.etree.XMLParser(**self._get_parser_options()))
+
+    def compile_path(self, qualified_path):
+        return self.etree.ETXPath(qualified_path)
+
+
+BACKENDS = {
+    StdlibXMLBackend.name: StdlibXMLBackend,
+    LxmlXMLBackend.name: LxmlXMLBackend,
+}
+
+_backends = {}
+
+
+def _load_backend_class(name):
+    if name in BACKENDS:
+        return BACKENDS[name]
+    module_name, class_name = name.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def get_backend(name=None):
+    """
+    Returns the XML backend configured with CML_XML_BACKEND, falling back to
+    the standard library one when the engine can't be loaded.
+    """
+    if name is None:
+        name = settings.CML_XML_BACKEND
+    backend = _backends.get(name)
+    if backend is None:
+        try:
+            backend = _load_backend_class(name)()
+        except ImportError as e:
+            logger.warning(f'XML backend {name} is not available, '
+                           f'falling back to {StdlibXMLBackend.name}: {repr(e)}')
+            backend = StdlibXMLBackend()
+        _backends[name] = backend
+    return backend
@@ -16,13 +16,77 @@ class CMLAppConf(AppConf):
     RESPONSE_ERROR = 'failure'
 
     MAX_EXEC_TIME = 60
+
+    # seconds a verified basic auth login is cached for, 0 to check the
+    # password on every request
+    AUTH_CACHE_TIMEOUT = 5 * 60
+    AUTH_CACHE_ALIAS = 'default'
     USE_ZIP = False
     FILE_LIMIT = 0
 
     UPLOAD_ROOT = os.path.join(settings.MEDIA_ROOT, 'cml', 'tmp')
+    # uploads are written to disk in chunks of this size
+    UPLOAD_CHUNK_SIZE = 64 * 1024
 
     DELETE_FILES_AFTER_IMPORT = True
 
+    # catalogue images are stored once per content in IMAGE_ROOT instead of
+    # under their names in CATALOG_FILE_DOWNLOAD_PATH
+    HASHED_IMAGES = False
+    IMAGE_ROOT = os.path.join(settings.MEDIA_ROOT, 'cml', 'images')
+
+    # runs mode=import requests, 'cml.jobs.SyncRunner' imports inside the
+    # request, 'cml.jobs.SlicedRunner' for MAX_EXEC_TIME seconds per request
+    IMPORT_RUNNER = 'cml.jobs.ThreadRunner'
+    IMPORT_WORKERS = 1
+    # unfinished jobs older than this are reported as failed
+    IMPORT_JOB_TIMEOUT = 60 * 60 * 6
+
+    STREAMING_IMPORT = True
+    # skips unchanged groups, properties, products and offers when set to
+    # 'cml.fingerprints.DatabaseFingerprintStore' or 'cml.fingerprints.FileFingerprintStore'
+    FINGERPRINT_STORE = None
+    FINGERPRINT_ROOT = os.path.join(UPLOAD_ROOT, 'fingerprints')
+    # keeps the 1C id -> pk mappings of the pipelines between exchanges
+    # when set to 'cml.idmap.SqliteIdMapStore'
+    ID_MAP_STORE = None
+    ID_MAP_ROOT = os.path.join(UPLOAD_ROOT, 'idmap')
+
+    # imported items keep a reference to their xml element in xml_element,
+    # which keeps the whole element subtree alive as long as the item
+    KEEP_XML_ELEMENT = False
+
+    # items passed to their pipelines only once per import, e.g. the skus and
+    # taxes repeated in every product, set to () to receive every occurrence
+    DEDUPLICATE_ITEMS = ('Sku', 'Tax')
+
+    # max number of items passed to a pipeline process_batch call
+    PIPELINE_BATCH_SIZE = 500
+
+    # products and offers are parsed in a pool of PARSE_WORKERS processes, in
+    # chunks of PARSE_CHUNK_SIZE elements, when it's greater than 1
+    PARSE_WORKERS = 0
+    PARSE_CHUNK_SIZE = 500
+    # pass parsed items to the pipelines in document order
+    PARSE_ORDERED = True
+
+    # offers are imported as OfferPrice tuples holding only the quantity,
+    # stock and prices, for OfferPricePipeline
+    PRICES_ONLY_IMPORT = False
+    # offers are imported into a cml.matrix.PriceMatrix per offers package,
+    # or per slice of a time-sliced import, for PriceMatrixPipeline
+    PRICE_MATRIX_IMPORT = False
+
+    # sale/query responses are written order by order
+    STREAMING_EXPORT = True
+    # sale/query documents are kept on disk until sale/success or until the
+    # get_version method of the orders pipeline returns another value
+    EXPORT_CACHE = False
+    EXPORT_CACHE_ROOT = os.path.join(UPLOAD_ROOT, 'export')
+
+    # 'stdlib', 'lxml' or a dotted path to a cml.backends.BaseXMLBackend subclass
+    XML_BACKEND = 'stdlib'
+
     DOC_MAJOR_VER = 2
     DOC_MINOR_VER = 1
     DOC_VERSION = f'{DOC_MAJOR_VER}.{DOC_MINOR_VER}'
@@ -0,0 +1,310 @@
+from __future__ import absolute_import
+
+import hashlib
+import importlib
+import json
+import os
+from collections import defaultdict
+
+from django.db import connections, router
+
+from .conf import settings
+from .utils.files import make_temp_file
+
+__all__ = (
+    'FINGERPRINTED_ITEMS',
+    'get_fingerprint',
+    'combine_fingerprints',
+    'BaseFingerprintStore',
+    'DatabaseFingerprintStore',
+    'FileFingerprintStore',
+    'FingerprintTracker',
+    'get_fingerprint_store',
+)
+
+FINGERPRINTED_ITEMS = ('Group', 'Property', 'Product', 'Offer', 'OfferPrice', 'PriceMatrix')
+
+# stored for nested items, which are fingerprinted with their top level
+# item, it never matches a digest so a nested item moved to the top level
+# is imported again
+NESTED_FINGERPRINT = 'nested'
+
+
+def _collect(element, parts):
+    parts.append(element.tag)
+    for key, value in sorted(element.attrib.items()):
+        parts.append(f'@{key}={value}')
+    parts.append((element.text or str()).strip())
+    for child in element:
+        # lxml comments and processing instructions have no string tag
+        if isinstance(child.tag, str):
+            _collect(child, parts)
+    parts.append('/')
+
+
+def get_fingerprint(element):
+    """
+    Returns a digest of the element content which ignores formatting
+    whitespace and attribute order.
+    """
+    parts = []
+    _collect(element, parts)
+    return hashlib.blake2b(
+        '\x00'.join(parts).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def combine_fingerprints(*digests):
+    """
+    Returns a digest of several ones, such as the fingerprint of an element
+    and the digests of the files it references.
+    """
+    return hashlib.blake2b(
+        '\x00'.join(digests).encode('utf-8'), digest_size=16).hexdigest()
+
+
+class BaseFingerprintStore(object):
+    """
+    Keeps the fingerprints of imported items between exchanges, keyed by
+    item class name and 1C id.
+    """
+
+    def load(self, item_class_name):
+        """
+        Returns a dict of 1C id -> fingerprint.
+        """
+        raise NotImplementedError
+
+    def update(self, item_class_name, fingerprints):
+        raise NotImplementedError
+
+    def delete(self, item_class_name, item_ids):
+        raise NotImplementedError
+
+
+class DatabaseFingerprintStore(BaseFingerprintStore):
+
+    batch_size = 1000
+
+    def load(self, item_class_name):
+        from .models import Fingerprint
+        return dict(
+            Fingerprint.objects
+            .filter(item_class=item_class_name)
+            .values_list('item_id', 'digest')
+            .iterator()
+        )
+
+    def update(self, item_class_name, fingerprints):
+        from .models import Fingerprint
+        instances = [
+            Fingerprint(item_class=item_class_name, item_id=item_id, digest=digest)
+            for item_id, digest in fingerprints.items()
+        ]
+        manager = Fingerprint.objects
+        database = connections[router.db_for_write(Fingerprint)]
+        if database.features.supports_update_conflicts_with_target:
+            manager.bulk_create(
+                instances,
+                batch_size=self.batch_size,
+                update_conflicts=True,
+                unique_fields=('item_class', 'item_id'),
+                update_fields=('digest', ),
+            )
+            return
+        # e.g. MySQL, which can't upsert on the unique fields
+        item_ids = list(fingerprints)
+        pks = {}
+        for i in range(0, len(item_ids), self.batch_size):
+            pks.update(
+                manager
+                .filter(item_class=item_class_name,
+                        item_id__in=item_ids[i:i + self.batch_size])
+                .values_list('item_id', 'pk')
+            )
+        new_instances = []
+        existing_instances = []
+        for instance in instances:
+            instance.pk = pks.get(instance.item_id)
+            if instance.pk is None:
+                new_instances.append(instance)
+            else:
+                existing_instances.append(instance)
+        manager.bulk_update(existing_instances, ('digest', ), batch_size=self.batch_size)
+        manager.bulk_create(new_instances, batch_size=self.batch_size)
+
+    def delete(self, item_class_name, item_ids):
+        from .models import Fingerprint
+        item_ids = list(item_ids)
+        for i in range(0, len(item_ids), self.batch_size):
+            (
+                Fingerprint.objects
+                .filter(item_class=item_class_name,
+                        item_id__in=item_ids[i:i + self.batch_size])
+                .delete()
+            )
+
+
+class FileFingerprintStore(BaseFingerprintStore):
+    """
+    Keeps a JSON file per item class in CML_FINGERPRINT_ROOT, for single
+    server setups.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or settings.CML_FINGERPRINT_ROOT
+        self._fingerprints = {}
+
+    def _get_path(self, item_class_name):
+        return os.path.join(self.root, f'{item_class_name}.json')
+
+    def load(self, item_class_name):
+        if item_class_name not in self._fingerprints:
+            try:
+                with open(self._get_path(item_class_name)) as f:
+                    fingerprints = json.load(f)
+            except FileNotFoundError:
+                fingerprints = {}
+            self._fingerprints[item_class_name] = fingerprints
+        return dict(self._fingerprints[item_class_name])
+
+    def _save(self, item_class_name):
+        os.makedirs(self.root, exist_ok=True)
+        fd, temp_path = make_temp_file(self.root, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self._fingerprints[item_class_name], f)
+        os.replace(temp_path, self._get_path(item_class_name))
+
+    def update(self, item_class_name, fingerprints):
+        self.load(item_class_name)
+        self._fingerprints[item_class_name].update(fingerprints)
+        self._save(item_class_name)
+
+    def delete(self, item_class_name, item_ids):
+        self.load(item_class_name)
+        stored = self._fingerprints[item_class_name]
+        for item_id in item_ids:
+            stored.pop(item_id, None)
+        self._save(item_class_name)
+
+
+class FingerprintTracker(object):
+    """
+    Compares item elements with the stored fingerprints during an import,
+    collects the changed ones and the ids which weren't seen.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._known = {}
+        self._seen = defaultdict(set)
+        self._changed = defaultdict(dict)
+        self._removed = {}
+
+    def _get_known(self, item_class_name):
+        known = self._known.get(item_class_name)
+        if known is None:
+            known = self._known[item_class_name] = self.store.load(item_class_name)
+        return known
+
+    @staticmethod
+    def is_fingerprinted(item_class_name):
+        return item_class_name in FINGERPRINTED_ITEMS
+
+    def is_changed(self, item_class_name, element, id_tag, extra=()):
+        """
+        Compares the fingerprint of ``element`` combined with the ``extra``
+        digests, those of the content the element references.
+        """
+        if not self.is_fingerprinted(item_class_name):
+            return True
+        item_id = (element.findtext(id_tag) or str()).strip()
+        if not item_id:
+            return True
+        return self.is_digest_changed(
+            item_class_name, item_id, get_fingerprint(element), extra)
+
+    def is_digest_changed(self, item_class_name, item_id, digest, extra=()):
+        """
+        Compares a fingerprint computed elsewhere, by the parse workers.
+        """
+        if extra:
+            digest = combine_fingerprints(digest, *extra)
+        self._seen[item_class_name].add(item_id)
+        if self._get_known(item_class_name).get(item_id) == digest:
+            return False
+        self._changed[item_class_name][item_id] = digest
+        return True
+
+    def add_nested(self, item_class_name, item_ids):
+        """
+        Marks the ids of items nested in another item as seen, so they
+        aren't reported as removed when they move from one parent to
+        another, and are when they disappear.
+        """
+        known = self._get_known(item_class_name)
+        seen = self._seen[item_class_name]
+        for item_id in item_ids:
+            seen.add(item_id)
+            if known.get(item_id) != NESTED_FINGERPRINT:
+                self._changed[item_class_name][item_id] = NESTED_FINGERPRINT
+
+    def discard(self, item_class_name, item_ids):
+        """
+        Drops the collected fingerprints of items the pipelines failed to
+        process, so they are imported again by the next exchange.
+        """
+        changed = self._changed.get(item_class_name)
+        if changed:
+            for item_id in item_ids:
+                changed.pop(item_id, None)
+
+    def get_seen(self):
+        """
+        Returns the ids seen so far by item class name, a JSON serializable
+        dict a resumed import passes to restore_seen().
+        """
+        return {item_class_name: list(item_ids)
+                for item_class_name, item_ids in self._seen.items() if item_ids}
+
+    def restore_seen(self, seen):
+        for item_class_name, item_ids in seen.items():
+            self._seen[item_class_name].update(item_ids)
+
+    def finish(self, item_class_names):
+        """
+        Returns the known ids of ``item_class_names`` which weren't seen,
+        call it once the sections of a full exchange have been imported.
+        """
+        removed = {}
+        for item_class_name in item_class_names:
+            item_ids = set(self._get_known(item_class_name)).difference(
+                self._seen.pop(item_class_name, ()))
+            if item_ids:
+                removed[item_class_name] = item_ids
+        self._removed.update(removed)
+        return removed
+
+    def commit(self):
+        """
+        Saves the fingerprints collected so far, call it once the items
+        have been passed to the pipelines.
+        """
+        for item_class_name, changed in self._changed.items():
+            if changed:
+                self.store.update(item_class_name, changed)
+                self._get_known(item_class_name).update(changed)
+        self._changed.clear()
+        for item_class_name, item_ids in self._removed.items():
+            self.store.delete(item_class_name, item_ids)
+            known = self._get_known(item_class_name)
+            for item_id in item_ids:
+                known.pop(item_id, None)
+        self._removed.clear()
+
+
+def get_fingerprint_store():
+    store_class_name = settings.CML_FINGERPRINT_STORE
+    if not store_class_name:
+        return None
+    module_name, class_name = store_class_name.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)()
@@ -0,0 +1,218 @@
+from __future__ import absolute_import
+
+import importlib
+import os
+import sqlite3
+from collections import defaultdict
+from contextlib import contextmanager
+
+from .conf import settings
+
+__all__ = (
+    'get_entity',
+    'IdMap',
+    'BaseIdMapStore',
+    'SqliteIdMapStore',
+    'get_id_map_store',
+)
+
+
+def get_entity(model, id_field='cml_id'):
+    """
+    Returns the IdMap entity name of the ``model`` rows matched on
+    ``id_field``.
+    """
+    return f'{model._meta.label_lower}.{id_field}'
+
+
+class BaseIdMapStore(object):
+    """
+    Keeps the 1C id -> pk mappings between exchanges, keyed by entity.
+    """
+
+    def load(self, entity):
+        """
+        Returns a dict of 1C id -> pk.
+        """
+        raise NotImplementedError
+
+    def update(self, entity, pks):
+        raise NotImplementedError
+
+    def delete(self, entity, item_ids):
+        raise NotImplementedError
+
+    def clear(self, prefix):
+        """
+        Deletes the mappings of the entities starting with ``prefix``.
+        """
+        raise NotImplementedError
+
+
+class SqliteIdMapStore(BaseIdMapStore):
+    """
+    Keeps the mappings in a SQLite database in CML_ID_MAP_ROOT, for single
+    server setups. Rows deleted outside of the imports stay mapped until
+    the database is removed.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or settings.CML_ID_MAP_ROOT
+
+    @contextmanager
+    def _connect(self):
+        """
+        Yields a connection closed on leaving the ``with`` block, the
+        changes made in it are committed.
+        """
+        os.makedirs(self.root, exist_ok=True)
+        connection = sqlite3.connect(os.path.join(self.root, 'idmap.sqlite3'))
+        try:
+            with connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS id_map '
+                    '(entity TEXT, item_id TEXT, pk, PRIMARY KEY (entity, item_id))')
+                yield connection
+        finally:
+            connection.close()
+
+    def load(self, entity):
+        with self._connect() as connection:
+            return dict(connection.execute(
+                'SELECT item_id, pk FROM id_map WHERE entity = ?', (entity, )))
+
+    def update(self, entity, pks):
+        with self._connect() as connection:
+            connection.executemany(
+                'INSERT OR REPLACE INTO id_map (entity, item_id, pk) VALUES (?, ?, ?)',
+                [(entity, item_id, pk if isinstance(pk, (int, str)) else str(pk))
+                 for item_id, pk in pks.items()])
+
+    def delete(self, entity, item_ids):
+        with self._connect() as connection:
+            connection.executemany(
+                'DELETE FROM id_map WHERE entity = ? AND item_id = ?',
+                [(entity, item_id) for item_id in item_ids])
+
+    def clear(self, prefix):
+        with self._connect() as connection:
+            connection.execute(
+                'DELETE FROM id_map WHERE substr(entity, 1, ?) = ?', (len(prefix), prefix))
+
+
+class IdMap(object):
+    """
+    1C id -> pk mappings shared by the pipelines of an exchange, so the
+    rows referenced by items are resolved with a dict lookup. Mappings are
+    kept per entity, a name of the rows such as the one returned by
+    get_entity(), loaded in bulk and updated by the pipelines as they
+    create rows. With a ``store`` they are kept between exchanges.
+    """
+
+    batch_size = 500
+
+    def __init__(self, store=None):
+        self.store = store
+        self._pks = {}
+        self._preloaded = set()
+        self._changed = defaultdict(dict)
+        self._removed = defaultdict(set)
+        # entity prefixes to clear in the store
+        self._cleared = set()
+
+    def get_map(self, entity):
+        """
+        Returns the dict of 1C id -> pk of the entity, don't modify it.
+        """
+        pks = self._pks.get(entity)
+        if pks is None:
+            stored = self.store is not None and not any(
+                entity.startswith(prefix) for prefix in self._cleared)
+            pks = self._pks[entity] = self.store.load(entity) if stored else {}
+        return pks
+
+    def get(self, entity, item_id):
+        return self.get_map(entity).get(item_id)
+
+    def preload(self, entity, queryset, id_field='cml_id'):
+        """
+        Loads the mappings of every ``queryset`` row with a single query,
+        once per exchange, unless the store has mappings of the entity.
+        Returns the dict of 1C id -> pk.
+        """
+        pks = self.get_map(entity)
+        if entity not in self._preloaded:
+            self._preloaded.add(entity)
+            if not pks:
+                self.update(entity, queryset.values_list(id_field, 'pk').iterator())
+        return pks
+
+    def resolve(self, entity, queryset, id_field, item_ids):
+        """
+        Returns the dict of 1C id -> pk of the entity with the mappings of
+        ``item_ids`` missing from it loaded from ``queryset`` in bulk.
+        """
+        pks = self.get_map(entity)
+        missing = list({item_id for item_id in item_ids if item_id and item_id not in pks})
+        for i in range(0, len(missing), self.batch_size):
+            self.update(entity, queryset.filter(
+                **{f'{id_field}__in': missing[i:i + self.batch_size]}
+            ).values_list(id_field, 'pk'))
+        return pks
+
+    def update(self, entity, pks):
+        """
+        Adds the mappings of ``pks``, a dict or ``(1C id, pk)`` pairs.
+        """
+        pks = dict(pks)
+        self.get_map(entity).update(pks)
+        if self.store is not None:
+            self._changed[entity].update(pks)
+            self._removed[entity].difference_update(pks)
+
+    def discard(self, entity, item_ids):
+        known = self.get_map(entity)
+        for item_id in item_ids:
+            known.pop(item_id, None)
+            if self.store is not None:
+                self._changed[entity].pop(item_id, None)
+                self._removed[entity].add(item_id)
+
+    def invalidate(self, model):
+        """
+        Drops every mapping of the ``model`` rows, e.g. once some were
+        deleted by a cascade, they are loaded again on next use.
+        """
+        prefix = get_entity(model, str())
+        for entity in list(self._pks):
+            if entity.startswith(prefix):
+                self._pks[entity].clear()
+                self._preloaded.discard(entity)
+                self._changed.pop(entity, None)
+                self._removed.pop(entity, None)
+        if self.store is not None:
+            self._cleared.add(prefix)
+
+    def commit(self):
+        """
+        Saves the changed mappings to the store.
+        """
+        for prefix in self._cleared:
+            self.store.clear(prefix)
+        self._cleared.clear()
+        for entity, pks in self._changed.items():
+            if pks:
+                self.store.update(entity, pks)
+        self._changed.clear()
+        for entity, item_ids in self._removed.items():
+            if item_ids:
+                self.store.delete(entity, item_ids)
+        self._removed.clear()
+
+
+def get_id_map_store():
+    store_class_name = settings.CML_ID_MAP_STORE
+    if not store_class_name:
+        return None
+    module_name, class_name = store_class_name.rsplit('.', 1)
+    return getattr(importlib.import_module(module_name), class_name)()
@@ -0,0 +1,124 @@
+from __future__ import absolute_import
+
+import hashlib
+import os
+
+from .conf import settings
+from .utils.files import make_temp_file
+
+__all__ = (
+    'is_image',
+    'get_image_path',
+    'store_image',
+    'store_image_file',
+    'load_image_index',
+    'get_image_digest',
+)
+
+
+def is_image(filename):
+    # every catalogue file except the documents and their archives
+    return os.path.splitext(filename)[1].lower() not in ('.xml', '.zip')
+
+
+def get_image_path(digest, filename):
+    """
+    Returns the path of the image with content ``digest`` in
+    CML_IMAGE_ROOT, keeping the extension of ``filename``.
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    return os.path.join(settings.CML_IMAGE_ROOT, digest[:2], f'{digest}{extension}')
+
+
+def _index_image(filename, digest, size):
+    from .models import StoredImage
+    stored_image, created = StoredImage.objects.get_or_create(
+        filename=filename, defaults={'digest': digest, 'size': size})
+    changed = created or stored_image.digest != digest
+    if changed and not created:
+        stored_image.digest = digest
+        stored_image.size = size
+        stored_image.save(update_fields=('digest', 'size', 'updated'))
+    return changed
+
+
+def store_image(filename, f):
+    """
+    Saves the image read from the binary file ``f`` under the digest of
+    its content and points the ``filename`` entry of the index to it. An
+    image already stored isn't written again. Returns ``(digest, changed)``,
+    ``changed`` is False if ``filename`` had the same content before.
+    """
+    os.makedirs(settings.CML_IMAGE_ROOT, exist_ok=True)
+    chunk_size = settings.CML_UPLOAD_CHUNK_SIZE
+    digest = hashlib.blake2b(digest_size=16)
+    size = 0
+    fd, temp_path = make_temp_file(settings.CML_IMAGE_ROOT, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as temp_file:
+            chunk = f.read(chunk_size)
+            while chunk:
+                digest.update(chunk)
+                size += len(chunk)
+                temp_file.write(chunk)
+                chunk = f.read(chunk_size)
+        digest = digest.hexdigest()
+        image_path = get_image_path(digest, filename)
+        if os.path.exists(image_path):
+            os.remove(temp_path)
+        else:
+            os.makedirs(os.path.dirname(image_path), exist_ok=True)
+            os.replace(temp_path, image_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+    return digest, _index_image(filename, digest, size)
+
+
+def store_image_file(filename, path):
+    """
+    Like store_image() for the file at ``path``, which is hashed in place
+    and moved under its digest only if the image isn't stored yet, the
+    file is left alone otherwise.
+    """
+    chunk_size = settings.CML_UPLOAD_CHUNK_SIZE
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        chunk = f.read(chunk_size)
+        while chunk:
+            digest.update(chunk)
+            chunk = f.read(chunk_size)
+    digest = digest.hexdigest()
+    image_path = get_image_path(digest, filename)
+    if not os.path.exists(image_path):
+        os.makedirs(os.path.dirname(image_path), exist_ok=True)
+        try:
+            os.replace(path, image_path)
+        except OSError:
+            # CML_IMAGE_ROOT is on another file system
+            with open(path, 'rb') as f:
+                return store_image(filename, f)
+    return digest, _index_image(filename, digest, os.path.getsize(image_path))
+
+
+def load_image_index():
+    """
+    Returns a dict of image file name -> digest of its content.
+    """
+    from .models import StoredImage
+    return dict(StoredImage.objects.values_list('filename', 'digest').iterator())
+
+
+def get_image_digest(filename):
+    """
+    Returns the digest of the ``filename`` image content, None if it isn't
+    stored.
+    """
+    from .models import StoredImage
+    return (
+        StoredImage.objects
+        .filter(filename=filename)
+        .values_list('digest', flat=True)
+        .first()
+    )
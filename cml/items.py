@@ -1,13 +1,15 @@
 from __future__ import absolute_import
 
+from collections import namedtuple
 from datetime import datetime
 from decimal import Decimal
 
 from .utils.translations import *
 
+# in the order batched pipelines are flushed, referenced items go first
 PROCESSED_ITEMS = (
-    'Group', 'PropertyVariant', 'Property', 'PropertyVariant', 'Sku', 'Tax',
-    'Product', 'Offer', 'Order', 'UnitOfMeasurementItem'
+    'Group', 'Property', 'PropertyVariant', 'UnitOfMeasurementItem', 'Sku',
+    'Tax', 'Product', 'PriceType', 'Offer', 'OfferPrice', 'PriceMatrix', 'Order',
 )
 
 __all__ = (
@@ -22,6 +24,7 @@ __all__ = (
     'PriceType',
     'Price',
     'Offer',
+    'OfferPrice',
     'Client',
     'OrderItem',
     'Order',
@@ -32,12 +35,18 @@ __all__ = (
 
 class BaseItem(object):
 
+    # attributes without a slot, like the fields of extended plans, go to
+    # a __dict__ created on first use
+    __slots__ = ('xml_element', '__dict__')
+
     def __init__(self, xml_element=None):
         self.xml_element = xml_element
 
 
 class UnitOfMeasurementItem(BaseItem):
 
+    __slots__ = ('code', 'title_full', 'intern_title_short')
+
     def __init__(self, *args, **kwargs):
         super(UnitOfMeasurementItem, self).__init__(*args, **kwargs)
 
@@ -48,6 +57,8 @@ class UnitOfMeasurementItem(BaseItem):
 
 class Group(BaseItem):
 
+    __slots__ = ('id', 'name', 'groups')
+
     def __init__(self, *args, **kwargs):
         super(Group, self).__init__(*args, **kwargs)
 
@@ -58,6 +69,8 @@ class Group(BaseItem):
 
 class Property(BaseItem):
 
+    __slots__ = ('id', 'name', 'value_type', 'for_products')
+
     def __init__(self, *args, **kwargs):
         super(Property, self).__init__(*args, **kwargs)
 
@@ -69,6 +82,8 @@ class Property(BaseItem):
 
 class PropertyVariant(BaseItem):
 
+    __slots__ = ('id', 'value', 'property_id')
+
     def __init__(self, *args, **kwargs):
         super(PropertyVariant, self).__init__(*args, **kwargs)
 
@@ -79,6 +94,8 @@ class PropertyVariant(BaseItem):
 
 class Sku(BaseItem):
 
+    __slots__ = ('id', 'name', 'name_full', 'international_abbr')
+
     def __init__(self, *args, **kwargs):
         super(Sku, self).__init__(*args, **kwargs)
 
@@ -90,6 +107,8 @@ class Sku(BaseItem):
 
 class Tax(BaseItem):
 
+    __slots__ = ('name', 'value')
+
     def __init__(self, *args, **kwargs):
         super(Tax, self).__init__(*args, **kwargs)
 
@@ -99,6 +118,8 @@ class Tax(BaseItem):
 
 class AdditionalField(BaseItem):
 
+    __slots__ = ('name', 'value')
+
     def __init__(self, *args, **kwargs):
         super(AdditionalField, self).__init__(*args, **kwargs)
 
@@ -108,6 +129,20 @@ class AdditionalField(BaseItem):
 
 class Product(BaseItem):
 
+    __slots__ = (
+        'id',
+        'name',
+        'item_number',
+        'sku_id',
+        'group_ids',
+        'properties',
+        'tax_name',
+        'image_path',
+        'image_filename',
+        'image_hash',
+        'additional_fields',
+    )
+
     def __init__(self, *args, **kwargs):
         super(Product, self).__init__(*args, **kwargs)
 
@@ -120,11 +155,15 @@ class Product(BaseItem):
         self.tax_name = str()
         self.image_path = str()
         self.image_filename = str()
+        # digest of the image content with CML_HASHED_IMAGES
+        self.image_hash = str()
         self.additional_fields = list()
 
 
 class PriceType(BaseItem):
 
+    __slots__ = ('id', 'name', 'currency', 'tax_name', 'tax_in_sum')
+
     def __init__(self, *args, **kwargs):
         super(PriceType, self).__init__(*args, **kwargs)
 
@@ -137,6 +176,15 @@ class PriceType(BaseItem):
 
 class Price(BaseItem):
 
+    __slots__ = (
+        'representation',
+        'price_type_id',
+        'price_for_sku',
+        'currency_name',
+        'sku_name',
+        'sku_ratio',
+    )
+
     def __init__(self, *args, **kwargs):
         super(Price, self).__init__(*args, **kwargs)
 
@@ -150,6 +198,8 @@ class Price(BaseItem):
 
 class Offer(BaseItem):
 
+    __slots__ = ('id', 'name', 'sku_id', 'prices', 'quantity')
+
     def __init__(self, *args, **kwargs):
         super(Offer, self).__init__(*args, **kwargs)
 
@@ -160,10 +210,26 @@ class Offer(BaseItem):
         self.quantity = int()
 
 
+# prices and stock of an offer imported with CML_PRICES_ONLY_IMPORT: the
+# quantity, a tuple of (warehouse id, quantity) pairs and a dict of price
+# type id -> price for unit, quantities and prices are Decimal
+OfferPrice = namedtuple('OfferPrice', ('id', 'quantity', 'stocks', 'prices'))
+
+
 class Client(BaseItem):
 
-    def __init__(self):
-        super().__init__()
+    __slots__ = (
+        'id',
+        'name',
+        'role',
+        'full_name',
+        'first_name',
+        'last_name',
+        'address',
+    )
+
+    def __init__(self, *args, **kwargs):
+        super(Client, self).__init__(*args, **kwargs)
 
         self.id = str()
         self.name = str()
@@ -176,8 +242,10 @@ class Client(BaseItem):
 
 class OrderItem(BaseItem):
 
-    def __init__(self):
-        super().__init__()
+    __slots__ = ('id', 'name', 'sku', 'price', 'quant', 'sum')
+
+    def __init__(self, *args, **kwargs):
+        super(OrderItem, self).__init__(*args, **kwargs)
 
         self.id = str()
         self.name = str()
@@ -189,6 +257,22 @@ class OrderItem(BaseItem):
 
 class Order(BaseItem):
 
+    __slots__ = (
+        'id',
+        'number',
+        'date',
+        'currency_name',
+        'currency_rate',
+        'operation',
+        'role',
+        'sum',
+        'client',
+        'time',
+        'comment',
+        'items',
+        'additional_fields',
+    )
+
     def __init__(self, *args, **kwargs):
         super(Order, self).__init__(*args, **kwargs)
 
@@ -0,0 +1,153 @@
+from __future__ import absolute_import
+
+import importlib
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connections, router, transaction
+
+from .archives import get_import_source
+from .conf import settings
+from .managers import ImportManager
+from .models import *
+from .stats import merge_stats
+
+__all__ = (
+    'BaseImportRunner',
+    'SyncRunner',
+    'ThreadRunner',
+    'SlicedRunner',
+    'get_import_runner',
+    'run_import_job',
+)
+
+logger = logging.getLogger(__name__)
+
+
+def run_import_job(job_id, deadline=None):
+    """
+    Imports the file of the job and records the outcome on it. With a
+    ``deadline`` the import is streamed from the job checkpoint and the job
+    is left pending with a new checkpoint if the deadline is reached, the
+    stats of the slices are kept in the checkpoint until the end.
+    """
+    job = ImportJob.objects.select_related('user').get(pk=job_id)
+    job.set_status(ImportJob.Status.RUNNING, checkpoint=job.checkpoint)
+    file_path, member = get_import_source(job.filename)
+    import_manager = ImportManager(
+        file_path,
+        streaming=True if deadline is not None else None,
+        checkpoint=job.checkpoint,
+        member=member,
+    )
+    try:
+        imported = import_manager.import_all(deadline=deadline)
+    except Exception as e:
+        logger.error(f'Import job {job.pk} error: {repr(e)}')
+        imported = False
+        message = str(e)
+    else:
+        message = f'Import error {job.filename}'
+    stats = merge_stats((job.checkpoint or {}).get('stats'), import_manager.stats.as_dict())
+    if not imported:
+        Exchange.log('import', job.user, job.filename, Exchange.Status.FAILURE, stats)
+        job.set_status(ImportJob.Status.FAILURE, message)
+        return
+    if import_manager.checkpoint is not None:
+        job.set_status(ImportJob.Status.PENDING,
+                       checkpoint=dict(import_manager.checkpoint, stats=stats))
+        return
+
+    # archives may hold the next document, they are removed by init
+    if settings.CML_DELETE_FILES_AFTER_IMPORT and member is None:
+        try:
+            os.remove(file_path)
+        except OSError:
+            logger.error(f'Can\'t delete file after import: {file_path}')
+
+    Exchange.log('import', job.user, job.filename, stats=stats)
+    job.set_status(ImportJob.Status.SUCCESS)
+
+
+class BaseImportRunner(object):
+    """
+    Starts import jobs. Runners are free to run the job in the current
+    process or elsewhere, the job state is kept in the database.
+    """
+
+    def submit(self, job):
+        raise NotImplementedError
+
+    def poll(self, job):
+        """
+        Called when 1C polls a job which isn't finished yet.
+        """
+        pass
+
+
+class SyncRunner(BaseImportRunner):
+    """
+    Runs the import inside the request.
+    """
+
+    def submit(self, job):
+        run_import_job(job.pk)
+
+
+class ThreadRunner(BaseImportRunner):
+    """
+    Runs imports in a process wide thread pool of CML_IMPORT_WORKERS threads.
+    """
+
+    _executor = None
+
+    @classmethod
+    def get_executor(cls):
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(
+                max_workers=settings.CML_IMPORT_WORKERS,
+                thread_name_prefix='cml-import',
+            )
+        return cls._executor
+
+    @staticmethod
+    def _run(job_id):
+        try:
+            run_import_job(job_id)
+        except Exception as e:
+            logger.error(f'Import job {job_id} error: {repr(e)}')
+        finally:
+            # pool threads outlive the job, don't keep their connections
+            connections.close_all()
+
+    def submit(self, job):
+        # the job row has to be committed before a pool thread reads it,
+        # e.g. when the request runs in a transaction with ATOMIC_REQUESTS
+        transaction.on_commit(
+            lambda: self.get_executor().submit(self._run, job.pk),
+            using=router.db_for_write(ImportJob))
+
+
+class SlicedRunner(BaseImportRunner):
+    """
+    Imports inside the requests for at most CML_MAX_EXEC_TIME seconds per
+    request, every poll resumes the job from the checkpoint saved by the
+    previous one. A slice interrupted by a crash is resumed once it has
+    not been updated for twice that time.
+    """
+
+    def submit(self, job):
+        self.poll(job)
+
+    def poll(self, job):
+        max_exec_time = settings.CML_MAX_EXEC_TIME
+        if job.claim(stale_after=2 * max_exec_time):
+            run_import_job(job.pk, deadline=time.monotonic() + max_exec_time)
+
+
+def get_import_runner():
+    module_name, class_name = settings.CML_IMPORT_RUNNER.rsplit('.', 1)
+    runner_class = getattr(importlib.import_module(module_name), class_name)
+    return runner_class()
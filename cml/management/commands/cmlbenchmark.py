@@ -0,0 +1,67 @@
+import os
+import shutil
+import tempfile
+
+from django.core.management.base import BaseCommand, CommandError
+
+from cml.utils.benchmark import run_benchmarks
+from cml.utils.generator import CommerceMLGenerator
+
+
+class Command(BaseCommand):
+    help = 'Measures import and export throughput on generated CommerceML documents'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--groups', type=int, default=100)
+        parser.add_argument('--depth', type=int, default=3)
+        parser.add_argument('--properties', type=int, default=10)
+        parser.add_argument('--variants', type=int, default=5)
+        parser.add_argument('--products', type=int, default=10000)
+        parser.add_argument('--offers', type=int, default=None,
+                            help='defaults to the number of products')
+        parser.add_argument('--price-types', type=int, default=2)
+        parser.add_argument('--orders', type=int, default=1000)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--repeat', type=int, default=1,
+                            help='runs per scenario, the best time is reported')
+        parser.add_argument('--tree', action='store_true',
+                            help='import the whole tree instead of streaming')
+        parser.add_argument('--pipelines', action='store_true',
+                            help='pass imported items to the project pipelines')
+        parser.add_argument('--workers', type=int, default=0,
+                            help='also import the catalogue and the offers in a pool '
+                                 'of parse workers')
+        parser.add_argument('--dir', default=None,
+                            help='keep the generated documents in this directory')
+
+    def handle(self, **options):
+        if options['repeat'] < 1:
+            raise CommandError('Error: --repeat must be at least 1')
+        generator = CommerceMLGenerator(
+            groups=options['groups'],
+            depth=options['depth'],
+            properties=options['properties'],
+            variants=options['variants'],
+            products=options['products'],
+            offers=options['offers'],
+            price_types=options['price_types'],
+            orders=options['orders'],
+            seed=options['seed'],
+        )
+        directory = options['dir']
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        else:
+            directory = tempfile.mkdtemp(prefix='cml-benchmark-')
+        try:
+            results = run_benchmarks(
+                generator, directory,
+                streaming=False if options['tree'] else None,
+                repeat=options['repeat'],
+                use_pipelines=options['pipelines'],
+                parse_workers=options['workers'])
+        finally:
+            if not options['dir']:
+                shutil.rmtree(directory, ignore_errors=True)
+        for result in results:
+            self.stdout.write(str(result))
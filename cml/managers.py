@@ -1,95 +1,547 @@
 from __future__ import absolute_import
 
+import glob
+import hashlib
 import importlib
+import inspect
 import logging
 import os
-from datetime import datetime
-from decimal import Decimal
+import time
+import zipfile
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
 from io import BytesIO
+from operator import attrgetter
 from typing import List
+from xml.etree import ElementTree as ET
 from xml.etree.ElementTree import Element
+from xml.sax.saxutils import quoteattr
 
 import six
 
+from .archives import wait_for_extraction
+from .backends import get_backend
 from .conf import settings
+from .fingerprints import FingerprintTracker, get_fingerprint_store
+from .idmap import IdMap, get_id_map_store
+from .images import get_image_digest, get_image_path, load_image_index
 from .items import *
+from .matrix import PriceMatrix
+from .parallel import ParallelParser
+from .plans import *
+from .scanner import ElementScanner, UnsupportedDocument
+from .stats import ExchangeStats
+from .utils.files import make_temp_file
 from .utils.translations import *
 
-try:
-    from xml.etree import cElementTree as ET  # NOQA
-except ImportError:
-    from xml.etree import ElementTree as ET  # NOQA
-
 
 logger = logging.getLogger(__name__)
 
+# keys of the items passed to the pipelines once per import
+DEDUPLICATION_KEYS = {
+    'Sku': attrgetter('id'),
+    'Tax': attrgetter('name', 'value'),
+}
+
+# plans of the items parsed by the process pool with CML_PARSE_WORKERS,
+# by path
+PARALLEL_ITEMS = {
+    (CATALOG, ITEMS, ITEM): 'Product',
+    (PACKAGE_OF_OFFERS, OFFERS, OFFER): 'Offer',
+}
+
+# items sent in full in every section of a full exchange
+SECTION_ITEMS = {
+    CLASSIFIER: ('Group', 'Property'),
+    CATALOG: ('Product', ),
+    PACKAGE_OF_OFFERS: ('Offer', ),
+}
+
+# stats phase names of the document sections
+SECTION_PHASES = {
+    CLASSIFIER: 'classifier',
+    CATALOG: 'catalogue',
+    PACKAGE_OF_OFFERS: 'offers',
+    DOCUMENT: 'orders',
+}
+
 
 class ManagerMixin(object):
 
+    @staticmethod
+    def qname(tag) -> str:
+        if not settings.CML_DOC_XMLNS:
+            return tag
+        return '{%s}%s' % (settings.CML_DOC_XMLNS, tag)
+
     @staticmethod
     def find(path, *, tree) -> 'Element':
-        return (
-            tree
-            .find('{%s}%s' % (settings.CML_DOC_XMLNS, path))
-        )
+        elements = get_backend().select(path, tree)
+        return elements[0] if elements else None
 
     @staticmethod
     def find_all(path, *, tree) -> List['Element']:
-        return (
-            tree.findall(
-                '/'.join(map(
-                    lambda d: '{%s}%s' % (settings.CML_DOC_XMLNS, d),
-                    path.split('/')
-                ))
-            )
-        )
+        return get_backend().select(path, tree)
 
 
 class ImportManager(ManagerMixin):
 
-    def __init__(self, file_path):
+    # extraction plans of the top level items, override in subclasses
+    # to read additional fields
+    plans = {
+        'Group': GROUP_PLAN,
+        'Property': PROPERTY_PLAN,
+        'UnitOfMeasurementItem': UNIT_OF_MEASUREMENT_PLAN,
+        'Product': PRODUCT_PLAN,
+        'PriceType': PRICE_TYPE_PLAN,
+        'Offer': OFFER_PLAN,
+        'Order': ORDER_PLAN,
+    }
+
+    def __init__(self, file_path, streaming=None, checkpoint=None, stats=None,
+                 member=None, prices_only=None, price_matrix=None):
         self.file_path = file_path
+        # name of the document inside the zip archive at file_path
+        self.member = member
         self.tree = None
-        self.item_processor = ItemProcessor()
-
-    def import_all(self):
+        # position of a streaming import to resume from, None once the
+        # file has been imported completely
+        self.checkpoint = checkpoint
+        self.namespace = settings.CML_DOC_XMLNS
+        self.backend = get_backend()
+        self.keep_xml_elements = settings.CML_KEEP_XML_ELEMENT
+        if streaming is None:
+            streaming = settings.CML_STREAMING_IMPORT
+        self.streaming = streaming
+        if prices_only is None:
+            prices_only = settings.CML_PRICES_ONLY_IMPORT
+        self.prices_only = prices_only
+        if price_matrix is None:
+            price_matrix = settings.CML_PRICE_MATRIX_IMPORT
+        self.price_matrix = PriceMatrix() if price_matrix else None
+        self.stats = stats if stats is not None else ExchangeStats('import')
+        self.item_processor = ItemProcessor(self.stats)
+        fingerprint_store = get_fingerprint_store()
+        self.fingerprints = None
+        if fingerprint_store is not None:
+            self.fingerprints = FingerprintTracker(fingerprint_store)
+        # 1C ids of previously imported items missing from a full exchange
+        self.removed_ids = {}
+        # a resumed import without the ids seen by the earlier slices
+        self._seen_unknown = False
+        self._deduplication_keys = {
+            item_class_name: DEDUPLICATION_KEYS[item_class_name]
+            for item_class_name in settings.CML_DEDUPLICATE_ITEMS
+        }
+        self._processed_keys = set()
+        self.parse_workers = settings.CML_PARSE_WORKERS
+        self._parallel = None
+        self._parallel_plans = {}
+        # image file name -> content digest, loaded on first use
+        self._image_index = None
+
+    def import_all(self, deadline=None):
+        """
+        Imports every section of the file, returns False if the file can't
+        be read. A streaming import stops after the first item processed
+        past the ``deadline`` (a time.monotonic() value) and leaves the
+        position to resume from in ``checkpoint``. Sends the collected
+        stats with the exchange_finished signal.
+        """
+        success = self._import_all(deadline)
+        self.stats.finish(
+            self.__class__, file_path=self.file_path, success=success,
+            complete=success and self.checkpoint is None)
+        return success
+
+    def _import_all(self, deadline):
+        if self.streaming:
+            if not self._stream_sections(
+                    CLASSIFIER, CATALOG, PACKAGE_OF_OFFERS, DOCUMENT,
+                    error_message='Import all error!', deadline=deadline):
+                return False
+            if self.checkpoint is None:
+                logger.info('Import success!')
+            return True
         try:
             self.tree = self._get_tree()
         except Exception as e:  # NOQA
             logger.error('Import all error!')
-            return
+            return False
         self.import_classifier()
         self.import_catalogue()
         self.import_offers_pack()
         self.import_orders()
+        self.checkpoint = None
         logger.info('Import success!')
+        return True
 
     def _get_tree(self):
         if self.tree is not None:
             return self.tree
-        if not os.path.exists(self.file_path):
-            message = f'File not found {self.file_path}'
-            logger.error(message)
-            raise OSError(message)
+        self._check_file()
         try:
-            tree = ET.parse(self.file_path)
+            with self.stats.phase('parse'), self._open_source() as source:
+                tree = self.backend.parse(source)
         except Exception as e:
             message = f'File parse error {self.file_path}'
             logger.error(message)
+            self.stats.add_error('parse')
             raise e
+        self.stats.bytes_parsed += self._get_source_size()
         return tree
 
-    @staticmethod
-    def _get_cleaned_text(element):
+    def _check_file(self):
+        if not os.path.exists(self.file_path):
+            message = f'File not found {self.file_path}'
+            logger.error(message)
+            self.stats.add_error('file')
+            raise OSError(message)
+
+    @contextmanager
+    def _open_source(self, binary=False):
+        """
+        Yields the path of the document, or the file opened for reading
+        with ``binary``, or a stream reading it from the archive, which is
+        never extracted to disk.
+        """
+        if self.member is None:
+            if not binary:
+                yield self.file_path
+                return
+            with open(self.file_path, 'rb') as f:
+                yield f
+            return
+        with zipfile.ZipFile(self.file_path) as archive, archive.open(self.member) as f:
+            yield f
+
+    def _get_source_size(self):
+        if self.member is None:
+            return os.path.getsize(self.file_path)
+        with zipfile.ZipFile(self.file_path) as archive:
+            return archive.getinfo(self.member).file_size
+
+    def _get_stream_handlers(self, sections):
+        handlers = {}
+        if CLASSIFIER in sections:
+            handlers[(CLASSIFIER, GROUPS, GROUP)] = self._parse_group
+            handlers[(CLASSIFIER, PROPERTIES, PROPERTY)] = self._parse_property
+            handlers[(CLASSIFIER, UNITS_OF_MEASUREMENT, UNIT_OF_MEASUREMENT)] = (
+                self._parse_unit_of_measurement)
+        if CATALOG in sections:
+            handlers[(CATALOG, ITEMS, ITEM)] = self._parse_product
+        if PACKAGE_OF_OFFERS in sections:
+            handlers[(PACKAGE_OF_OFFERS, TYPES_OF_PRICES, PRICE_TYPE)] = (
+                self._parse_price_type)
+            handlers[(PACKAGE_OF_OFFERS, OFFERS, OFFER)] = self._parse_offer
+        if DOCUMENT in sections:
+            handlers[(DOCUMENT, )] = self._parse_order
+        return {
+            tuple(map(self.qname, path)): handler
+            for path, handler in handlers.items()
+        }
+
+    def _stream_sections(self, *sections, error_message, deadline=None):
+        """
+        Scans the file for the item elements of the requested sections and
+        hands them to their parsers in chunks, falling back to iterparse
+        for documents the scanner doesn't support. Processed elements and
+        everything outside of them are dropped right away, so memory usage
+        doesn't depend on file size.
+        """
         try:
-            text = element.text
+            self._check_file()
+        except OSError:
+            logger.error(error_message)
+            return False
+        try:
+            self.stats.bytes_parsed += self._get_source_size()
+            self._stream(self._get_stream_handlers(sections), deadline)
         except Exception as e:  # NOQA
-            text = str()
-        if text is None:
-            return str()
-        return text.strip(str())
+            logger.error(f'File parse error {self.file_path}: {repr(e)}')
+            logger.error(error_message)
+            self.stats.add_error('parse')
+            return False
+        finally:
+            # buffers are never part of a checkpoint
+            self._flush()
+        return True
+
+    def _get_file_signature(self):
+        stat = os.stat(self.file_path)
+        if self.member is None:
+            return [stat.st_size, stat.st_mtime]
+        return [stat.st_size, stat.st_mtime, self.member]
+
+    def _get_resume_checkpoint(self):
+        if not self.checkpoint:
+            return None
+        if self.checkpoint.get('file') != self._get_file_signature():
+            logger.warning(f'File {self.file_path} changed since the '
+                           f'checkpoint, importing from the start')
+            return None
+        return self.checkpoint
+
+    def _set_checkpoint(self, section_path, position, state=None):
+        self.checkpoint = dict(
+            state or {},
+            section=section_path[0].rpartition('}')[2],
+            position=position,
+            file=self._get_file_signature(),
+        )
+        if self.fingerprints is not None:
+            # the sections left to finish report the ids no slice has seen
+            self.checkpoint['seen'] = self.fingerprints.get_seen()
+
+    def _add_section_time(self, section_path, phase_start):
+        section = section_path[0].rpartition('}')[2]
+        now = time.perf_counter()
+        self.stats.add_phase_time(SECTION_PHASES.get(section, section), now - phase_start)
+        return now
+
+    def _stream(self, handlers, deadline=None):
+        # time-sliced imports have to process every item before the
+        # checkpoint, so they are never parsed in parallel
+        if deadline is not None or self.parse_workers <= 1:
+            self._stream_elements(handlers, deadline)
+            return
+        self._parallel_plans = {
+            tuple(map(self.qname, path)): plan_name
+            for path, plan_name in PARALLEL_ITEMS.items()
+            # prices only and price matrix offers aren't parsed with a plan
+            if plan_name != 'Offer' or not (self.prices_only or self.price_matrix is not None)
+        }
+        with ParallelParser(self, self.parse_workers,
+                            settings.CML_PARSE_ORDERED) as self._parallel:
+            try:
+                self._stream_elements(handlers, deadline)
+            finally:
+                self._parallel = None
+                self._parallel_plans = {}
+
+    def _stream_elements(self, handlers, deadline):
+        checkpoint = self._get_resume_checkpoint()
+        if checkpoint is not None and self.fingerprints is not None:
+            if 'seen' in checkpoint:
+                self.fingerprints.restore_seen(checkpoint['seen'])
+            else:
+                self._seen_unknown = True
+        with self._open_source(binary=True) as source:
+            try:
+                scanner = ElementScanner(
+                    source, handlers, settings.CML_PARSE_CHUNK_SIZE,
+                    state=checkpoint if checkpoint and 'offset' in checkpoint else None)
+            except UnsupportedDocument as e:
+                logger.info(f'File {self.file_path} is parsed with iterparse: {e}')
+                source.seek(0)
+                completed = self._iterparse_elements(source, handlers, deadline, checkpoint)
+            else:
+                completed = self._scan_elements(scanner, handlers, deadline, checkpoint)
+        if not completed:
+            return
+        if self._parallel is not None:
+            self._parallel.drain()
+        self.checkpoint = None
+
+    def _scan_elements(self, scanner, handlers, deadline, checkpoint):
+        """
+        Handles the elements found by the scanner, a time-sliced import
+        resumes from the offset of the checkpoint. Returns False if the
+        import stopped at the deadline.
+        """
+        position = skip = 0
+        if checkpoint is not None:
+            if 'offset' in checkpoint:
+                position = checkpoint['position']
+            else:
+                # a checkpoint of an iterparse import
+                skip = checkpoint['position']
+        # the time up to the end of a section is added to its phase
+        phase_start = time.perf_counter()
+        for event, path, data in scanner:
+            if event == 'items':
+                if position + len(data) <= skip:
+                    position += len(data)
+                    continue
+                if position < skip:
+                    data, position = data[skip - position:], skip
+                plan_name = self._parallel_plans.get(path)
+                if plan_name is not None:
+                    # the workers parse the raw elements
+                    position += len(data)
+                    self._parallel.add(plan_name, scanner.wrap(
+                        b''.join(item_data for item_data, end in data)), len(scanner.stack))
+                    continue
+                handler = handlers[path]
+                parent = self._parse_fragment(
+                    scanner, b''.join(item_data for item_data, end in data))
+                for element, (item_data, end) in zip(parent, data):
+                    position += 1
+                    handler(element)
+                    if deadline is not None and time.monotonic() >= deadline:
+                        self._set_checkpoint(path, position, scanner.get_state(end))
+                        self._add_section_time(path, phase_start)
+                        return False
+                if len(path) == 1:
+                    phase_start = self._add_section_time(path, phase_start)
+            elif event == 'end' and len(path) == 1:
+                self._finish_section(self._parse_fragment(
+                    scanner, b'', scanner.stack + [data]))
+                phase_start = self._add_section_time(path, phase_start)
+        return True
+
+    def _parse_fragment(self, scanner, data, stack=None):
+        """
+        Parses ``data`` inside the open elements of the scanner, returns
+        the innermost of them.
+        """
+        if stack is None:
+            stack = scanner.stack
+        element = self.backend.fromstring(scanner.wrap(data, stack))
+        for i in range(len(stack) - 1):
+            element = element[0]
+        return element
+
+    def _iterparse_elements(self, source, handlers, deadline, checkpoint):
+        """
+        Handles the elements yielded by the backend iterparse, a time-sliced
+        import skips the elements up to the checkpoint position and the time
+        spent on them isn't counted towards the deadline. Elements are never
+        parsed in parallel here. Returns False if the import stopped at the
+        deadline.
+        """
+        skip = checkpoint['position'] if checkpoint is not None else 0
+        sections = {path[0] for path in handlers}
+        position = 0
+        skip_start = time.monotonic() if skip and deadline is not None else None
+        phase_start = time.perf_counter()
+        for path, element in self.backend.iterparse(source, handlers):
+            handler = handlers.get(path)
+            if handler is not None:
+                position += 1
+                # elements before the checkpoint are parsed, not processed
+                if position <= skip:
+                    continue
+                if position == skip + 1 and skip_start is not None:
+                    deadline += time.monotonic() - skip_start
+                handler(element)
+                if deadline is not None and time.monotonic() >= deadline:
+                    self._set_checkpoint(path, position)
+                    self._add_section_time(path, phase_start)
+                    return False
+            elif len(path) == 1 and path[0] in sections:
+                self._finish_section(element)
+            if len(path) == 1:
+                phase_start = self._add_section_time(path, phase_start)
+        return True
+
+    def _flush(self):
+        self.item_processor.flush_batches()
+        if self.price_matrix:
+            # after the batched price types
+            self.item_processor.process_item(self.price_matrix)
+            self.item_processor.flush_batches()
+            self.price_matrix = self.price_matrix.copy_columns()
+        if self.fingerprints is not None:
+            for item_class_name, item_ids in self.item_processor.pop_failed_ids().items():
+                self.fingerprints.discard(item_class_name, item_ids)
+            self.fingerprints.commit()
+
+    def _finish_section(self, section_element):
+        """
+        Ends an import phase. Items of a full exchange section which were
+        imported before but are missing now are reported as removed.
+        """
+        if self._parallel is not None:
+            self._parallel.drain()
+        self.item_processor.flush_batches()
+        section = section_element.tag.rpartition('}')[2]
+        only_changes = section_element.get(CONTAINS_ONLY_CHANGES, FALSE)
+        if self.fingerprints is not None and only_changes.lower() != TRUE.lower():
+            if self._seen_unknown:
+                logger.warning(f'Removed items of {section} aren\'t detected, the import '
+                               f'was resumed from a checkpoint without the seen ids')
+            else:
+                removed = self.fingerprints.finish(self._get_section_items(section))
+                for item_class_name, item_ids in removed.items():
+                    logger.info(f'{len(item_ids)} {item_class_name} items removed')
+                    self.removed_ids[item_class_name] = item_ids
+                    self.item_processor.process_removed(item_class_name, item_ids)
+        self._flush()
+
+    def _get_section_items(self, section):
+        # offers are fingerprinted under the name of the item they're read into
+        if section == PACKAGE_OF_OFFERS and self.price_matrix is not None:
+            return ('PriceMatrix', )
+        if section == PACKAGE_OF_OFFERS and self.prices_only:
+            return ('OfferPrice', )
+        return SECTION_ITEMS.get(section, ())
+
+    def _parse(self, plan_name, element):
+        plan = self.plans[plan_name]
+        item_class_name = plan.item_class.__name__
+        if self.fingerprints is not None:
+            extra = ()
+            if item_class_name == 'Product':
+                image_element = element.find(self.qname(IMAGE))
+                if image_element is not None:
+                    extra = self._get_image_digests(get_basename(image_element))
+            if not self.fingerprints.is_changed(
+                    item_class_name, element, self.qname(ID), extra):
+                return None
+        return plan.compile(self.namespace).parse(
+            element, self._process_item, self.keep_xml_elements)
+
+    def _process_item(self, item):
+        item_class_name = item.__class__.__name__
+        get_key = self._deduplication_keys.get(item_class_name)
+        if get_key is not None:
+            key = (item_class_name, get_key(item))
+            if key in self._processed_keys:
+                return
+            self._processed_keys.add(key)
+        if item_class_name == 'PriceType' and self.price_matrix is not None:
+            self.price_matrix.add_price_type(item)
+        if item_class_name == 'Product' and item.image_filename and settings.CML_HASHED_IMAGES:
+            self._set_image_hash(item)
+        self.item_processor.process_item(item)
+
+    def _get_image_digest(self, filename):
+        if self._image_index is None:
+            # images of an archive uploaded with the documents may still
+            # be extracted in the background
+            wait_for_extraction()
+            self._image_index = load_image_index()
+        digest = self._image_index.get(filename)
+        if digest is None:
+            # stored since the index was loaded, e.g. by another process
+            digest = get_image_digest(filename)
+            if digest is not None:
+                self._image_index[filename] = digest
+        return digest
+
+    def _get_image_digests(self, filename):
+        """
+        Returns the digests a product fingerprint is combined with, so the
+        product is imported again when its image changes.
+        """
+        if not filename or not settings.CML_HASHED_IMAGES:
+            return ()
+        digest = self._get_image_digest(filename)
+        return () if digest is None else (digest, )
+
+    def _set_image_hash(self, product_item):
+        digest = self._get_image_digest(product_item.image_filename)
+        if digest is not None:
+            product_item.image_hash = digest
+            product_item.image_path = get_image_path(digest, product_item.image_filename)
 
     def import_classifier(self):
+        if self.streaming:
+            self._stream_sections(
+                CLASSIFIER, error_message='Import classifier error!')
+            return
         try:
             tree = self._get_tree()
         except Exception as e:  # NOQA
@@ -97,56 +549,47 @@ class ImportManager(ManagerMixin):
             return
         classifier_element = self.find(CLASSIFIER, tree=tree)
         if classifier_element is not None:
-            self._parse_groups(classifier_element)
-            self._parse_properties(classifier_element)
-            self._parse_units_of_measurements(classifier_element)
+            with self.stats.phase(SECTION_PHASES[CLASSIFIER]):
+                self._parse_groups(classifier_element)
+                self._parse_properties(classifier_element)
+                self._parse_units_of_measurements(classifier_element)
+                self._finish_section(classifier_element)
 
-    def _parse_groups(self, current_element, parent_item=None):
+    def _parse_groups(self, current_element):
         for group_element in self.find_all(f'{GROUPS}/{GROUP}', tree=current_element):
-            group_item = Group(group_element)
-            group_item.id = self._get_cleaned_text(self.find(ID, tree=group_element))
-            group_item.name = self._get_cleaned_text(self.find(TITLE, tree=group_element))
-            if parent_item is not None:
-                parent_item.groups.append(group_item)
-            self._parse_groups(group_element, group_item)
-            # processing only top level groups
-            if parent_item is None:
-                self.item_processor.process_item(group_item)
+            self._parse_group(group_element)
+
+    def _parse_group(self, group_element):
+        # nested groups are collected into the top level group item
+        if self.fingerprints is not None:
+            group_tag, id_tag = self.qname(GROUP), self.qname(ID)
+            self.fingerprints.add_nested('Group', [
+                (element.findtext(id_tag) or str()).strip()
+                for element in group_element.iter(group_tag)
+                if element is not group_element
+            ])
+        self._parse('Group', group_element)
 
     def _parse_properties(self, current_element):
         for property_element in self.find_all(
                 f'{PROPERTIES}/{PROPERTY}', tree=current_element):
-            property_item = Property(property_element)
-            property_item.id = self._get_cleaned_text(
-                self.find(ID, tree=property_element))
-            property_item.name = self._get_cleaned_text(
-                self.find(TITLE, tree=property_element))
-            property_item.value_type = self._get_cleaned_text(
-                self.find(VALUE_TYPE, tree=property_element))
-            property_item.for_products = self._get_cleaned_text(
-                self.find(FOR_GOODS, tree=property_element)) == TRUE
-            self.item_processor.process_item(property_item)
-
-            for variant_element in self.find_all(
-                    f'{VARIATIONS_REFERENCES}/{property_item.value_type}',
-                    tree=property_element):
-                variant = PropertyVariant(variant_element)
-                variant.id = self._get_cleaned_text(self.find(VALUE_ID, tree=variant_element))
-                variant.value = self._get_cleaned_text(self.find(VALUE, tree=variant_element))
-                variant.property_id = property_item.id
-                self.item_processor.process_item(variant)
+            self._parse_property(property_element)
+
+    def _parse_property(self, property_element):
+        self._parse('Property', property_element)
 
     def _parse_units_of_measurements(self, current_element):
         for unit_element in self.find_all(f'{UNITS_OF_MEASUREMENT}/{UNIT_OF_MEASUREMENT}', tree=current_element):
-            unit_item = UnitOfMeasurementItem(unit_element)
-            unit_item.code = self._get_cleaned_text(
-                self.find(CODE, tree=unit_element))
-            unit_item.title_full = self._get_cleaned_text(
-                self.find(TITLE_FULL, tree=unit_element))
-            unit_item.intern_title_short = self._get_cleaned_text(
-                self.find(INTERNATIONAL_TITLE_SHORT, tree=unit_element))
+            self._parse_unit_of_measurement(unit_element)
+
+    def _parse_unit_of_measurement(self, unit_element):
+        self._parse('UnitOfMeasurementItem', unit_element)
 
     def import_catalogue(self):
+        if self.streaming:
+            self._stream_sections(
+                CATALOG, error_message='Import catalogue error!')
+            return
         try:
             tree = self._get_tree()
         except Exception as e:  # NOQA
@@ -155,87 +598,23 @@ class ImportManager(ManagerMixin):
 
         catalogue_element = self.find(CATALOG, tree=tree)
         if catalogue_element is not None:
-            self._parse_products(catalogue_element)
+            with self.stats.phase(SECTION_PHASES[CATALOG]):
+                self._parse_products(catalogue_element)
+                self._finish_section(catalogue_element)
 
     def _parse_products(self, current_element):
         for product_element in self.find_all(
                 f'{ITEMS}/{ITEM}', tree=current_element):
-            product_item = Product(product_element)
-            product_item.id = self._get_cleaned_text(
-                self.find(ID, tree=product_element))
-            product_item.name = self._get_cleaned_text(
-                self.find(TITLE, tree=product_element))
-            product_item.item_number = self._get_cleaned_text(
-                self.find(ITEM_NUMBER, tree=product_element))
-
-            sku_element = self.find(BASIC_UNIT, tree=product_element)
-
-            if sku_element is not None:
-                sku_item = Sku(sku_element)
-                sku_item.id = sku_element.get(CODE)
-                sku_item.name_full = sku_element.get(TITLE_FULL)
-                sku_item.international_abbr = sku_element.get(INTERNATIONAL_ABBR)
-                sku_item.name = self._get_cleaned_text(sku_element)
-                product_item.sku_id = sku_item.id
-                self.item_processor.process_item(sku_item)
-
-            image_element = self.find(IMAGE, tree=product_element)
-            if image_element is not None:
-                image_text = self._get_cleaned_text(image_element)
-
-                try:
-                    image_filename = os.path.basename(image_text)
-                except Exception as e:  # NOQA
-                    image_filename = str()
-
-                if image_filename:
-                    product_item.image_path = os.path.join(
-                        settings.MEDIA_ROOT, image_filename)
-                    product_item.image_filename = image_filename
-
-            for group_id_element in self.find_all(
-                    f'{GROUPS}/{ID}', tree=product_element):
-                product_item.group_ids.append(
-                    self._get_cleaned_text(group_id_element))
-
-            for property_element in self.find_all(
-                    f'{PROPERTIES_VALUES}/{PROPERTY_VALUES}',
-                    tree=product_element):
-                property_id = self._get_cleaned_text(
-                    self.find(ID, tree=property_element))
-                property_variant_id = self._get_cleaned_text(
-                    self.find(VALUE, tree=property_element))
-
-                if property_variant_id:
-                    product_item.properties.append((property_id, property_variant_id))
-
-            for tax_element in self.find_all(
-                    f'{TAX_RATES}/{TAX_RATE}', tree=product_element):
-                tax_item = Tax(tax_element)
-                tax_item.name = self._get_cleaned_text(
-                    self.find(TITLE, tree=tax_element))
-
-                try:
-                    tax_item.value = Decimal(self._get_cleaned_text(
-                        self.find(BET, tree=tax_element)))
-                except Exception as e:  # NOQA
-                    tax_item.value = Decimal()
-
-                self.item_processor.process_item(tax_item)
-                product_item.tax_name = tax_item.name
-
-            for additional_field_element in self.find_all(
-                    f'{THE_VALUES_OF_THE_DETAILS}/{THE_VALUE_OF_THE_PROPS}',
-                    tree=product_element):
-                additional_field = AdditionalField(additional_field_element)
-                additional_field.name = self._get_cleaned_text(
-                    self.find(TITLE, tree=additional_field_element))
-                additional_field.value = self._get_cleaned_text(
-                    self.find(VALUE, tree=additional_field_element))
-                product_item.additional_fields.append(additional_field)
-            self.item_processor.process_item(product_item)
+            self._parse_product(product_element)
+
+    def _parse_product(self, product_element):
+        self._parse('Product', product_element)
 
     def import_offers_pack(self):
+        if self.streaming:
+            self._stream_sections(
+                PACKAGE_OF_OFFERS, error_message='Import offers pack error!')
+            return
         try:
             tree = self._get_tree()
         except Exception as e:  # NOQA
@@ -243,236 +622,282 @@ class ImportManager(ManagerMixin):
             return
         offers_pack_element = self.find(PACKAGE_OF_OFFERS, tree=tree)
         if offers_pack_element is not None:
-            self._parse_price_types(offers_pack_element)
-            self._parse_offers(offers_pack_element)
+            with self.stats.phase(SECTION_PHASES[PACKAGE_OF_OFFERS]):
+                self._parse_price_types(offers_pack_element)
+                self._parse_offers(offers_pack_element)
+                self._finish_section(offers_pack_element)
 
     def _parse_price_types(self, current_element):
         for price_type_element in self.find_all(
                 f'{TYPES_OF_PRICES}/{PRICE_TYPE}',
                 tree=current_element):
-            price_type_item = PriceType(price_type_element)
-            price_type_item.id = self._get_cleaned_text(
-                self.find(ID, tree=price_type_element))
-            price_type_item.name = self._get_cleaned_text(
-                self.find(TITLE, tree=price_type_element))
-            price_type_item.currency = self._get_cleaned_text(
-                self.find(CURRENCY, tree=price_type_element))
-            price_type_item.tax_name = self._get_cleaned_text(
-                self.find(f'{TAX}/{TITLE}', tree=price_type_element))
-            if self._get_cleaned_text(self.find(
-                    f'{TAX}/{TAKEN_INTO_ACCOUNT_IN_THE_AMOUNT}',
-                    tree=price_type_element)) == TRUE:
-                price_type_item.tax_in_sum = True
-            self.item_processor.process_item(price_type_item)
+            self._parse_price_type(price_type_element)
+
+    def _parse_price_type(self, price_type_element):
+        self._parse('PriceType', price_type_element)
 
     def _parse_offers(self, current_element):
         for offer_element in self.find_all(
                 f'{OFFERS}/{OFFER}', tree=current_element):
-            offer_item = Offer(offer_element)
-            offer_item.id = self._get_cleaned_text(self.find(ID, tree=offer_element))
-            offer_item.name = self._get_cleaned_text(self.find(TITLE, tree=offer_element))
-            offer_item.quantity = self._get_cleaned_text(self.find(QUANTITY, tree=offer_element))
-
-            sku_element = self.find(BASIC_UNIT, tree=offer_element)
-            if sku_element is not None:
-                sku_item = Sku(sku_element)
-                sku_item.id = sku_element.get(CODE)
-                sku_item.name_full = sku_element.get(TITLE_FULL)
-                sku_item.international_abbr = sku_element.get(INTERNATIONAL_ABBR)
-                sku_item.name = self._get_cleaned_text(sku_element)
-                offer_item.sku_id = sku_item.id
-                self.item_processor.process_item(sku_item)
-
-            for price_element in self.find_all(
-                    f'{PRICES}/{PRICE}', tree=offer_element):
-                price_item = Price(price_element)
-                price_item.representation = self._get_cleaned_text(
-                    self.find(PERFORMANCE, tree=price_element))
-                price_item.price_type_id = self._get_cleaned_text(
-                    self.find(PRICE_TYPE_ID, tree=price_element))
-                price_item.price_for_sku = Decimal(self._get_cleaned_text(
-                    self.find(PRICE_PER_UNIT, tree=price_element)))
-                price_item.currency_name = self._get_cleaned_text(
-                    self.find(CURRENCY, tree=price_element))
-                price_item.sku_name = self._get_cleaned_text(
-                    self.find(UNIT, tree=price_element))
-                price_item.sku_ratio = Decimal(self._get_cleaned_text(
-                    self.find(RATIO, tree=price_element)))
-                offer_item.prices.append(price_item)
-
-            self.item_processor.process_item(offer_item)
+            self._parse_offer(offer_element)
+
+    def _parse_offer(self, offer_element):
+        if self.price_matrix is not None:
+            self._parse_price_matrix_row(offer_element)
+        elif self.prices_only:
+            self._parse_offer_price(offer_element)
+        else:
+            self._parse('Offer', offer_element)
+
+    def _parse_offer_price(self, offer_element):
+        if self.fingerprints is not None and not self.fingerprints.is_changed(
+                'OfferPrice', offer_element, self.qname(ID)):
+            return
+        self._process_item(get_offer_price_parser(self.namespace)(offer_element))
+
+    def _parse_price_matrix_row(self, offer_element):
+        if self.fingerprints is not None and not self.fingerprints.is_changed(
+                'PriceMatrix', offer_element, self.qname(ID)):
+            return
+        get_price_matrix_parser(self.namespace)(offer_element, self.price_matrix)
 
     def import_orders(self):
+        if self.streaming:
+            self._stream_sections(
+                DOCUMENT, error_message='Import orders error!')
+            return
         try:
             tree = self._get_tree()
         except Exception as e:  # NOQA
             logger.error('Import orders error!')
             return
-        orders_elements = self.find(DOCUMENT, tree=tree)
-        if orders_elements is not None:
-            self._parse_orders(orders_elements)
-
-    def _parse_orders(self, order_elements):
-        for order_element in order_elements:
-            order_item = Order(order_element)
-            order_item.id = self._get_cleaned_text(
-                self.find(ID, tree=order_element))
-            order_item.number = self._get_cleaned_text(
-                self.find(NUMBER, tree=order_element))
-            order_item.date = self._get_cleaned_text(
-                self.find(DATE, tree=order_element))
-            order_item.currency_name = self._get_cleaned_text(
-                self.find(CURRENCY, tree=order_element))
-            order_item.currency_rate = self._get_cleaned_text(
-                self.find(CURRENCY, tree=order_element))
-            order_item.operation = self._get_cleaned_text(
-                self.find(HOUSEHOLD_OPERATION, tree=order_element))
-            order_item.role = self._get_cleaned_text(
-                self.find(ROLE, tree=order_element))
-            order_item.sum = self._get_cleaned_text(
-                self.find(AMOUNT, tree=order_element))
-            order_item.client.id = self._get_cleaned_text(
-                self.find(f'{COUNTERPARTIES}/{COUNTERPARTY}/{ID}',
-                          tree=order_element))
-            order_item.client.name = self._get_cleaned_text(
-                self.find(f'{COUNTERPARTIES}/{COUNTERPARTY}/{TITLE}',
-                          tree=order_element))
-            order_item.client.full_name = self._get_cleaned_text(
-                self.find(f'{COUNTERPARTIES}/{COUNTERPARTY}/{FULL_NAME}',
-                          tree=order_element))
-            order_item.time = self._get_cleaned_text(
-                self.find(TIME, tree=order_element))
-            order_item.comment = self._get_cleaned_text(
-                self.find(COMMENT, tree=order_element))
-            item_elements = self.find(
-                f'{PRODUCTS}/{PRODUCT}', tree=order_element)
-
-            if item_elements is not None:
-                for item_element in item_elements:
-                    order_item_item = OrderItem(item_element)  # NOQA
-                    order_item_item.id = self._get_cleaned_text(
-                        self.find(ID, tree=item_element))
-                    order_item_item.name = self._get_cleaned_text(
-                        self.find(TITLE, tree=item_element))
-                    sku_element = self.find(BASIC_UNIT, tree=item_element)
-
-                    if sku_element is not None:
-                        order_item_item.sku.id = sku_element.get(CODE)
-                        order_item_item.sku.name = self._get_cleaned_text(
-                            sku_element)
-                        order_item_item.sku.name_full = sku_element.get(
-                            TITLE_FULL)
-                        order_item_item.sku.international_abbr = sku_element.get(
-                            INTERNATIONAL_ABBR)
-
-                    order_item_item.price = self._get_cleaned_text(
-                        self.find(PRICE_PER_UNIT, tree=item_element))
-                    order_item_item.quant = self._get_cleaned_text(
-                        self.find(QUANTITY, tree=item_element))
-                    order_item_item.sum = self._get_cleaned_text(
-                        self.find(AMOUNT, tree=item_element))
-                    order_item.items.append(order_item_item)
-
-                    additional_field_elements = self.find(
-                        f'{THE_VALUES_OF_THE_DETAILS}/{THE_VALUE_OF_THE_PROPS}',
-                        tree=order_element
-                    )
-                    if additional_field_elements is not None:
-                        for additional_field_element in additional_field_elements:
-                            additional_field_item = AdditionalField(additional_field_element)
-                            additional_field_item.name = self._get_cleaned_text(
-                                self.find(TITLE, tree=item_element))
-                            additional_field_item.value = self._get_cleaned_text(
-                                self.find(VALUE, tree=item_element))
-            self.item_processor.process_item(order_item)
+        if self.find(DOCUMENT, tree=tree) is not None:
+            with self.stats.phase(SECTION_PHASES[DOCUMENT]):
+                self._parse_orders(tree)
+                self._flush()
+
+    def _parse_orders(self, current_element):
+        for order_element in self.find_all(DOCUMENT, tree=current_element):
+            self._parse_order(order_element)
+
+    def _parse_order(self, order_element):
+        self._parse('Order', order_element)
 
 
 class ExportManager(object):
 
-    def __init__(self):
-        self.item_processor = ItemProcessor()
+    def __init__(self, stats=None, since=None):
+        self.stats = stats if stats is not None else ExchangeStats('export')
+        # export watermark passed to the yield_item method of the pipeline
+        self.since = since
+        self.item_processor = ItemProcessor(self.stats)
         self.root = ET.Element(COMMERCIAL_INFORMATION)
         self.root.set(VERSIONS_OF_THE_SCHEME, settings.CML_DOC_VERSION)
         self.root.set(DATA_FORMATIONS, six.text_type(datetime.now().date()))
 
     def get_xml(self):
-        f = BytesIO()
-        tree = ET.ElementTree(self.root)
-        tree.write(f, encoding=settings.CML_DEFAULT_CHARSET, xml_declaration=True)
-        return f.getvalue()
+        """
+        Returns the exported document and sends the collected stats with
+        the exchange_finished signal.
+        """
+        with self.stats.phase('serialize'):
+            f = BytesIO()
+            tree = ET.ElementTree(self.root)
+            tree.write(f, encoding=settings.CML_DEFAULT_CHARSET, xml_declaration=True)
+            xml = f.getvalue()
+        self.stats.bytes_written += len(xml)
+        self.stats.finish(self.__class__, success=True)
+        return xml
+
+    def iter_xml(self):
+        """
+        Yields the document encoded to CML_DEFAULT_CHARSET order by order,
+        as the orders are yielded by the pipeline, so only one of them is
+        kept in memory. Sends the collected stats with the
+        exchange_finished signal once the document is complete, call it
+        instead of export_all and get_xml.
+        """
+        charset = settings.CML_DEFAULT_CHARSET
+        attributes = ''.join(
+            f' {name}={quoteattr(value)}' for name, value in self.root.items())
+        data = (f"<?xml version='1.0' encoding='{charset}'?>\n"
+                f'<{COMMERCIAL_INFORMATION}{attributes}>').encode(charset, 'xmlcharrefreplace')
+        self.stats.bytes_written += len(data)
+        yield data
+        orders = iter(self.item_processor.yield_item(Order, since=self.since))
+        while True:
+            start = time.perf_counter()
+            order = next(orders, None)
+            if order is None:
+                break
+            order_element = self.get_order_element(order)
+            serialize_start = time.perf_counter()
+            self.stats.add_phase_time('orders', serialize_start - start)
+            data = ET.tostring(order_element, encoding=charset, xml_declaration=False)
+            self.stats.add_phase_time('serialize', time.perf_counter() - serialize_start)
+            self.stats.bytes_written += len(data)
+            yield data
+        data = f'</{COMMERCIAL_INFORMATION}>'.encode(charset)
+        self.stats.bytes_written += len(data)
+        yield data
+        self.stats.finish(self.__class__, success=True)
 
     def export_all(self):
         self.export_orders()
 
     def export_orders(self):
-        for order in self.item_processor.yield_item(Order):
-            order_element = ET.SubElement(self.root, DOCUMENT)
-            ET.SubElement(order_element, ID).text = six.text_type(order.id)
-            ET.SubElement(order_element, NUMBER).text = six.text_type(
-                order.number)
-            ET.SubElement(order_element, DATE).text = six.text_type(
-                order.date.strftime('%Y-%m-%d'))
-            ET.SubElement(order_element, TIME).text = six.text_type(
-                order.time.strftime('%H:%M:%S'))
-            ET.SubElement(order_element, HOUSEHOLD_OPERATION).text = six.text_type(
-                order.operation)
-            ET.SubElement(order_element, ROLE).text = six.text_type(order.role)
-            ET.SubElement(order_element, CURRENCY).text = six.text_type(
-                order.currency_name)
-            ET.SubElement(order_element, EXCHANGE_RATE).text = six.text_type(
-                order.currency_rate)
-            ET.SubElement(order_element, AMOUNT).text = six.text_type(order.sum)
-            ET.SubElement(order_element, COMMENT).text = six.text_type(
-                order.comment)
-            clients_element = ET.SubElement(order_element, COUNTERPARTIES)
-            client_element = ET.SubElement(clients_element, COUNTERPARTY)
-            ET.SubElement(client_element, ID).text = six.text_type(
-                order.client.id)
-            ET.SubElement(client_element, NAME).text = six.text_type(
-                order.client.name)
-            ET.SubElement(client_element, ROLE).text = six.text_type(
-                order.client.role)
-            ET.SubElement(client_element, FULL_NAME).text = six.text_type(
-                order.client.full_name)
-            ET.SubElement(client_element, SURNAME).text = six.text_type(
-                order.client.last_name)
-            ET.SubElement(client_element, NAME).text = six.text_type(
-                order.client.first_name)
-
-            # address_element = ET.SubElement(clients_element, REGISTRATION_ADDRESS)
-
-            ET.SubElement(clients_element, PERFORMANCE).text = six.text_type(
-                order.client.address)
-            products_element = ET.SubElement(order_element, ITEMS)
-
-            for order_item in order.items:
-                product_element = ET.SubElement(products_element, ITEM)
-                ET.SubElement(product_element, ID).text = six.text_type(
-                    order_item.id)
-                ET.SubElement(product_element, TITLE).text = six.text_type(
-                    order_item.name)
-                sku_element = ET.SubElement(product_element, BASIC_UNIT)
-                sku_element.set(CODE, order_item.sku.id)
-                sku_element.set(TITLE_FULL, order_item.sku.name_full)
-                sku_element.set(
-                    INTERNATIONAL_ABBR, order_item.sku.international_abbr)
-                sku_element.text = order_item.sku.name
-
-                ET.SubElement(product_element, PRICE_PER_UNIT).text = six.text_type(
-                    order_item.price)
-                ET.SubElement(product_element, QUANTITY).text = six.text_type(
-                    order_item.quant)
-                ET.SubElement(product_element, AMOUNT).text = six.text_type(
-                    order_item.sum)
+        with self.stats.phase('orders'):
+            for order in self.item_processor.yield_item(Order, since=self.since):
+                self.root.append(self.get_order_element(order))
+
+    def get_order_element(self, order):
+        self.stats.add_item(order.__class__.__name__)
+        order_element = ET.Element(DOCUMENT)
+        ET.SubElement(order_element, ID).text = six.text_type(order.id)
+        ET.SubElement(order_element, NUMBER).text = six.text_type(
+            order.number)
+        ET.SubElement(order_element, DATE).text = six.text_type(
+            order.date.strftime('%Y-%m-%d'))
+        ET.SubElement(order_element, TIME).text = six.text_type(
+            order.time.strftime('%H:%M:%S'))
+        ET.SubElement(order_element, HOUSEHOLD_OPERATION).text = six.text_type(
+            order.operation)
+        ET.SubElement(order_element, ROLE).text = six.text_type(order.role)
+        ET.SubElement(order_element, CURRENCY).text = six.text_type(
+            order.currency_name)
+        ET.SubElement(order_element, EXCHANGE_RATE).text = six.text_type(
+            order.currency_rate)
+        ET.SubElement(order_element, AMOUNT).text = six.text_type(order.sum)
+        ET.SubElement(order_element, COMMENT).text = six.text_type(
+            order.comment)
+        clients_element = ET.SubElement(order_element, COUNTERPARTIES)
+        client_element = ET.SubElement(clients_element, COUNTERPARTY)
+        ET.SubElement(client_element, ID).text = six.text_type(
+            order.client.id)
+        ET.SubElement(client_element, NAME).text = six.text_type(
+            order.client.name)
+        ET.SubElement(client_element, ROLE).text = six.text_type(
+            order.client.role)
+        ET.SubElement(client_element, FULL_NAME).text = six.text_type(
+            order.client.full_name)
+        ET.SubElement(client_element, SURNAME).text = six.text_type(
+            order.client.last_name)
+        ET.SubElement(client_element, NAME).text = six.text_type(
+            order.client.first_name)
+
+        # address_element = ET.SubElement(clients_element, REGISTRATION_ADDRESS)
+
+        ET.SubElement(clients_element, PERFORMANCE).text = six.text_type(
+            order.client.address)
+        products_element = ET.SubElement(order_element, ITEMS)
+
+        for order_item in order.items:
+            product_element = ET.SubElement(products_element, ITEM)
+            ET.SubElement(product_element, ID).text = six.text_type(
+                order_item.id)
+            ET.SubElement(product_element, TITLE).text = six.text_type(
+                order_item.name)
+            sku_element = ET.SubElement(product_element, BASIC_UNIT)
+            sku_element.set(CODE, order_item.sku.id)
+            sku_element.set(TITLE_FULL, order_item.sku.name_full)
+            sku_element.set(
+                INTERNATIONAL_ABBR, order_item.sku.international_abbr)
+            sku_element.text = order_item.sku.name
+
+            ET.SubElement(product_element, PRICE_PER_UNIT).text = six.text_type(
+                order_item.price)
+            ET.SubElement(product_element, QUANTITY).text = six.text_type(
+                order_item.quant)
+            ET.SubElement(product_element, AMOUNT).text = six.text_type(
+                order_item.sum)
+        return order_element
+
+    def get_cached_xml(self, user=None):
+        """
+        Returns ``(file, etag, rendered)``, the open binary file of the
+        document cached in CML_EXPORT_CACHE_ROOT, rendered first if there
+        is none for the version returned by the get_version method of the
+        pipeline, and the UTC time its orders were read at. The caller
+        closes the file. The documents of a ``user`` are kept in a
+        directory of their own, rendering one only replaces the earlier
+        documents of the same user.
+        """
+        version = self.item_processor.get_version(Order)
+        key = hashlib.blake2b(
+            f'{settings.CML_DEFAULT_CHARSET}:{self.since}:{version}'.encode('utf-8'),
+            digest_size=16).hexdigest()
+        cache_root = settings.CML_EXPORT_CACHE_ROOT
+        if user is not None:
+            cache_root = os.path.join(cache_root, str(user.pk))
+        file_path = os.path.join(cache_root, f'orders-{key}.xml')
+        while True:
+            try:
+                f = open(file_path, 'rb')
+                break
+            except FileNotFoundError:
+                # not rendered yet or invalidated meanwhile by another request
+                self._render_cache(file_path)
+        # the modification time is the render time, a document rendered
+        # again for the same version is a new one, the descriptor stays
+        # valid if the file is replaced or removed
+        mtime_ns = os.fstat(f.fileno()).st_mtime_ns
+        # rounded down, the orders read at that time are in the document
+        rendered = datetime.fromtimestamp(0, tz=timezone.utc) + timedelta(
+            microseconds=mtime_ns // 1000)
+        return f, f'"{key}-{mtime_ns}"', rendered
+
+    def _render_cache(self, file_path):
+        cache_root = os.path.dirname(file_path)
+        # the documents of other users are left alone
+        self._remove_cached(glob.glob(os.path.join(cache_root, 'orders-*.xml')))
+        os.makedirs(cache_root, exist_ok=True)
+        fd, temp_path = make_temp_file(cache_root, suffix='.tmp')
+        started = time.time_ns()
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                for data in self.iter_xml():
+                    f.write(data)
+            # orders changed while the document was rendered may be missing
+            # from it, so it's dated when the rendering started
+            os.utime(temp_path, ns=(started, started))
+            os.replace(temp_path, file_path)
+        except BaseException:
+            os.remove(temp_path)
+            raise
+
+    @staticmethod
+    def _remove_cached(file_paths):
+        for file_path in file_paths:
+            try:
+                os.remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    @classmethod
+    def invalidate_cache(cls):
+        """
+        Removes the cached documents of every user.
+        """
+        cls._remove_cached(glob.glob(
+            os.path.join(settings.CML_EXPORT_CACHE_ROOT, '**', 'orders-*.xml'), recursive=True))
 
     def flush(self):
+        self.invalidate_cache()
         self.item_processor.flush_pipeline(Order)
 
 
 class ItemProcessor(ManagerMixin):
 
-    def __init__(self):
+    def __init__(self, stats=None):
+        self.stats = stats if stats is not None else ExchangeStats('import')
         self._project_pipelines = {}
+        self._batched_items = set()
+        self._buffers = {}
+        self.batch_size = settings.CML_PIPELINE_BATCH_SIZE
+        # shared with the pipelines having an id_map attribute
+        self.id_map = IdMap(get_id_map_store())
+        # item class name -> ids of the items a pipeline call failed for
+        self.failed_ids = defaultdict(set)
         self._load_project_pipelines()
 
     def _load_project_pipelines(self):
@@ -490,39 +915,144 @@ class ItemProcessor(ManagerMixin):
                 pipeline_class = getattr(pipelines_module, f'{item_class_name}Pipeline')
             except AttributeError:
                 continue
-            self._project_pipelines[item_class_name] = pipeline_class()
+            pipeline = self._project_pipelines[item_class_name] = pipeline_class()
+            if hasattr(pipeline, 'id_map'):
+                pipeline.id_map = self.id_map
+            if hasattr(pipeline_class, 'process_batch'):
+                self._batched_items.add(item_class_name)
 
     def _get_project_pipeline(self, item_class):
         item_class_name = item_class.__name__
         return self._project_pipelines.get(item_class_name, False)
 
     def process_item(self, item):
+        item_class_name = item.__class__.__name__
+        self.stats.add_item(item_class_name)
+        if item_class_name in self._batched_items:
+            buffer = self._buffers.setdefault(item_class_name, [])
+            buffer.append(item)
+            if len(buffer) >= self.batch_size:
+                # flushing every buffer keeps referenced items ahead of
+                # the items referencing them
+                self.flush_batches()
+            return
         project_pipeline = self._get_project_pipeline(item.__class__)
         if project_pipeline:
+            if self._buffers:
+                # the item may reference the buffered ones
+                self.flush_batches()
+            try:
+                with self.stats.pipeline(project_pipeline, 'process_item'):
+                    project_pipeline.process_item(item)  # NOQA
+            except Exception as e:
+                self.stats.add_error(item_class_name)
+                self._add_failed(item_class_name, (item, ))
+                logger.error(
+                    f'Error processing of item {item_class_name}: '
+                    f'{repr(e)}'
+                )
+
+    def _add_failed(self, item_class_name, items):
+        failed_ids = self.failed_ids[item_class_name]
+        for item in items:
+            if isinstance(item, PriceMatrix):
+                failed_ids.update(item.offer_ids)
+                continue
+            item_id = getattr(item, 'id', None)
+            if item_id:
+                failed_ids.add(item_id)
+
+    def pop_failed_ids(self):
+        """
+        Returns the ids of the items the pipelines failed for since the
+        last call, by item class name.
+        """
+        failed_ids, self.failed_ids = self.failed_ids, defaultdict(set)
+        return failed_ids
+
+    def flush_batches(self):
+        """
+        Passes the buffered items to the process_batch method of their
+        pipelines, in PROCESSED_ITEMS order, then saves the id mappings
+        they changed.
+        """
+        for item_class_name in PROCESSED_ITEMS:
+            items = self._buffers.pop(item_class_name, None)
+            if not items:
+                continue
+            project_pipeline = self._project_pipelines[item_class_name]
+            try:
+                with self.stats.pipeline(project_pipeline, 'process_batch'):
+                    project_pipeline.process_batch(items)  # NOQA
+            except Exception as e:
+                self.stats.add_error(item_class_name)
+                self._add_failed(item_class_name, items)
+                logger.error(
+                    f'Error processing of batch {item_class_name}: '
+                    f'{repr(e)}'
+                )
+        if self.id_map.store is not None:
+            try:
+                self.id_map.commit()
+            except Exception as e:
+                self.stats.add_error('id_map')
+                logger.error(f'Error saving id mappings: {repr(e)}')
+
+    def process_removed(self, item_class_name, item_ids):
+        project_pipeline = self._project_pipelines.get(item_class_name)
+        if project_pipeline and hasattr(project_pipeline, 'process_removed'):
             try:
-                project_pipeline.process_item(item)  # NOQA
+                with self.stats.pipeline(project_pipeline, 'process_removed'):
+                    project_pipeline.process_removed(item_ids)  # NOQA
             except Exception as e:
+                self.stats.add_error(item_class_name)
                 logger.error(
-                    f'Error processing of item {item.__class__.__name__}: '
+                    f'Error processing of removed items {item_class_name}: '
                     f'{repr(e)}'
                 )
 
-    def yield_item(self, item_class):
+    def yield_item(self, item_class, since=None):
+        """
+        Returns the items yielded by the pipeline, ``since`` is passed to
+        yield_item methods accepting it.
+        """
         project_pipeline = self._get_project_pipeline(item_class)
         if project_pipeline:
             try:
-                return project_pipeline.yield_item()  # NOQA
+                if 'since' in inspect.signature(project_pipeline.yield_item).parameters:  # NOQA
+                    items = project_pipeline.yield_item(since=since)  # NOQA
+                else:
+                    items = project_pipeline.yield_item()  # NOQA
+                return self.stats.iterate(project_pipeline, 'yield_item', items)
             except Exception as e:
+                self.stats.add_error(item_class.__name__)
                 logger.error(f'Error yielding item {item_class.__name__}: '
                              f'{repr(e)}')
                 return []
         return []
 
+    def get_version(self, item_class):
+        """
+        Returns the value of the optional get_version method of the
+        pipeline, which changes whenever the exported items do.
+        """
+        project_pipeline = self._get_project_pipeline(item_class)
+        if project_pipeline and hasattr(project_pipeline, 'get_version'):
+            try:
+                return project_pipeline.get_version()  # NOQA
+            except Exception as e:
+                self.stats.add_error(item_class.__name__)
+                logger.error(f'Error getting version of pipeline for item '
+                             f'{item_class.__name__}: {repr(e)}')
+        return None
+
     def flush_pipeline(self, item_class):
         project_pipeline = self._get_project_pipeline(item_class)
         if project_pipeline:
             try:
-                project_pipeline.flush()  # NOQA
+                with self.stats.pipeline(project_pipeline, 'flush'):
+                    project_pipeline.flush()  # NOQA
             except Exception as e:
+                self.stats.add_error(item_class.__name__)
                 logger.error(f'Error flushing pipeline for item {item_class.__name__}: '
                              f'{repr(e)}')
@@ -0,0 +1,176 @@
+from __future__ import absolute_import
+
+import math
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+__all__ = (
+    'PriceMatrix',
+)
+
+NAN = float('nan')
+
+
+class PriceMatrix(object):
+    """
+    Prices of the imported offers as an offer x price type table. Offer ids
+    and quantities are kept per row, every price type column is a float
+    array of prices and one of ratios, NaN where the offer has no price of
+    the type. Prices are floats, recalculations apply to whole columns and
+    use numpy when it's installed.
+    """
+
+    __slots__ = (
+        'offer_ids',
+        'quantities',
+        'price_type_ids',
+        'currencies',
+        'tax_in_sum',
+        'prices',
+        'ratios',
+        '_columns',
+    )
+
+    def __init__(self):
+        self.offer_ids = []
+        self.quantities = array('d')
+        self.price_type_ids = []
+        # currency of the column prices, None if unknown
+        self.currencies = []
+        # True if the column prices include taxes, None if unknown
+        self.tax_in_sum = []
+        self.prices = []
+        self.ratios = []
+        self._columns = {}
+
+    def __len__(self):
+        return len(self.offer_ids)
+
+    def copy_columns(self):
+        """
+        Returns an empty matrix with the price type columns of this one.
+        """
+        matrix = PriceMatrix()
+        for column, price_type_id in enumerate(self.price_type_ids):
+            index = matrix.get_column(price_type_id)
+            matrix.currencies[index] = self.currencies[column]
+            matrix.tax_in_sum[index] = self.tax_in_sum[column]
+        return matrix
+
+    def get_column(self, price_type_id):
+        """
+        Returns the column index of the price type, adding the column if
+        there is none.
+        """
+        column = self._columns.get(price_type_id)
+        if column is None:
+            column = self._columns[price_type_id] = len(self.price_type_ids)
+            rows = len(self.offer_ids)
+            self.price_type_ids.append(price_type_id)
+            self.currencies.append(None)
+            self.tax_in_sum.append(None)
+            self.prices.append(array('d', [NAN]) * rows)
+            self.ratios.append(array('d', [NAN]) * rows)
+        return column
+
+    def add_price_type(self, price_type):
+        column = self.get_column(price_type.id)
+        self.currencies[column] = price_type.currency or None
+        self.tax_in_sum[column] = price_type.tax_in_sum
+
+    def add_offer(self, offer_id, quantity):
+        """
+        Adds a row without prices, returns its index.
+        """
+        self.offer_ids.append(offer_id)
+        self.quantities.append(quantity)
+        for column in self.prices:
+            column.append(NAN)
+        for column in self.ratios:
+            column.append(NAN)
+        return len(self.offer_ids) - 1
+
+    def set_price(self, row, price_type_id, price, ratio=1.0, currency=None):
+        column = self.get_column(price_type_id)
+        self.prices[column][row] = price
+        self.ratios[column][row] = ratio
+        if currency and self.currencies[column] is None:
+            self.currencies[column] = currency
+
+    def get_price(self, offer_id, price_type_id):
+        """
+        Returns the price, None if there is none. Looks the row up by a
+        linear search, iterate over the columns for bulk access.
+        """
+        price = self.prices[self._columns[price_type_id]][self.offer_ids.index(offer_id)]
+        return None if math.isnan(price) else price
+
+    def iter_rows(self):
+        """
+        Yields ``(offer id, quantity, {price type id: price})`` per row,
+        without the missing prices.
+        """
+        for row, offer_id in enumerate(self.offer_ids):
+            prices = {}
+            for price_type_id, column in zip(self.price_type_ids, self.prices):
+                price = column[row]
+                if not math.isnan(price):
+                    prices[price_type_id] = price
+            yield offer_id, self.quantities[row], prices
+
+    def scale_column(self, price_type_id, factor):
+        column = self.prices[self.get_column(price_type_id)]
+        if numpy is not None:
+            values = numpy.frombuffer(column, dtype=numpy.float64)
+            values *= factor
+            # the array can't be resized while the view is alive
+            del values
+        else:
+            column[:] = array('d', [value * factor for value in column])
+
+    def convert_currency(self, rates, currency=None):
+        """
+        Converts the prices with ``rates``, a dict of currency -> rate of
+        its unit in the target currency. Columns already in ``currency``
+        or in a currency without a rate are kept, the converted ones are
+        marked with ``currency``.
+        """
+        for column, price_type_id in enumerate(self.price_type_ids):
+            column_currency = self.currencies[column]
+            if column_currency == currency or column_currency not in rates:
+                continue
+            self.scale_column(price_type_id, rates[column_currency])
+            self.currencies[column] = currency
+
+    def exclude_tax(self, rate):
+        """
+        Removes a tax of ``rate`` percent from the columns of price types
+        with taxes taken into account in the sum.
+        """
+        factor = 100 / (100 + float(rate))
+        for column, price_type_id in enumerate(self.price_type_ids):
+            if self.tax_in_sum[column]:
+                self.scale_column(price_type_id, factor)
+                self.tax_in_sum[column] = False
+
+    def as_numpy(self):
+        """
+        Returns the ``(prices, ratios, quantities)`` numpy arrays, prices
+        and ratios of shape (offers, price types). Raises ImportError
+        without numpy.
+        """
+        if numpy is None:
+            raise ImportError('numpy is required for PriceMatrix.as_numpy()')
+        shape = (len(self.offer_ids), len(self.price_type_ids))
+
+        def stack(columns):
+            if not columns:
+                return numpy.empty(shape)
+            return numpy.column_stack([numpy.array(column, dtype=numpy.float64)
+                                       for column in columns])
+        return (stack(self.prices), stack(self.ratios),
+                numpy.array(self.quantities, dtype=numpy.float64))
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cml', '0003_importjob_checkpoint'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Fingerprint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('item_class', models.CharField(max_length=50)),
+                ('item_id', models.CharField(max_length=200)),
+                ('digest', models.CharField(max_length=64)),
+            ],
+            options={
+                'verbose_name': 'Item fingerprint',
+                'verbose_name_plural': 'Item fingerprints',
+                'constraints': [models.UniqueConstraint(fields=('item_class', 'item_id'), name='cml_fingerprint_unique_item')],
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 03:11
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cml', '0004_fingerprint'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='exchange',
+            name='duration',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='exchange',
+            name='error_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='exchange',
+            name='file_size',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='exchange',
+            name='item_counts',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='exchange',
+            name='status',
+            field=models.CharField(choices=[('success', 'Успешно'), ('failure', 'Ошибка')], default='success', max_length=20),
+        ),
+        migrations.AddIndex(
+            model_name='exchange',
+            index=models.Index(fields=['timestamp'], name='cml_exchange_timestamp'),
+        ),
+        migrations.AddIndex(
+            model_name='exchange',
+            index=models.Index(fields=['exchange_type', 'timestamp'], name='cml_exchange_type_timestamp'),
+        ),
+    ]
@@ -1,10 +1,17 @@
 from __future__ import absolute_import
 
+from datetime import timedelta
+
 from django.conf import settings
 from django.db import models
+from django.utils import timezone
 
 __all__ = (
     'Exchange',
+    'ImportJob',
+    'Fingerprint',
+    'ExportWatermark',
+    'StoredImage',
 )
 
 
@@ -14,20 +21,199 @@ class Exchange(models.Model):
         IMPORT = 'import', 'Импорт'
         EXPORT = 'export', 'Экспорт'
 
+    class Status(models.TextChoices):
+        SUCCESS = 'success', 'Успешно'
+        FAILURE = 'failure', 'Ошибка'
+
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
     exchange_type = models.CharField(max_length=50, choices=ExchangeType.choices)
     filename = models.CharField(max_length=200)
     timestamp = models.DateTimeField(auto_now_add=True)
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.SUCCESS)
+    # seconds
+    duration = models.FloatField(null=True, blank=True)
+    # bytes of the imported file or the exported document
+    file_size = models.BigIntegerField(null=True, blank=True)
+    item_counts = models.JSONField(default=dict, blank=True)
+    error_count = models.PositiveIntegerField(default=0)
 
     class Meta:
         verbose_name = 'Exchange log entry'
         verbose_name_plural = 'Exchange log entries'
+        indexes = (
+            models.Index(fields=('timestamp', ), name='cml_exchange_timestamp'),
+            models.Index(fields=('exchange_type', 'timestamp'), name='cml_exchange_type_timestamp'),
+        )
 
     @classmethod
-    def log(cls, exchange_type, user, filename=str()):
+    def log(cls, exchange_type, user, filename=str(), status=Status.SUCCESS, stats=None):
+        """
+        Saves an entry, ``stats`` is an ExchangeStats.as_dict() record of
+        the exchange.
+        """
+        stats = stats or {}
         ex_log = Exchange(
             exchange_type=exchange_type,
             user=user,
-            filename=filename
+            filename=filename,
+            status=status,
+            duration=stats.get('duration'),
+            file_size=stats.get('bytes_parsed') or stats.get('bytes_written') or None,
+            item_counts=stats.get('items', {}),
+            error_count=stats.get('error_count', 0),
         )
         ex_log.save()
+
+
+class ImportJob(models.Model):
+
+    class Status(models.TextChoices):
+        PENDING = 'pending', 'Ожидает'
+        RUNNING = 'running', 'Выполняется'
+        SUCCESS = 'success', 'Успешно'
+        FAILURE = 'failure', 'Ошибка'
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    filename = models.CharField(max_length=200)
+    status = models.CharField(
+        max_length=20, choices=Status.choices, default=Status.PENDING)
+    message = models.TextField(blank=True)
+    # set once the final status has been sent to 1C
+    reported = models.BooleanField(default=False)
+    # position of a time-sliced import to resume from
+    checkpoint = models.JSONField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Import job'
+        verbose_name_plural = 'Import jobs'
+
+    @property
+    def is_finished(self):
+        return self.status in (self.Status.SUCCESS, self.Status.FAILURE)
+
+    @classmethod
+    def get_unreported(cls, user, filename):
+        return (
+            cls.objects
+            .filter(user=user, filename=filename, reported=False)
+            .order_by('-pk')
+            .first()
+        )
+
+    @classmethod
+    def supersede(cls, user, filename=None):
+        """
+        Marks the unreported jobs of the user, of ``filename`` only if it's
+        given, as reported, so a new exchange never gets their status.
+        """
+        jobs = cls.objects.filter(user=user, reported=False)
+        if filename is not None:
+            jobs = jobs.filter(filename=filename)
+        jobs.update(reported=True, updated=timezone.now())
+
+    def set_status(self, status, message=str(), checkpoint=None):
+        self.status = status
+        self.message = message
+        self.checkpoint = checkpoint
+        self.save(update_fields=('status', 'message', 'checkpoint', 'updated'))
+
+    def claim(self, stale_after):
+        """
+        Marks a pending job, or a running one not updated for
+        ``stale_after`` seconds, as running. Returns False if another worker
+        is running it.
+        """
+        stale = timezone.now() - timedelta(seconds=stale_after)
+        return bool(
+            ImportJob.objects
+            .filter(pk=self.pk)
+            .filter(
+                models.Q(status=self.Status.PENDING) |
+                models.Q(status=self.Status.RUNNING, updated__lt=stale)
+            )
+            .update(status=self.Status.RUNNING, updated=timezone.now())
+        )
+
+
+class Fingerprint(models.Model):
+
+    item_class = models.CharField(max_length=50)
+    item_id = models.CharField(max_length=200)
+    digest = models.CharField(max_length=64)
+
+    class Meta:
+        verbose_name = 'Item fingerprint'
+        verbose_name_plural = 'Item fingerprints'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('item_class', 'item_id'), name='cml_fingerprint_unique_item'),
+        )
+
+
+class ExportWatermark(models.Model):
+    """
+    Time up to which the orders were delivered to a 1C user. A sale/query
+    exports the orders changed since ``exported_until``, the time the
+    orders were read at becomes the new watermark once sale/success
+    confirms it.
+    """
+
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, on_delete=models.CASCADE)
+    exported_until = models.DateTimeField(null=True, blank=True)
+    # time of the last unconfirmed sale/query
+    pending = models.DateTimeField(null=True, blank=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Export watermark'
+        verbose_name_plural = 'Export watermarks'
+
+    @classmethod
+    def get_exported_until(cls, user):
+        return cls.objects.filter(user=user).values_list('exported_until', flat=True).first()
+
+    @classmethod
+    def start_export(cls, user, pending=None):
+        """
+        Returns the watermark of the user and remembers ``pending``, the
+        time the exported orders are read at, the current time by default.
+        A repeated query exports the same orders and the ones changed in
+        between.
+        """
+        if pending is None:
+            pending = timezone.now()
+        elif not settings.USE_TZ:
+            pending = timezone.make_naive(pending)
+        watermark, created = cls.objects.update_or_create(
+            user=user, defaults={'pending': pending})
+        return watermark.exported_until
+
+    @classmethod
+    def confirm_export(cls, user):
+        """
+        Advances the watermark of the user to the pending time.
+        """
+        watermark = cls.objects.filter(user=user).first()
+        if watermark is not None and watermark.pending is not None:
+            watermark.exported_until = watermark.pending
+            watermark.pending = None
+            watermark.save(update_fields=('exported_until', 'pending', 'updated'))
+
+
+class StoredImage(models.Model):
+    """
+    Digest of the content of an uploaded image, the image itself is stored
+    under the digest by cml.images.store_image.
+    """
+
+    filename = models.CharField(max_length=255, unique=True)
+    digest = models.CharField(max_length=64)
+    size = models.BigIntegerField(default=0)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = 'Stored image'
+        verbose_name_plural = 'Stored images'
@@ -0,0 +1,141 @@
+from __future__ import absolute_import
+
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from .fingerprints import get_fingerprint
+from .utils.translations import ID
+
+__all__ = (
+    'ParallelParser',
+)
+
+
+def _init_worker():
+    import django
+    django.setup()
+
+
+_backends = {}
+
+
+def parse_chunk(manager_class, plan_name, namespace, backend_class, document, depth,
+                fingerprint):
+    """
+    Parses the item elements of a scanned chunk in a worker process, the
+    children of the element at ``depth`` in ``document``. Returns an
+    ``(id, fingerprint, items)`` tuple per element, with the items in the
+    order the item processor has to receive them. The id and fingerprint
+    are None unless ``fingerprint`` is set.
+    """
+    backend = _backends.get(backend_class)
+    if backend is None:
+        backend = _backends[backend_class] = backend_class()
+    compiled_plan = manager_class.plans[plan_name].compile(namespace)
+    id_tag = '{%s}%s' % (namespace, ID) if namespace else ID
+    parent = backend.fromstring(document)
+    for i in range(depth - 1):
+        parent = parent[0]
+    results = []
+    for element in parent:
+        item_id = digest = None
+        if fingerprint:
+            item_id = (element.findtext(id_tag) or str()).strip()
+            digest = get_fingerprint(element)
+        items = []
+        compiled_plan.parse(element, items.append)
+        results.append((item_id, digest, items))
+    return results
+
+
+class ParallelParser(object):
+    """
+    Parses chunks of item elements found by the ElementScanner in a pool of
+    ``workers`` processes and passes the resulting items to
+    ``process_item`` in the parent process, in document order unless
+    ``ordered`` is False. The parent process only scans the document, the
+    workers parse the raw chunks and compute the fingerprints of their
+    elements, which are checked in the parent. Items are parsed without
+    their xml elements.
+    """
+
+    def __init__(self, manager, workers, ordered=True):
+        self.manager = manager
+        self.workers = workers
+        self.ordered = ordered
+        self._executor = None
+        self._plan_names = {}
+        self._pending = deque()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            for future in self._pending:
+                future.cancel()
+            self._pending.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def add(self, plan_name, document, depth):
+        """
+        Submits the item elements which are the children of the element at
+        ``depth`` in ``document``.
+        """
+        if self._executor is None:
+            # started on first use, documents without items need no pool
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers, initializer=_init_worker)
+        # bounded number of chunks in flight keeps the parent memory flat
+        while len(self._pending) >= 2 * self.workers:
+            self._collect(block=True)
+        manager = self.manager
+        item_class_name = manager.plans[plan_name].item_class.__name__
+        fingerprint = (manager.fingerprints is not None
+                       and manager.fingerprints.is_fingerprinted(item_class_name))
+        future = self._executor.submit(
+            parse_chunk, type(manager), plan_name, manager.namespace,
+            type(manager.backend), document, depth, fingerprint)
+        self._plan_names[future] = plan_name
+        self._pending.append(future)
+        self._collect(block=False)
+
+    def _collect(self, block):
+        if self.ordered:
+            while self._pending and (block or self._pending[0].done()):
+                self._process(self._pending.popleft())
+                block = False
+            return
+        done, not_done = wait(
+            self._pending, timeout=None if block else 0,
+            return_when=FIRST_COMPLETED)
+        self._pending = deque(not_done)
+        for future in done:
+            self._process(future)
+
+    def _process(self, future):
+        manager = self.manager
+        plan_name = self._plan_names.pop(future)
+        item_class_name = manager.plans[plan_name].item_class.__name__
+        process_item = manager._process_item
+        for item_id, digest, items in future.result():
+            if item_id:
+                extra = ()
+                if item_class_name == 'Product':
+                    extra = manager._get_image_digests(next(
+                        (item.image_filename for item in items
+                         if type(item).__name__ == 'Product'), None))
+                if not manager.fingerprints.is_digest_changed(
+                        item_class_name, item_id, digest, extra):
+                    continue
+            for item in items:
+                process_item(item)
+
+    def drain(self):
+        """
+        Waits for all the chunks and processes their items.
+        """
+        while self._pending:
+            self._collect(block=True)
@@ -0,0 +1,380 @@
+from __future__ import absolute_import
+
+from django.apps import apps
+from django.db import connections
+
+from .idmap import get_entity
+
+__all__ = (
+    'BulkModelPipeline',
+    'GroupModelPipeline',
+    'PropertyModelPipeline',
+    'ProductModelPipeline',
+    'OfferModelPipeline',
+    'PriceModelPipeline',
+)
+
+
+class BulkModelPipeline(object):
+    """
+    Import pipeline writing items to ``model`` with a few bulk queries per
+    batch instead of a query per item. Rows are matched on ``id_fields``,
+    the model fields holding the 1C id, which have to be unique together.
+    ``fields`` maps model fields to item attributes.
+
+    Subclass it in the project pipelines module:
+
+        class ProductPipeline(ProductModelPipeline):
+            model = Product
+    """
+
+    model = None
+    id_fields = ('cml_id', )
+    fields = {}
+    # upsert with INSERT ... ON CONFLICT where the database supports it
+    upsert = True
+    # delete the rows of the items removed from a full exchange
+    delete_removed = False
+    # rows per query
+    batch_size = 500
+    # cml.idmap.IdMap set by the item processor, shares the pk mappings of
+    # models matched on a single id field with the other pipelines
+    id_map = None
+
+    def __init__(self):
+        self._pks = None
+        self._related_pks = {}
+
+    def get_queryset(self):
+        return self.model._default_manager.all()
+
+    def get_item_id(self, item):
+        return item.id
+
+    def get_values(self, item):
+        """
+        Returns a dict of model field values for the item, or None to skip
+        it.
+        """
+        return {field: getattr(item, attr) for field, attr in self.fields.items()}
+
+    def get_rows(self, items):
+        for item in items:
+            values = self.get_values(item)
+            if values is not None:
+                yield self.get_item_id(item), values
+
+    def process_batch(self, items):
+        self.save(self.get_rows(items))
+
+    def process_removed(self, item_ids):
+        if not self.delete_removed:
+            return
+        item_ids = list(item_ids)
+        for i in range(0, len(item_ids), self.batch_size):
+            chunk = item_ids[i:i + self.batch_size]
+            _, counts = (
+                self.get_queryset().filter(**{f'{self.id_fields[0]}__in': chunk}).delete())
+            self._discard_pks(chunk)
+            self._forget_deleted(counts)
+
+    def _forget_deleted(self, counts):
+        """
+        Drops the pk mappings of the models rows were deleted from,
+        ``counts`` of QuerySet.delete(), as a cascade may have deleted
+        rows of any of them.
+        """
+        models = {apps.get_model(label) for label, count in counts.items() if count}
+        for model in models:
+            if self.id_map is not None:
+                self.id_map.invalidate(model)
+            if model is self.model:
+                self._pks = None
+        for key in list(self._related_pks):
+            if key[0] in models:
+                del self._related_pks[key]
+
+    def _split_key(self, key):
+        return key if len(self.id_fields) > 1 else (key, )
+
+    def _make_key(self, row):
+        return tuple(row) if len(self.id_fields) > 1 else row[0]
+
+    def _uses_id_map(self):
+        return self.id_map is not None and len(self.id_fields) == 1
+
+    def get_pk_map(self):
+        """
+        Returns a dict of 1C id (a tuple for several ``id_fields``) -> pk of
+        the stored rows, loaded with a single query on first use.
+        """
+        if self._uses_id_map():
+            return self.id_map.preload(
+                get_entity(self.model, self.id_fields[0]), self.get_queryset(), self.id_fields[0])
+        if self._pks is None:
+            self._pks = {
+                self._make_key(row[:-1]): row[-1]
+                for row in self.get_queryset().values_list(*self.id_fields, 'pk').iterator()
+            }
+        return self._pks
+
+    def get_pk(self, item_id):
+        return self.get_pk_map().get(item_id)
+
+    def _get_loaded_pks(self):
+        # the mappings known so far, without loading the whole map
+        if self._uses_id_map():
+            return self.id_map.get_map(get_entity(self.model, self.id_fields[0]))
+        return self._pks or {}
+
+    def _update_pks(self, pks):
+        if self._uses_id_map():
+            self.id_map.update(get_entity(self.model, self.id_fields[0]), pks)
+        else:
+            self.get_pk_map().update(pks)
+
+    def _discard_pks(self, keys):
+        if self._uses_id_map():
+            self.id_map.discard(get_entity(self.model, self.id_fields[0]), keys)
+        else:
+            pks = self.get_pk_map()
+            for key in keys:
+                pks.pop(key, None)
+
+    def _load_pks(self, keys):
+        keys = set(keys)
+        found = {}
+        first_values = list({self._split_key(key)[0] for key in keys})
+        for i in range(0, len(first_values), self.batch_size):
+            rows = (
+                self.get_queryset()
+                .filter(**{f'{self.id_fields[0]}__in': first_values[i:i + self.batch_size]})
+                .values_list(*self.id_fields, 'pk')
+            )
+            for row in rows:
+                key = self._make_key(row[:-1])
+                if key in keys:
+                    found[key] = row[-1]
+        self._update_pks(found)
+
+    def resolve(self, model, id_field, item_ids):
+        """
+        Returns a dict of 1C id -> pk of the ``model`` rows referenced by
+        ``item_ids``, e.g. to fill foreign keys. Known ids are cached.
+        """
+        if self.id_map is not None:
+            return self.id_map.resolve(get_entity(model, id_field),
+                                       model._default_manager.all(), id_field, item_ids)
+        pks = self._related_pks.setdefault((model, id_field), {})
+        missing = list({item_id for item_id in item_ids if item_id and item_id not in pks})
+        for i in range(0, len(missing), self.batch_size):
+            pks.update(
+                model._default_manager
+                .filter(**{f'{id_field}__in': missing[i:i + self.batch_size]})
+                .values_list(id_field, 'pk')
+            )
+        return pks
+
+    def can_upsert(self):
+        database = connections[self.get_queryset().db]
+        return self.upsert and database.features.supports_update_conflicts_with_target
+
+    def _get_stale_keys(self, instances):
+        """
+        Returns the keys of the ``instances`` whose mapped pk has no row,
+        the rows deleted outside of the imports.
+        """
+        mapped_pks = [instance.pk for instance in instances.values()]
+        stored = set()
+        for i in range(0, len(mapped_pks), self.batch_size):
+            stored.update(
+                self.model._default_manager
+                .filter(pk__in=mapped_pks[i:i + self.batch_size])
+                .values_list('pk', flat=True)
+            )
+        return [key for key, instance in instances.items() if instance.pk not in stored]
+
+    def save(self, rows):
+        """
+        Creates or updates the rows given as ``(1C id, values)`` pairs, the
+        last values of a repeated id win.
+        """
+        rows = dict(rows)
+        if not rows:
+            return
+        update_fields = [
+            field for field in next(iter(rows.values()))
+            if field not in self.id_fields
+        ]
+        instances = {}
+        for key, values in rows.items():
+            values = dict(values)
+            values.update(zip(self.id_fields, self._split_key(key)))
+            instances[key] = self.model(**values)
+        manager = self.model._default_manager
+
+        if self.can_upsert():
+            if update_fields:
+                options = dict(update_conflicts=True, unique_fields=self.id_fields,
+                               update_fields=update_fields)
+            else:
+                options = dict(ignore_conflicts=True)
+            manager.bulk_create(list(instances.values()), batch_size=self.batch_size,
+                                **options)
+            pks = self._get_loaded_pks()
+        else:
+            pks = self.get_pk_map()
+            new_instances = []
+            existing_instances = {}
+            for key, instance in instances.items():
+                if key in pks:
+                    instance.pk = pks[key]
+                    existing_instances[key] = instance
+                else:
+                    new_instances.append(instance)
+            updated = 0
+            if existing_instances and update_fields:
+                updated = manager.bulk_update(list(existing_instances.values()), update_fields,
+                                              batch_size=self.batch_size)
+            if updated < len(existing_instances):
+                stale = self._get_stale_keys(existing_instances)
+                self._discard_pks(stale)
+                for key in stale:
+                    instance = existing_instances[key]
+                    instance.pk = None
+                    new_instances.append(instance)
+            manager.bulk_create(new_instances, batch_size=self.batch_size)
+
+        missing = []
+        created = {}
+        for key, instance in instances.items():
+            if instance.pk is not None:
+                created[key] = instance.pk
+            elif key not in pks:
+                missing.append(key)
+        self._update_pks(created)
+        if missing:
+            self._load_pks(missing)
+
+
+class GroupModelPipeline(BulkModelPipeline):
+    """
+    Saves the nested groups too, level by level. ``parent_field`` is the
+    attname of the foreign key to the parent group, e.g. ``'parent_id'``.
+    """
+
+    fields = {'name': 'name'}
+    parent_field = None
+
+    def process_batch(self, items):
+        parent_ids = {}
+        while items:
+            rows = []
+            for item in items:
+                values = self.get_values(item)
+                if values is None:
+                    continue
+                if self.parent_field:
+                    values[self.parent_field] = self.get_pk(parent_ids.get(item.id))
+                rows.append((self.get_item_id(item), values))
+            self.save(rows)
+            children = []
+            for item in items:
+                for child in item.groups:
+                    parent_ids[child.id] = item.id
+                    children.append(child)
+            items = children
+
+
+class PropertyModelPipeline(BulkModelPipeline):
+
+    fields = {'name': 'name'}
+
+
+class ProductModelPipeline(BulkModelPipeline):
+    """
+    ``group_field`` is the attname of a foreign key to ``group_model``
+    set to the first group of the product.
+    """
+
+    fields = {'name': 'name'}
+    group_field = None
+    group_model = None
+    group_id_field = 'cml_id'
+
+    def get_rows(self, items):
+        if self.group_field:
+            group_pks = self.resolve(
+                self.group_model, self.group_id_field,
+                [item.group_ids[0] for item in items if item.group_ids])
+        for item in items:
+            values = self.get_values(item)
+            if values is None:
+                continue
+            if self.group_field:
+                values[self.group_field] = group_pks.get(
+                    item.group_ids[0] if item.group_ids else None)
+            yield self.get_item_id(item), values
+
+
+class OfferModelPipeline(BulkModelPipeline):
+    """
+    ``product_field`` is the attname of a foreign key to ``product_model``,
+    found by the part of the offer id before ``#``. Prices are passed to
+    ``price_pipeline_class`` once the offers are saved.
+    """
+
+    fields = {'name': 'name', 'quantity': 'quantity'}
+    product_field = None
+    product_model = None
+    product_id_field = 'cml_id'
+    price_pipeline_class = None
+
+    def __init__(self):
+        super(OfferModelPipeline, self).__init__()
+        self.price_pipeline = None
+        if self.price_pipeline_class is not None:
+            self.price_pipeline = self.price_pipeline_class(self)
+
+    @staticmethod
+    def get_product_id(item):
+        return item.id.partition('#')[0]
+
+    def get_rows(self, items):
+        if self.product_field:
+            product_pks = self.resolve(
+                self.product_model, self.product_id_field,
+                [self.get_product_id(item) for item in items])
+        for item_id, values in super(OfferModelPipeline, self).get_rows(items):
+            if self.product_field:
+                values[self.product_field] = product_pks.get(item_id.partition('#')[0])
+            yield item_id, values
+
+    def process_batch(self, items):
+        super(OfferModelPipeline, self).process_batch(items)
+        if self.price_pipeline is not None:
+            self.price_pipeline.process_batch(items)
+
+
+class PriceModelPipeline(BulkModelPipeline):
+    """
+    Saves the prices of the offers saved by ``offer_pipeline``, a row per
+    offer and price type.
+    """
+
+    id_fields = ('offer_id', 'price_type_id')
+    fields = {'price': 'price_for_sku', 'currency': 'currency_name'}
+
+    def __init__(self, offer_pipeline):
+        super(PriceModelPipeline, self).__init__()
+        self.offer_pipeline = offer_pipeline
+
+    def get_rows(self, items):
+        for offer in items:
+            offer_pk = self.offer_pipeline.get_pk(self.offer_pipeline.get_item_id(offer))
+            if offer_pk is None:
+                continue
+            for price in offer.prices:
+                values = self.get_values(price)
+                if values is not None:
+                    yield (offer_pk, price.price_type_id), values
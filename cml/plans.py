@@ -0,0 +1,569 @@
+from __future__ import absolute_import
+
+import math
+import os
+from decimal import Decimal, InvalidOperation
+from operator import attrgetter
+
+from .conf import settings
+from .items import *
+from .utils.translations import *
+
+__all__ = (
+    'SELF',
+    'EMIT_BEFORE',
+    'EMIT_AFTER',
+    'get_text',
+    'get_bool',
+    'get_decimal',
+    'get_attribute',
+    'get_basename',
+    'Field',
+    'SubItem',
+    'ExtractionPlan',
+    'CompiledPlan',
+    'GROUP_PLAN',
+    'PROPERTY_VARIANT_PLAN',
+    'PROPERTY_PLAN',
+    'UNIT_OF_MEASUREMENT_PLAN',
+    'SKU_PLAN',
+    'TAX_PLAN',
+    'ADDITIONAL_FIELD_PLAN',
+    'PRODUCT_PLAN',
+    'PRICE_TYPE_PLAN',
+    'PRICE_PLAN',
+    'OFFER_PLAN',
+    'ORDER_ITEM_PLAN',
+    'ORDER_PLAN',
+    'get_offer_price_parser',
+    'get_price_matrix_parser',
+)
+
+# path of a field read from the element itself
+ELEMENT = '.'
+# path segment matching any child element
+WILDCARD = '*'
+# plan reference to the plan being declared, for recursive structures
+SELF = 'self'
+
+# when a sub item is passed to the item processor relative to its parent
+EMIT_BEFORE = 'before'
+EMIT_AFTER = 'after'
+
+
+def get_text(element):
+    text = element.text
+    if text is None:
+        return str()
+    return text.strip()
+
+
+def get_bool(element):
+    return get_text(element).lower() == TRUE.lower()
+
+
+def _to_decimal(text):
+    try:
+        return Decimal(text.strip())
+    except (AttributeError, InvalidOperation):
+        return Decimal()
+
+
+def get_decimal(element):
+    return _to_decimal(element.text)
+
+
+def get_attribute(name):
+    def converter(element):
+        return element.get(name)
+    return converter
+
+
+def get_basename(element):
+    return os.path.basename(get_text(element))
+
+
+def _make_setter(attr):
+    *parents, name = attr.split('.')
+    if not parents:
+        return lambda item, value: setattr(item, name, value)
+    get_parent = attrgetter('.'.join(parents))
+    return lambda item, value: setattr(get_parent(item), name, value)
+
+
+def _make_appender(attr):
+    get_list = attrgetter(attr)
+    return lambda item, value: get_list(item).append(value)
+
+
+class Field(object):
+    """
+    Reads a value from the child element at ``path`` (relative to the item
+    element, ``'.'`` for the element itself) and stores it on ``attr``.
+    Dotted attributes are set on nested objects, ``many`` fields are
+    appended to a list attribute, skipping ``None`` values. Other fields
+    keep the value of the first matching element.
+    """
+
+    def __init__(self, path, attr, converter=get_text, many=False):
+        self.path = path
+        self.attr = attr
+        self.converter = converter
+        self.many = many
+
+    def compile(self, namespace):
+        converter = self.converter
+        store = (_make_appender if self.many else _make_setter)(self.attr)
+        if self.many:
+            def handler(item, element, state):
+                value = converter(element)
+                if value is not None:
+                    store(item, value)
+        else:
+            def handler(item, element, state):
+                if state.fill(self, item):
+                    store(item, converter(element))
+        return handler
+
+
+class SubItem(object):
+    """
+    Builds a nested item from the child element at ``path`` with its own
+    ``plan``. ``getter`` picks what is stored on the parent ``attr`` (the sub
+    item itself by default), ``emit`` makes the item processor receive the sub
+    item before or after its parent and ``link`` is called with the parent
+    and the sub item once the parent is complete. ``condition`` is called
+    with the parent and the child element and skips the elements it
+    rejects. Without ``many`` the ``attr`` is read from the first accepted
+    element.
+    """
+
+    def __init__(self, path, plan, attr=None, getter=None, many=False,
+                 emit=None, link=None, condition=None):
+        self.path = path
+        self.plan = plan
+        self.attr = attr
+        self.getter = getter
+        self.many = many
+        self.emit = emit
+        self.link = link
+        self.condition = condition
+
+    def compile(self, namespace, parent_plan):
+        plan = parent_plan if self.plan == SELF else self.plan
+        compiled_plan = plan.compile(namespace)
+        getter = self.getter
+        store = None
+        if self.attr is not None:
+            store = (_make_appender if self.many else _make_setter)(self.attr)
+        track = self.emit is not None or self.link is not None
+        condition = self.condition
+        # a single valued attribute takes the first accepted element
+        single = store is not None and not self.many
+
+        def handler(item, element, state):
+            if condition is not None and not condition(item, element):
+                return
+            if single and not state.fill(self, item):
+                return
+            sub_item = compiled_plan.extract(element, state)
+            if track:
+                state.sub_items.append((self, item, sub_item))
+            if store is not None:
+                value = sub_item if getter is None else getter(sub_item)
+                if value is not None or not self.many:
+                    store(item, value)
+        return handler
+
+
+class _ExtractionState(object):
+    __slots__ = ('sub_items', 'keep_element', 'filled')
+
+    def __init__(self, keep_element):
+        self.sub_items = []
+        self.keep_element = keep_element
+        self.filled = set()
+
+    def fill(self, field, item):
+        # single valued fields are read from the first matching element only
+        key = (field, item)
+        if key in self.filled:
+            return False
+        self.filled.add(key)
+        return True
+
+
+class _Node(object):
+    __slots__ = ('handlers', 'children', 'wildcard')
+
+    def __init__(self):
+        self.handlers = []
+        self.children = {}
+        self.wildcard = None
+
+    def get_child(self, tag):
+        if tag == WILDCARD:
+            if self.wildcard is None:
+                self.wildcard = _Node()
+            return self.wildcard
+        return self.children.setdefault(tag, _Node())
+
+
+class ExtractionPlan(object):
+    """
+    Declarative mapping of the child elements of an item element onto the
+    attributes of ``item_class``. The plan is compiled once per namespace
+    into a dispatcher which reads every item element in a single pass over
+    its children. ``finalize`` is called with the item once all fields are
+    read.
+    """
+
+    def __init__(self, item_class, fields, finalize=None):
+        self.item_class = item_class
+        self.fields = tuple(fields)
+        self.finalize = finalize
+        self._compiled = {}
+
+    def extend(self, *fields, finalize=None):
+        return ExtractionPlan(
+            self.item_class, self.fields + fields,
+            finalize=finalize or self.finalize,
+        )
+
+    def compile(self, namespace=None):
+        if namespace is None:
+            namespace = settings.CML_DOC_XMLNS
+        compiled = self._compiled.get(namespace)
+        if compiled is None:
+            # registered before the fields are compiled, so recursive plans
+            # get the same compiled instance
+            compiled = self._compiled[namespace] = CompiledPlan(self)
+            compiled.build(namespace)
+        return compiled
+
+
+class CompiledPlan(object):
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.item_class = plan.item_class
+        self.finalize = plan.finalize
+        self.root = _Node()
+
+    @staticmethod
+    def _qualify(tag, namespace):
+        if tag == WILDCARD or not namespace:
+            return tag
+        return '{%s}%s' % (namespace, tag)
+
+    def build(self, namespace):
+        for field in self.plan.fields:
+            if isinstance(field, SubItem):
+                handler = field.compile(namespace, self.plan)
+            else:
+                handler = field.compile(namespace)
+            node = self.root
+            if field.path != ELEMENT:
+                for tag in field.path.split('/'):
+                    node = node.get_child(self._qualify(tag, namespace))
+            node.handlers.append(handler)
+
+    def extract(self, element, state):
+        item = self.item_class(element if state.keep_element else None)
+        for handler in self.root.handlers:
+            handler(item, element, state)
+        self._walk(self.root, element, item, state)
+        if self.finalize is not None:
+            self.finalize(item)
+        return item
+
+    def _walk(self, node, element, item, state):
+        children = node.children
+        wildcard = node.wildcard
+        for child in element:
+            child_node = children.get(child.tag, wildcard)
+            if child_node is None:
+                continue
+            for handler in child_node.handlers:
+                handler(item, child, state)
+            if child_node.children or child_node.wildcard is not None:
+                self._walk(child_node, child, item, state)
+
+    def parse(self, element, process_item, keep_element=False):
+        """
+        Extracts the item from ``element`` and passes it to ``process_item``
+        together with its emitted sub items. Items keep a reference to their
+        element only with ``keep_element``.
+        """
+        state = _ExtractionState(keep_element)
+        item = self.extract(element, state)
+        after = []
+        for field, parent, sub_item in state.sub_items:
+            if field.link is not None:
+                field.link(parent, sub_item)
+            if field.emit == EMIT_BEFORE:
+                process_item(sub_item)
+            elif field.emit == EMIT_AFTER:
+                after.append(sub_item)
+        process_item(item)
+        for sub_item in after:
+            process_item(sub_item)
+        return item
+
+
+class _PropertyValue(object):
+    __slots__ = ('id', 'value')
+
+    def __init__(self, xml_element=None):
+        self.id = str()
+        self.value = str()
+
+
+def _get_property_value(value):
+    if value.value:
+        return value.id, value.value
+    return None
+
+
+def _link_property_variant(property_item, variant):
+    variant.property_id = property_item.id
+
+
+def _is_property_variant(property_item, element):
+    # the variants are the elements named after the value type of the property
+    return element.tag.rpartition('}')[2] == property_item.value_type
+
+
+def _set_image_path(product_item):
+    if product_item.image_filename:
+        product_item.image_path = os.path.join(
+            settings.MEDIA_ROOT, product_item.image_filename)
+
+
+GROUP_PLAN = ExtractionPlan(Group, (
+    Field(ID, 'id'),
+    Field(TITLE, 'name'),
+    SubItem(f'{GROUPS}/{GROUP}', SELF, attr='groups', many=True),
+))
+
+PROPERTY_VARIANT_PLAN = ExtractionPlan(PropertyVariant, (
+    Field(VALUE_ID, 'id'),
+    Field(VALUE, 'value'),
+))
+
+PROPERTY_PLAN = ExtractionPlan(Property, (
+    Field(ID, 'id'),
+    Field(TITLE, 'name'),
+    Field(VALUE_TYPE, 'value_type'),
+    Field(FOR_GOODS, 'for_products', get_bool),
+    SubItem(f'{VARIATIONS_REFERENCES}/{WILDCARD}', PROPERTY_VARIANT_PLAN,
+            emit=EMIT_AFTER, link=_link_property_variant,
+            condition=_is_property_variant),
+))
+
+UNIT_OF_MEASUREMENT_PLAN = ExtractionPlan(UnitOfMeasurementItem, (
+    Field(CODE, 'code'),
+    Field(TITLE_FULL, 'title_full'),
+    Field(INTERNATIONAL_TITLE_SHORT, 'intern_title_short'),
+))
+
+SKU_PLAN = ExtractionPlan(Sku, (
+    Field(ELEMENT, 'id', get_attribute(CODE)),
+    Field(ELEMENT, 'name_full', get_attribute(TITLE_FULL)),
+    Field(ELEMENT, 'international_abbr', get_attribute(INTERNATIONAL_ABBR)),
+    Field(ELEMENT, 'name'),
+))
+
+TAX_PLAN = ExtractionPlan(Tax, (
+    Field(TITLE, 'name'),
+    Field(BET, 'value', get_decimal),
+))
+
+ADDITIONAL_FIELD_PLAN = ExtractionPlan(AdditionalField, (
+    Field(TITLE, 'name'),
+    Field(VALUE, 'value'),
+))
+
+PROPERTY_VALUE_PLAN = ExtractionPlan(_PropertyValue, (
+    Field(ID, 'id'),
+    Field(VALUE, 'value'),
+))
+
+PRODUCT_PLAN = ExtractionPlan(Product, (
+    Field(ID, 'id'),
+    Field(TITLE, 'name'),
+    Field(ITEM_NUMBER, 'item_number'),
+    SubItem(BASIC_UNIT, SKU_PLAN, attr='sku_id', getter=attrgetter('id'),
+            emit=EMIT_BEFORE),
+    Field(IMAGE, 'image_filename', get_basename),
+    Field(f'{GROUPS}/{ID}', 'group_ids', many=True),
+    SubItem(f'{PROPERTIES_VALUES}/{PROPERTY_VALUES}', PROPERTY_VALUE_PLAN,
+            attr='properties', getter=_get_property_value, many=True),
+    SubItem(f'{TAX_RATES}/{TAX_RATE}', TAX_PLAN, attr='tax_name',
+            getter=attrgetter('name'), emit=EMIT_BEFORE),
+    SubItem(f'{THE_VALUES_OF_THE_DETAILS}/{THE_VALUE_OF_THE_PROPS}',
+            ADDITIONAL_FIELD_PLAN, attr='additional_fields', many=True),
+), finalize=_set_image_path)
+
+PRICE_TYPE_PLAN = ExtractionPlan(PriceType, (
+    Field(ID, 'id'),
+    Field(TITLE, 'name'),
+    Field(CURRENCY, 'currency'),
+    Field(f'{TAX}/{TITLE}', 'tax_name'),
+    Field(f'{TAX}/{TAKEN_INTO_ACCOUNT_IN_THE_AMOUNT}', 'tax_in_sum', get_bool),
+))
+
+PRICE_PLAN = ExtractionPlan(Price, (
+    Field(PERFORMANCE, 'representation'),
+    Field(PRICE_TYPE_ID, 'price_type_id'),
+    Field(PRICE_PER_UNIT, 'price_for_sku', get_decimal),
+    Field(CURRENCY, 'currency_name'),
+    Field(UNIT, 'sku_name'),
+    Field(RATIO, 'sku_ratio', get_decimal),
+))
+
+OFFER_PLAN = ExtractionPlan(Offer, (
+    Field(ID, 'id'),
+    Field(TITLE, 'name'),
+    Field(QUANTITY, 'quantity'),
+    SubItem(BASIC_UNIT, SKU_PLAN, attr='sku_id', getter=attrgetter('id'),
+            emit=EMIT_BEFORE),
+    SubItem(f'{PRICES}/{PRICE}', PRICE_PLAN, attr='prices', many=True),
+))
+
+ORDER_ITEM_PLAN = ExtractionPlan(OrderItem, (
+    Field(ID, 'id'),
+    Field(TITLE, 'name'),
+    SubItem(BASIC_UNIT, SKU_PLAN, attr='sku'),
+    Field(PRICE_PER_UNIT, 'price'),
+    Field(QUANTITY, 'quant'),
+    Field(AMOUNT, 'sum'),
+))
+
+ORDER_PLAN = ExtractionPlan(Order, (
+    Field(ID, 'id'),
+    Field(NUMBER, 'number'),
+    Field(DATE, 'date'),
+    Field(CURRENCY, 'currency_name'),
+    Field(EXCHANGE_RATE, 'currency_rate'),
+    Field(HOUSEHOLD_OPERATION, 'operation'),
+    Field(ROLE, 'role'),
+    Field(AMOUNT, 'sum'),
+    Field(f'{COUNTERPARTIES}/{COUNTERPARTY}/{ID}', 'client.id'),
+    Field(f'{COUNTERPARTIES}/{COUNTERPARTY}/{TITLE}', 'client.name'),
+    Field(f'{COUNTERPARTIES}/{COUNTERPARTY}/{FULL_NAME}', 'client.full_name'),
+    Field(TIME, 'time'),
+    Field(COMMENT, 'comment'),
+    SubItem(f'{PRODUCTS}/{PRODUCT}', ORDER_ITEM_PLAN, attr='items', many=True),
+    SubItem(f'{THE_VALUES_OF_THE_DETAILS}/{THE_VALUE_OF_THE_PROPS}',
+            ADDITIONAL_FIELD_PLAN, attr='additional_fields', many=True),
+))
+
+_offer_price_parsers = {}
+
+
+def get_offer_price_parser(namespace=None):
+    """
+    Returns a function reading an OfferPrice from an offer element in a
+    single pass over its children, without building the Offer, Sku and
+    Price items. Stock is read from both the ``<Склад ИдСклада=""
+    КоличествоНаСкладе=""/>`` elements and the ``Остатки`` section.
+    """
+    if namespace is None:
+        namespace = settings.CML_DOC_XMLNS
+    parser = _offer_price_parsers.get(namespace)
+    if parser is not None:
+        return parser
+
+    def qualify(tag):
+        return CompiledPlan._qualify(tag, namespace)
+
+    id_tag = qualify(ID)
+    quantity_tag = qualify(QUANTITY)
+    prices_tag = qualify(PRICES)
+    price_tag = qualify(PRICE)
+    price_type_id_tag = qualify(PRICE_TYPE_ID)
+    price_per_unit_tag = qualify(PRICE_PER_UNIT)
+    warehouse_tag = qualify(WAREHOUSE)
+    remains_tag = qualify(REMAINS)
+    remain_tag = qualify(REMAIN)
+
+    def parse(element):
+        item_id = str()
+        quantity = Decimal()
+        stocks = []
+        prices = {}
+        for child in element:
+            tag = child.tag
+            if tag == id_tag:
+                item_id = get_text(child)
+            elif tag == quantity_tag:
+                quantity = get_decimal(child)
+            elif tag == prices_tag:
+                for price in child:
+                    if price.tag == price_tag:
+                        prices[price.findtext(price_type_id_tag, str()).strip()] = (
+                            _to_decimal(price.findtext(price_per_unit_tag)))
+            elif tag == warehouse_tag:
+                stocks.append((child.get(WAREHOUSE_ID),
+                               _to_decimal(child.get(QUANTITY_IN_WAREHOUSE))))
+            elif tag == remains_tag:
+                for remain in child:
+                    if remain.tag != remain_tag:
+                        continue
+                    for warehouse in remain.iterfind(warehouse_tag):
+                        stocks.append((warehouse.findtext(id_tag, str()).strip(),
+                                       _to_decimal(warehouse.findtext(quantity_tag))))
+        return OfferPrice(item_id, quantity, tuple(stocks), prices)
+
+    parser = _offer_price_parsers[namespace] = parse
+    return parser
+
+
+def _to_float(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return float('nan')
+
+
+_price_matrix_parsers = {}
+
+
+def get_price_matrix_parser(namespace=None):
+    """
+    Returns a function adding the quantity and prices of an offer element
+    to a PriceMatrix row, without building any item.
+    """
+    if namespace is None:
+        namespace = settings.CML_DOC_XMLNS
+    parser = _price_matrix_parsers.get(namespace)
+    if parser is not None:
+        return parser
+
+    def qualify(tag):
+        return CompiledPlan._qualify(tag, namespace)
+
+    id_tag = qualify(ID)
+    quantity_tag = qualify(QUANTITY)
+    price_path = f'{qualify(PRICES)}/{qualify(PRICE)}'
+    price_type_id_tag = qualify(PRICE_TYPE_ID)
+    price_per_unit_tag = qualify(PRICE_PER_UNIT)
+    ratio_tag = qualify(RATIO)
+    currency_tag = qualify(CURRENCY)
+
+    def parse(element, matrix):
+        quantity = _to_float(element.findtext(quantity_tag))
+        row = matrix.add_offer(element.findtext(id_tag, str()).strip(),
+                               0.0 if math.isnan(quantity) else quantity)
+        for price in element.iterfind(price_path):
+            ratio = price.findtext(ratio_tag)
+            matrix.set_price(
+                row, price.findtext(price_type_id_tag, str()).strip(),
+                _to_float(price.findtext(price_per_unit_tag)),
+                1.0 if ratio is None else _to_float(ratio),
+                price.findtext(currency_tag))
+        return row
+
+    parser = _price_matrix_parsers[namespace] = parse
+    return parser
@@ -0,0 +1,362 @@
+from __future__ import absolute_import
+
+import codecs
+import re
+
+__all__ = (
+    'ScanError',
+    'UnsupportedDocument',
+    'ElementScanner',
+)
+
+BLOCK_SIZE = 1024 * 1024
+
+_BOM = codecs.BOM_UTF8
+_DECLARATION = re.compile(
+    rb'<\?xml\s(?:[^?]|\?(?!>))*?encoding\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+_START_TAG = re.compile(
+    rb'<([^\s/>!?]+)((?:[^>"\'/]|/(?!>)|"[^"]*"|\'[^\']*\')*)(/?)>')
+_END_TAG = re.compile(rb'</([^\s>]+)\s*>')
+_XMLNS = re.compile(
+    rb'(?:^|\s)xmlns(?::([^\s=]+))?\s*=\s*(?:"([^"]*)"|\'([^\']*)\')')
+# markup the name of an element may appear in without being a tag
+_SKIPPED = {
+    b'!--': b'-->',
+    b'![CDATA[': b']]>',
+    b'?': b'?>',
+}
+_ASCII_MARKUP = '<>/="\'?!-[]: xmlns'
+
+
+class ScanError(SyntaxError):
+    pass
+
+
+class UnsupportedDocument(Exception):
+    """
+    The document can't be scanned as bytes, it has to be parsed.
+    """
+
+
+class ElementScanner(object):
+    """
+    Finds the elements at ``paths`` (tuples of qualified tags below the root
+    element, like the ones of BaseXMLBackend.iterparse) in the bytes of an
+    XML document without parsing them. Only the tags above the elements
+    are tokenized and everything outside of the requested paths is skipped
+    by searching for its end tag, the elements themselves are parsed later
+    in chunks wrapped with wrap().
+
+    Iteration yields ``(event, path, data)``:
+
+    * ``'start'`` and ``'end'`` for the elements above the requested ones,
+      data is the start tag;
+    * ``'items'`` for up to ``chunk_size`` consecutive elements at a path,
+      data is a list of ``(element bytes, document offset of its end)``.
+
+    A scan resumes from a state returned by get_state(), the document
+    offset to continue from and the start tags of the elements open there.
+    Documents in an encoding which isn't a superset of ASCII or with a
+    doctype raise UnsupportedDocument.
+    """
+
+    def __init__(self, f, paths, chunk_size=500, state=None, block_size=BLOCK_SIZE):
+        self.f = f
+        self.paths = frozenset(paths)
+        self.prefixes = frozenset(
+            path[:i] for path in self.paths for i in range(1, len(path)))
+        self.chunk_size = chunk_size
+        self.block_size = block_size
+        self.encoding = 'utf-8'
+        # start tags of the open elements, from the root one
+        self.stack = []
+        self._names = []
+        self._scopes = []
+        self._paths = []
+        self._buffer = b''
+        # document offset of the buffer start
+        self._base = 0
+        self._eof = False
+        self._pos = 0
+        self._end_patterns = {}
+        if state is None:
+            self._read_prolog()
+        else:
+            self._restore(state)
+
+    @property
+    def path(self):
+        return self._paths[-1] if self._paths else ()
+
+    def get_state(self, offset):
+        """
+        Returns a JSON serializable state to resume from ``offset``, which
+        has to be inside the currently open element.
+        """
+        return {
+            'offset': offset,
+            'stack': [tag.decode(self.encoding) for tag in self.stack],
+            'encoding': self.encoding,
+        }
+
+    def _restore(self, state):
+        self._set_encoding(state['encoding'])
+        self.f.seek(state['offset'])
+        self._base = state['offset']
+        for tag in state['stack']:
+            tag = tag.encode(self.encoding)
+            match = _START_TAG.match(tag)
+            if match is None:
+                raise ScanError(f'Invalid start tag {tag!r}')
+            self._push(tag, match.group(1), self._get_scope(match.group(2)))
+
+    def wrap(self, data, stack=None):
+        """
+        Returns a document with ``data`` inside the ``stack`` start tags,
+        the open elements by default.
+        """
+        if stack is None:
+            stack = self.stack
+        end_tags = [b'</%s>' % _START_TAG.match(tag).group(1) for tag in reversed(stack)]
+        return b''.join([
+            b'<?xml version="1.0" encoding="%s"?>' % self.encoding.encode('ascii'),
+            *stack, data, *end_tags,
+        ])
+
+    def _set_encoding(self, encoding):
+        try:
+            codec = codecs.lookup(encoding)
+            ascii_compatible = (
+                _ASCII_MARKUP.encode(codec.name) == _ASCII_MARKUP.encode('ascii'))
+        except (LookupError, UnicodeError):
+            ascii_compatible = False
+        if not ascii_compatible:
+            raise UnsupportedDocument(f'Encoding {encoding} is not supported')
+        self.encoding = encoding
+
+    def _read_prolog(self):
+        self._read()
+        buffer = self._buffer
+        if buffer.startswith(_BOM):
+            self._pos = len(_BOM)
+        elif b'\x00' in buffer[:4]:
+            raise UnsupportedDocument('UTF-16 and UTF-32 are not supported')
+        if buffer.startswith(b'<?xml', self._pos):
+            # the whole declaration is read before its encoding is looked up
+            self._find(b'?>', self._pos)
+        match = _DECLARATION.match(self._buffer, self._pos)
+        if match is not None:
+            self._set_encoding((match.group(1) or match.group(2)).decode('ascii'))
+        while True:
+            start = self._find(b'<', self._pos)
+            if start == -1:
+                raise ScanError('No root element')
+            self._fill(start + 9)
+            if self._buffer.startswith(b'<!DOCTYPE', start):
+                raise UnsupportedDocument('Doctypes are not supported')
+            end = self._skip_markup(start)
+            if end is None:
+                match = self._match(_START_TAG, start)
+                tag = match.group(0)
+                if match.group(3):
+                    # an empty root element, nothing to scan
+                    self._pos = match.end()
+                    return
+                self._push(tag, match.group(1), self._get_scope(match.group(2)))
+                end = match.end()
+            self._pos = end
+            if self.stack:
+                return
+
+    def __iter__(self):
+        pos = self._pos
+        chunk = []
+        chunk_path = None
+        while self._names:
+            if pos > self.block_size:
+                pos = self._discard(pos)
+            start = self._find(b'<', pos)
+            if start == -1:
+                raise ScanError('Unclosed element %r' % self._names[-1])
+            end = self._skip_markup(start)
+            if end is not None:
+                pos = end
+                continue
+            if self._buffer.startswith(b'</', start):
+                if chunk:
+                    yield 'items', chunk_path, chunk
+                    chunk = []
+                match = self._match(_END_TAG, start)
+                if match.group(1) != self._names[-1]:
+                    raise ScanError('Mismatched end tag %r' % match.group(1))
+                pos = match.end()
+                path = self.path
+                tag = self._pop()
+                if path:
+                    yield 'end', path, tag
+                continue
+
+            match = self._match(_START_TAG, start)
+            name, empty = match.group(1), match.group(3)
+            scope = self._get_scope(match.group(2))
+            path = self.path + (self._qualify(name, scope), )
+            end = match.end()
+            if path in self.paths:
+                if not empty:
+                    end = self._find_end(name, end)
+                if chunk and chunk_path != path:
+                    yield 'items', chunk_path, chunk
+                    chunk = []
+                chunk_path = path
+                chunk.append((self._buffer[start:end], self._base + end))
+                if len(chunk) >= self.chunk_size:
+                    yield 'items', chunk_path, chunk
+                    chunk = []
+            elif path in self.prefixes:
+                if chunk:
+                    yield 'items', chunk_path, chunk
+                    chunk = []
+                tag = match.group(0)
+                if empty:
+                    yield 'start', path, tag
+                    yield 'end', path, tag
+                else:
+                    self._push(tag, name, scope)
+                    yield 'start', path, tag
+            elif not empty:
+                # skipped elements aren't kept in the buffer
+                pos = self._find_end(name, end, keep=False)
+                continue
+            pos = end
+        if chunk:
+            yield 'items', chunk_path, chunk
+
+    def _push(self, tag, name, scope):
+        self._paths.append(
+            self.path + (self._qualify(name, scope), ) if self.stack else ())
+        self.stack.append(tag)
+        self._names.append(name)
+        self._scopes.append(scope)
+
+    def _pop(self):
+        self._paths.pop()
+        self._names.pop()
+        self._scopes.pop()
+        return self.stack.pop()
+
+    def _get_scope(self, attributes):
+        scope = self._scopes[-1] if self._scopes else {}
+        if b'xmlns' not in attributes:
+            return scope
+        scope = dict(scope)
+        for prefix, value, alt_value in _XMLNS.findall(attributes):
+            scope[prefix or None] = (value or alt_value).decode(self.encoding)
+        return scope
+
+    def _qualify(self, name, scope):
+        prefix, _, local_name = name.rpartition(b':')
+        namespace = scope.get(prefix or None)
+        local_name = local_name.decode(self.encoding)
+        if namespace:
+            return '{%s}%s' % (namespace, local_name)
+        if prefix:
+            raise ScanError('Unbound prefix %r' % prefix)
+        return local_name
+
+    def _skip_markup(self, start):
+        """
+        Returns the end of the comment, CDATA section or processing
+        instruction at ``start``, None if there is a tag.
+        """
+        self._fill(start + 9)
+        for opening, closing in _SKIPPED.items():
+            if self._buffer.startswith(opening, start + 1):
+                end = self._find(closing, start + 1 + len(opening))
+                if end == -1:
+                    raise ScanError('Unclosed markup')
+                return end + len(closing)
+        if self._buffer.startswith(b'<!', start):
+            raise ScanError('Unexpected declaration')
+        return None
+
+    def _find_end(self, name, pos, keep=True):
+        """
+        Returns the end of the element ``name`` which content starts at
+        ``pos``. Elements of the same name are counted as there are no
+        other start or end tags it can be closed with. Unless ``keep`` is
+        set the element is dropped from the buffer as it's scanned.
+        """
+        regex = self._end_patterns.get(name)
+        if regex is None:
+            regex = self._end_patterns[name] = re.compile(
+                rb'<(?:(/?)' + re.escape(name) + rb'(?=[\s/>])|(!--|!\[CDATA\[|\?))')
+        depth = 1
+        while True:
+            if not keep and pos > self.block_size:
+                pos = self._discard(pos)
+            match = self._search(regex, pos, overlap=None if keep else len(name) + 3)
+            if match is None:
+                raise ScanError('Unclosed element %r' % name)
+            if match.group(2) is not None:
+                pos = self._skip_markup(match.start())
+            elif match.group(1):
+                end = self._find(b'>', match.end())
+                if end == -1:
+                    raise ScanError('Unclosed element %r' % name)
+                pos = end + 1
+                depth -= 1
+                if depth == 0:
+                    return pos
+            else:
+                match = self._match(_START_TAG, match.start())
+                pos = match.end()
+                if not match.group(3):
+                    depth += 1
+
+    def _read(self):
+        # the buffer grows geometrically, so searches restarted after a
+        # read scan every byte a bounded number of times
+        data = self.f.read(max(self.block_size, len(self._buffer)))
+        if not data:
+            self._eof = True
+            return False
+        self._buffer += data
+        return True
+
+    def _fill(self, end):
+        while len(self._buffer) < end and self._read():
+            pass
+
+    def _discard(self, pos):
+        self._buffer = self._buffer[pos:]
+        self._base += pos
+        return 0
+
+    def _find(self, sub, pos):
+        while True:
+            index = self._buffer.find(sub, pos)
+            if index != -1 or not self._read():
+                return index
+
+    def _search(self, regex, pos, overlap=None):
+        """
+        Returns the first match after ``pos``, with ``overlap``, the
+        length of the longest partial match, the bytes searched already are
+        dropped from the buffer.
+        """
+        while True:
+            match = regex.search(self._buffer, pos)
+            # the lookahead of a match may need the next bytes
+            if match is not None and match.end() < len(self._buffer) or self._eof:
+                return match
+            if match is None and overlap is not None:
+                pos = self._discard(max(pos, len(self._buffer) - overlap))
+            self._read()
+
+    def _match(self, regex, pos):
+        while True:
+            match = regex.match(self._buffer, pos)
+            if match is not None:
+                return match
+            if not self._read():
+                raise ScanError('Invalid tag at offset %d' % (self._base + pos))
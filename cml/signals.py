@@ -0,0 +1,9 @@
+from django.dispatch import Signal
+
+__all__ = (
+    'exchange_finished',
+)
+
+# sent by ImportManager.import_all and ExportManager.get_xml with the
+# ``stats`` keyword argument, an ExchangeStats instance
+exchange_finished = Signal()
@@ -0,0 +1,142 @@
+from __future__ import absolute_import
+
+import logging
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from .signals import exchange_finished
+
+__all__ = (
+    'ExchangeStats',
+    'merge_stats',
+)
+
+logger = logging.getLogger(__name__)
+
+
+class ExchangeStats(object):
+    """
+    Collects the wall time of every phase of an import or export, the items
+    per class, the time spent in every project pipeline method, the errors
+    and the parsed and written bytes. Managers pass it on to their item processor.
+    """
+
+    def __init__(self, exchange_type):
+        self.exchange_type = exchange_type
+        self.started = time.monotonic()
+        self.duration = None
+        self.phases = defaultdict(float)
+        self.items = defaultdict(int)
+        # (pipeline class name, method) -> [calls, seconds]
+        self.pipelines = defaultdict(lambda: [0, 0.0])
+        self.errors = defaultdict(int)
+        self.bytes_parsed = 0
+        self.bytes_written = 0
+
+    @property
+    def error_count(self):
+        return sum(self.errors.values())
+
+    def add_phase_time(self, phase, seconds):
+        self.phases[phase] += seconds
+
+    @contextmanager
+    def phase(self, phase):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_phase_time(phase, time.perf_counter() - start)
+
+    def add_item(self, item_class_name):
+        self.items[item_class_name] += 1
+
+    def add_error(self, source):
+        self.errors[source] += 1
+
+    @contextmanager
+    def pipeline(self, pipeline, method):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_pipeline_time(pipeline, method, time.perf_counter() - start)
+
+    def add_pipeline_time(self, pipeline, method, seconds, calls=1):
+        timing = self.pipelines[(pipeline.__class__.__name__, method)]
+        timing[0] += calls
+        timing[1] += seconds
+
+    def iterate(self, pipeline, method, iterable):
+        """
+        Yields from ``iterable`` counting the time spent in the pipeline
+        generator, not in the caller.
+        """
+        iterator = iter(iterable)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_pipeline_time(pipeline, method, time.perf_counter() - start)
+                return
+            self.add_pipeline_time(pipeline, method, time.perf_counter() - start)
+            yield item
+
+    def as_dict(self):
+        return {
+            'exchange_type': self.exchange_type,
+            'duration': self.duration,
+            'phases': dict(self.phases),
+            'items': dict(self.items),
+            'pipelines': {
+                f'{pipeline}.{method}': {'calls': calls, 'seconds': seconds}
+                for (pipeline, method), (calls, seconds) in self.pipelines.items()
+            },
+            'errors': dict(self.errors),
+            'error_count': self.error_count,
+            'bytes_parsed': self.bytes_parsed,
+            'bytes_written': self.bytes_written,
+        }
+
+    def finish(self, sender, **kwargs):
+        """
+        Ends the exchange, logs the collected stats and sends the
+        exchange_finished signal. ``kwargs`` are added to both.
+        """
+        self.duration = time.monotonic() - self.started
+        record = self.as_dict()
+        record.update(kwargs)
+        logger.info(
+            f'{self.exchange_type.capitalize()} finished in {self.duration:.3f}s, '
+            f'{sum(self.items.values())} items, {self.error_count} errors',
+            extra={'cml_stats': record})
+        exchange_finished.send(sender=sender, stats=self, **kwargs)
+
+
+def merge_stats(first, second):
+    """
+    Adds up two ExchangeStats.as_dict() records, e.g. of the slices of a
+    time-sliced import. Every slice reads the whole file, so the larger
+    sizes are kept.
+    """
+    if not first:
+        return second
+    merged = dict(second)
+    merged['duration'] = (first.get('duration') or 0) + (second.get('duration') or 0)
+    merged['error_count'] = first.get('error_count', 0) + second.get('error_count', 0)
+    for key in ('bytes_parsed', 'bytes_written'):
+        merged[key] = max(first.get(key, 0), second.get(key, 0))
+    for key in ('phases', 'items', 'errors'):
+        values = dict(first.get(key, {}))
+        for name, value in second.get(key, {}).items():
+            values[name] = values.get(name, 0) + value
+        merged[key] = values
+    pipelines = {name: dict(timing) for name, timing in first.get('pipelines', {}).items()}
+    for name, timing in second.get('pipelines', {}).items():
+        merged_timing = pipelines.setdefault(name, {'calls': 0, 'seconds': 0.0})
+        merged_timing['calls'] += timing['calls']
+        merged_timing['seconds'] += timing['seconds']
+    merged['pipelines'] = pipelines
+    return merged
@@ -0,0 +1,155 @@
+from __future__ import absolute_import
+
+import gc
+import os
+import time
+import tracemalloc
+
+from ..managers import ExportManager, ImportManager, ItemProcessor
+from ..matrix import PriceMatrix
+
+__all__ = (
+    'BenchmarkResult',
+    'run_benchmarks',
+)
+
+
+class _CountingItemProcessor(ItemProcessor):
+    """
+    Counts the imported items, passes them to the project pipelines only
+    when ``use_pipelines`` is set so the import itself is measured.
+    """
+
+    def __init__(self, use_pipelines=False):
+        super(_CountingItemProcessor, self).__init__()
+        self.use_pipelines = use_pipelines
+        self.count = 0
+
+    def process_item(self, item):
+        # a row per offer
+        self.count += len(item) if isinstance(item, PriceMatrix) else 1
+        if self.use_pipelines:
+            super(_CountingItemProcessor, self).process_item(item)
+
+
+class _OrdersItemProcessor(ItemProcessor):
+
+    def __init__(self, orders):
+        super(_OrdersItemProcessor, self).__init__()
+        self.orders = orders
+
+    def yield_item(self, item_class, since=None):
+        return iter(self.orders)
+
+
+class BenchmarkResult(object):
+
+    __slots__ = ('name', 'items', 'seconds', 'cpu_seconds', 'peak_memory')
+
+    def __init__(self, name, items, seconds, cpu_seconds, peak_memory):
+        self.name = name
+        self.items = items
+        self.seconds = seconds
+        # of the current process, parse workers aren't counted
+        self.cpu_seconds = cpu_seconds
+        self.peak_memory = peak_memory
+
+    @property
+    def items_per_second(self):
+        return self.items / self.seconds if self.seconds else 0.0
+
+    def __str__(self):
+        return (f'{self.name:<32} {self.items:>10} items {self.seconds:>9.3f} s '
+                f'{self.cpu_seconds:>9.3f} s cpu {self.items_per_second:>12.0f} items/s '
+                f'{self.peak_memory / 1024 / 1024:>9.1f} MiB peak')
+
+
+def _measure(name, run, repeat):
+    """
+    Returns the best time of ``repeat`` runs with its CPU time and the
+    peak memory of one more run traced with tracemalloc, which slows it
+    down too much to be timed. ``run`` returns the number of items.
+    """
+    seconds = cpu_seconds = None
+    for i in range(repeat):
+        gc.collect()
+        start, cpu_start = time.perf_counter(), time.process_time()
+        items = run()
+        elapsed = time.perf_counter() - start
+        if seconds is None or elapsed < seconds:
+            seconds, cpu_seconds = elapsed, time.process_time() - cpu_start
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return BenchmarkResult(name, items, seconds, cpu_seconds, peak_memory)
+
+
+def _import(file_path, method, streaming, use_pipelines, prices_only=False,
+            price_matrix=False, parse_workers=None):
+    def run():
+        manager = ImportManager(file_path, streaming=streaming, prices_only=prices_only,
+                                price_matrix=price_matrix)
+        if parse_workers is not None:
+            manager.parse_workers = parse_workers
+        manager.item_processor = _CountingItemProcessor(use_pipelines)
+        getattr(manager, method)()
+        return manager.item_processor.count
+    return run
+
+
+def _export(orders, get_xml):
+    def run():
+        manager = ExportManager()
+        manager.item_processor = _OrdersItemProcessor(orders)
+        manager.export_all()
+        if get_xml:
+            manager.get_xml()
+        return len(orders)
+    return run
+
+
+def run_benchmarks(generator, directory, streaming=None, repeat=1,
+                   use_pipelines=False, parse_workers=None):
+    """
+    Writes the documents of ``generator`` to ``directory`` and measures
+    import_all and every import phase on them, then export_all and
+    get_xml on its orders. With ``parse_workers`` the catalogue and the
+    offers are parsed in a pool of that many processes too. Returns a
+    list of BenchmarkResult.
+    """
+    import_path = os.path.join(directory, 'import.xml')
+    offers_path = os.path.join(directory, 'offers.xml')
+    orders_path = os.path.join(directory, 'orders.xml')
+    generator.write_import(import_path)
+    generator.write_offers(offers_path)
+    generator.write_orders(orders_path)
+    orders = list(generator.get_orders())
+
+    scenarios = (
+        ('import_all import.xml', _import(import_path, 'import_all', streaming, use_pipelines)),
+        ('import_all offers.xml', _import(offers_path, 'import_all', streaming, use_pipelines)),
+        ('import_classifier', _import(import_path, 'import_classifier', streaming, use_pipelines)),
+        ('import_catalogue', _import(import_path, 'import_catalogue', streaming, use_pipelines)),
+        ('import_offers_pack', _import(offers_path, 'import_offers_pack', streaming, use_pipelines)),
+        ('import_offers_pack prices only', _import(offers_path, 'import_offers_pack', streaming,
+                                                   use_pipelines, prices_only=True)),
+        ('import_offers_pack price matrix', _import(offers_path, 'import_offers_pack', streaming,
+                                                    use_pipelines, price_matrix=True)),
+        ('import_orders', _import(orders_path, 'import_orders', streaming, use_pipelines)),
+        ('export_all', _export(orders, get_xml=False)),
+        ('export_all + get_xml', _export(orders, get_xml=True)),
+    )
+    if parse_workers:
+        scenarios += (
+            (f'import_catalogue {parse_workers} workers', _import(
+                import_path, 'import_catalogue', streaming, use_pipelines,
+                parse_workers=parse_workers)),
+            (f'import_offers_pack {parse_workers} workers', _import(
+                offers_path, 'import_offers_pack', streaming, use_pipelines,
+                parse_workers=parse_workers)),
+        )
+    return [_measure(name, run, repeat) for name, run in scenarios]
@@ -0,0 +1,26 @@
+from __future__ import absolute_import
+
+import os
+import secrets
+
+__all__ = (
+    'make_temp_file',
+)
+
+_FLAGS = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+
+
+def make_temp_file(directory, suffix=str()):
+    """
+    Creates a temporary file in ``directory`` like tempfile.mkstemp(), but
+    with the permissions of files created by open(), 0o666 less the umask,
+    rather than 0o600, so the file can be moved into place for the web
+    server to read. Returns ``(file descriptor, path)``.
+    """
+    while True:
+        path = os.path.join(directory, f'tmp{secrets.token_hex(8)}{suffix}')
+        try:
+            # the mode is masked with the process umask
+            return os.open(path, _FLAGS, 0o666), path
+        except FileExistsError:
+            continue
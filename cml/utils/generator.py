@@ -0,0 +1,343 @@
+from __future__ import absolute_import
+
+import random
+import uuid
+from datetime import datetime, timedelta
+from decimal import Decimal
+from xml.sax.saxutils import XMLGenerator
+
+from ..conf import settings
+from ..items import Client, Order, OrderItem, Sku
+from .translations import *
+
+__all__ = (
+    'CommerceMLGenerator',
+)
+
+SKU_CODE = '796'
+SKU_NAME = 'шт'
+SKU_NAME_FULL = 'Штука'
+SKU_ABBR = 'PCE'
+TAX_NAME = 'НДС'
+DIRECTORY = 'Справочник'
+
+
+class _Writer(object):
+
+    def __init__(self, out, xmlns):
+        self.xml = XMLGenerator(out, encoding='utf-8', short_empty_elements=True)
+        self.xmlns = xmlns
+        self.xml.startDocument()
+
+    def start(self, tag, attrs=None):
+        self.xml.startElement(tag, attrs or {})
+
+    def end(self, tag):
+        self.xml.endElement(tag)
+
+    def text(self, tag, value, attrs=None):
+        self.start(tag, attrs)
+        self.xml.characters(str(value))
+        self.end(tag)
+
+    def start_document(self):
+        attrs = {
+            VERSIONS_OF_THE_SCHEME: settings.CML_DOC_VERSION,
+            DATA_FORMATIONS: '2020-01-01T00:00:00',
+        }
+        if self.xmlns:
+            attrs['xmlns'] = self.xmlns
+        self.start(COMMERCIAL_INFORMATION, attrs)
+
+    def end_document(self):
+        self.end(COMMERCIAL_INFORMATION)
+        self.xml.endDocument()
+
+
+class CommerceMLGenerator(object):
+    """
+    Writes synthetic CommerceML documents of the given size: a classifier
+    and catalogue (import.xml), an offers package (offers.xml) and orders.
+    The same ``seed`` always gives the same documents, offers and orders
+    reference the generated products.
+    """
+
+    def __init__(self, groups=10, depth=2, properties=5, variants=3,
+                 products=1000, offers=None, price_types=2, orders=100,
+                 seed=0, xmlns=None):
+        self.groups = groups
+        self.depth = max(depth, 1)
+        self.properties = properties
+        self.variants = variants
+        self.products = products
+        self.offers = products if offers is None else offers
+        self.price_types = price_types
+        self.orders = orders
+        self.seed = seed
+        self.xmlns = settings.CML_DOC_XMLNS if xmlns is None else xmlns
+        self._namespace = uuid.uuid5(uuid.NAMESPACE_URL, f'django-cml:{seed}')
+
+    def _get_id(self, kind, number):
+        return str(uuid.uuid5(self._namespace, f'{kind}:{number}'))
+
+    def _get_random(self, kind):
+        return random.Random(f'{self.seed}:{kind}')
+
+    def _open(self, target):
+        if hasattr(target, 'write'):
+            return target, False
+        return open(target, 'wb'), True
+
+    def _write(self, target, write_sections):
+        out, close = self._open(target)
+        try:
+            writer = _Writer(out, self.xmlns)
+            writer.start_document()
+            write_sections(writer)
+            writer.end_document()
+        finally:
+            if close:
+                out.close()
+
+    def get_group_tree(self):
+        """
+        Returns a list of ``(group number, parent number or None)`` with
+        at most ``depth`` levels, parents come before their children.
+        """
+        rnd = self._get_random('groups')
+        levels = []
+        tree = []
+        for number in range(self.groups):
+            parents = [n for n, level in enumerate(levels) if level < self.depth - 1]
+            if number == 0 or not parents or rnd.random() < 0.3:
+                parent = None
+            else:
+                parent = rnd.choice(parents)
+            levels.append(0 if parent is None else levels[parent] + 1)
+            tree.append((number, parent))
+        return tree
+
+    def write_import(self, target):
+        """
+        Writes the classifier and the catalogue to a file path or a binary
+        file object.
+        """
+        self._write(target, self._write_import)
+
+    def _write_import(self, writer):
+        writer.start(CLASSIFIER)
+        writer.text(ID, self._get_id('classifier', 0))
+        writer.text(TITLE, 'Classifier')
+        children = {}
+        for number, parent in self.get_group_tree():
+            children.setdefault(parent, []).append(number)
+        self._write_groups(writer, children, None)
+        writer.start(PROPERTIES)
+        for number in range(self.properties):
+            writer.start(PROPERTY)
+            writer.text(ID, self._get_id('property', number))
+            writer.text(TITLE, f'Property {number}')
+            writer.text(VALUE_TYPE, DIRECTORY)
+            writer.start(VARIATIONS_REFERENCES)
+            for variant in range(self.variants):
+                writer.start(DIRECTORY)
+                writer.text(VALUE_ID, self._get_id('variant', f'{number}:{variant}'))
+                writer.text(VALUE, f'Value {number}.{variant}')
+                writer.end(DIRECTORY)
+            writer.end(VARIATIONS_REFERENCES)
+            writer.text(FOR_GOODS, 'true')
+            writer.end(PROPERTY)
+        writer.end(PROPERTIES)
+        writer.end(CLASSIFIER)
+
+        rnd = self._get_random('products')
+        writer.start(CATALOG, {CONTAINS_ONLY_CHANGES: 'false'})
+        writer.text(ID, self._get_id('catalog', 0))
+        writer.text(TITLE, 'Catalog')
+        writer.start(ITEMS)
+        for number in range(self.products):
+            writer.start(ITEM)
+            writer.text(ID, self._get_id('product', number))
+            writer.text(ITEM_NUMBER, f'A-{number:08d}')
+            writer.text(TITLE, f'Product {number}')
+            self._write_sku(writer)
+            if self.groups:
+                writer.start(GROUPS)
+                writer.text(ID, self._get_id('group', rnd.randrange(self.groups)))
+                writer.end(GROUPS)
+            if self.properties:
+                writer.start(PROPERTIES_VALUES)
+                for property_number in range(self.properties):
+                    writer.start(PROPERTY_VALUES)
+                    writer.text(ID, self._get_id('property', property_number))
+                    value = str()
+                    if self.variants:
+                        value = self._get_id(
+                            'variant', f'{property_number}:{rnd.randrange(self.variants)}')
+                    writer.text(VALUE, value)
+                    writer.end(PROPERTY_VALUES)
+                writer.end(PROPERTIES_VALUES)
+            writer.start(TAX_RATES)
+            writer.start(TAX_RATE)
+            writer.text(TITLE, TAX_NAME)
+            writer.text(BET, 20)
+            writer.end(TAX_RATE)
+            writer.end(TAX_RATES)
+            writer.start(THE_VALUES_OF_THE_DETAILS)
+            writer.start(THE_VALUE_OF_THE_PROPS)
+            writer.text(TITLE, FULL_NAME)
+            writer.text(VALUE, f'Product {number} full name')
+            writer.end(THE_VALUE_OF_THE_PROPS)
+            writer.end(THE_VALUES_OF_THE_DETAILS)
+            writer.end(ITEM)
+        writer.end(ITEMS)
+        writer.end(CATALOG)
+
+    def _write_groups(self, writer, children, parent):
+        writer.start(GROUPS)
+        for number in children.get(parent, ()):
+            writer.start(GROUP)
+            writer.text(ID, self._get_id('group', number))
+            writer.text(TITLE, f'Group {number}')
+            if number in children:
+                self._write_groups(writer, children, number)
+            writer.end(GROUP)
+        writer.end(GROUPS)
+
+    def _write_sku(self, writer):
+        writer.text(BASIC_UNIT, SKU_NAME, {
+            CODE: SKU_CODE,
+            TITLE_FULL: SKU_NAME_FULL,
+            INTERNATIONAL_ABBR: SKU_ABBR,
+        })
+
+    def get_offer_id(self, number):
+        product_id = self._get_id('product', number % self.products)
+        if number < self.products:
+            return product_id
+        return f'{product_id}#{self._get_id("characteristic", number)}'
+
+    def write_offers(self, target):
+        """
+        Writes the offers package with prices of every price type.
+        """
+        self._write(target, self._write_offers)
+
+    def _write_offers(self, writer):
+        rnd = self._get_random('offers')
+        writer.start(PACKAGE_OF_OFFERS, {CONTAINS_ONLY_CHANGES: 'false'})
+        writer.text(ID, self._get_id('package', 0))
+        writer.text(TITLE, 'Offers')
+        writer.start(TYPES_OF_PRICES)
+        for number in range(self.price_types):
+            writer.start(PRICE_TYPE)
+            writer.text(ID, self._get_id('price_type', number))
+            writer.text(TITLE, f'Price type {number}')
+            writer.text(CURRENCY, 'RUB')
+            writer.start(TAX)
+            writer.text(TITLE, TAX_NAME)
+            writer.text(TAKEN_INTO_ACCOUNT_IN_THE_AMOUNT, 'true')
+            writer.end(TAX)
+            writer.end(PRICE_TYPE)
+        writer.end(TYPES_OF_PRICES)
+        writer.start(OFFERS)
+        for number in range(self.offers if self.products else 0):
+            writer.start(OFFER)
+            writer.text(ID, self.get_offer_id(number))
+            writer.text(TITLE, f'Offer {number}')
+            self._write_sku(writer)
+            writer.start(PRICES)
+            for price_type in range(self.price_types):
+                price = Decimal(rnd.randrange(100, 1000000)) / 100
+                writer.start(PRICE)
+                writer.text(PERFORMANCE, f'{price} RUB за {SKU_NAME}')
+                writer.text(PRICE_TYPE_ID, self._get_id('price_type', price_type))
+                writer.text(PRICE_PER_UNIT, price)
+                writer.text(CURRENCY, 'RUB')
+                writer.text(UNIT, SKU_NAME)
+                writer.text(RATIO, 1)
+                writer.end(PRICE)
+            writer.end(PRICES)
+            writer.text(QUANTITY, rnd.randrange(1000))
+            writer.end(OFFER)
+        writer.end(OFFERS)
+        writer.end(PACKAGE_OF_OFFERS)
+
+    def get_orders(self):
+        """
+        Yields the generated orders as Order items, as an export pipeline
+        would.
+        """
+        rnd = self._get_random('orders')
+        start = datetime(2020, 1, 1)
+        for number in range(self.orders):
+            order = Order()
+            order.id = self._get_id('order', number)
+            order.number = str(number + 1)
+            moment = start + timedelta(minutes=number)
+            order.date = moment.date()
+            order.time = moment.time()
+            order.currency_name = 'RUB'
+            order.currency_rate = Decimal(1)
+            order.comment = f'Order {number}'
+            client = Client()
+            client.id = self._get_id('client', number)
+            client.name = client.full_name = f'Client {number}'
+            client.first_name = 'Client'
+            client.last_name = str(number)
+            order.client = client
+            for line in range(rnd.randint(1, 5) if self.products else 0):
+                product_number = rnd.randrange(self.products)
+                order_item = OrderItem()
+                order_item.id = self._get_id('product', product_number)
+                order_item.name = f'Product {product_number}'
+                sku = Sku()
+                sku.id, sku.name = SKU_CODE, SKU_NAME
+                sku.name_full, sku.international_abbr = SKU_NAME_FULL, SKU_ABBR
+                order_item.sku = sku
+                order_item.price = Decimal(rnd.randrange(100, 100000)) / 100
+                order_item.quant = Decimal(rnd.randint(1, 10))
+                order_item.sum = order_item.price * order_item.quant
+                order.items.append(order_item)
+                order.sum += order_item.sum
+            yield order
+
+    def write_orders(self, target):
+        """
+        Writes the orders as a document sent by 1C.
+        """
+        self._write(target, self._write_orders)
+
+    def _write_orders(self, writer):
+        for order in self.get_orders():
+            writer.start(DOCUMENT)
+            writer.text(ID, order.id)
+            writer.text(NUMBER, order.number)
+            writer.text(DATE, order.date.isoformat())
+            writer.text(HOUSEHOLD_OPERATION, order.operation)
+            writer.text(ROLE, order.role)
+            writer.text(CURRENCY, order.currency_name)
+            writer.text(EXCHANGE_RATE, order.currency_rate)
+            writer.text(AMOUNT, order.sum)
+            writer.start(COUNTERPARTIES)
+            writer.start(COUNTERPARTY)
+            writer.text(ID, order.client.id)
+            writer.text(TITLE, order.client.name)
+            writer.text(FULL_NAME, order.client.full_name)
+            writer.text(ROLE, order.client.role)
+            writer.end(COUNTERPARTY)
+            writer.end(COUNTERPARTIES)
+            writer.text(TIME, order.time.strftime('%H:%M:%S'))
+            writer.text(COMMENT, order.comment)
+            writer.start(PRODUCTS)
+            for order_item in order.items:
+                writer.start(PRODUCT)
+                writer.text(ID, order_item.id)
+                writer.text(TITLE, order_item.name)
+                self._write_sku(writer)
+                writer.text(PRICE_PER_UNIT, order_item.price)
+                writer.text(QUANTITY, order_item.quant)
+                writer.text(AMOUNT, order_item.sum)
+                writer.end(PRODUCT)
+            writer.end(PRODUCTS)
+            writer.end(DOCUMENT)
@@ -5,6 +5,7 @@ CATALOG = 'Каталог'
 CLASSIFIER = 'Классификатор'
 CODE = 'Код'
 COMMENT = 'Комментарий'
+CONTAINS_ONLY_CHANGES = 'СодержитТолькоИзменения'
 COMMERCIAL_INFORMATION = 'КоммерческаяИнформация'
 COUNTERPARTIES = 'Контрагенты'
 COUNTERPARTY = 'Контрагент'
@@ -71,3 +72,8 @@ ITEM_NUMBER = 'Артикул'
 UNITS_OF_MEASUREMENT = 'ЕдиницыИзмерения'
 UNIT_OF_MEASUREMENT = 'ЕдиницаИзмерения'
 INTERNATIONAL_TITLE_SHORT = 'МеждународноеСокращение'
+REMAINS = 'Остатки'
+REMAIN = 'Остаток'
+WAREHOUSE = 'Склад'
+WAREHOUSE_ID = 'ИдСклада'
+QUANTITY_IN_WAREHOUSE = 'КоличествоНаСкладе'
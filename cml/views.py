@@ -2,18 +2,30 @@ from __future__ import absolute_import
 
 import logging
 import os
+import shutil
+from datetime import timedelta
 
 from django.conf import settings
-from django.core.files.uploadedfile import SimpleUploadedFile
-from django.http import Http404, HttpResponse
+from django.contrib.sessions.backends.signed_cookies import SessionStore as CookieSessionStore
+from django.http import FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.http import parse_etags
 from django.views.decorators.csrf import csrf_exempt
 
+from .archives import extract_images_in_background, get_import_source, remove_archives
 from .auth import has_perm_or_basicauth, logged_in_or_basicauth
-from .managers import ImportManager, ExportManager
+from .images import is_image, store_image_file
+from .jobs import get_import_runner
+from .managers import ExportManager
 from .models import *
+from .stats import merge_stats
+from .utils.files import make_temp_file
 
 logger = logging.getLogger(__name__)
 
+EXPORT_STATS_SESSION_KEY = 'cml_export_stats'
+UPLOAD_OFFSETS_SESSION_KEY = 'cml_upload_offsets'
+
 
 @csrf_exempt
 @has_perm_or_basicauth('cml.add_exchange')
@@ -43,6 +55,14 @@ def check_auth(request):
 
 
 def init(request):
+    if request.GET.get('type') == 'catalog':
+        # jobs and parts left by an earlier exchange
+        ImportJob.supersede(request.user)
+        shutil.rmtree(get_staging_path(request), ignore_errors=True)
+        if hasattr(request, 'session'):
+            request.session.pop(UPLOAD_OFFSETS_SESSION_KEY, None)
+        if settings.CML_DELETE_FILES_AFTER_IMPORT:
+            remove_archives()
     result = (f'zip={"yes" if settings.CML_USE_ZIP else "no"}\n'
               f'file_limit={settings.CML_FILE_LIMIT}')
     return HttpResponse(result)
@@ -63,58 +83,221 @@ def upload_file(request):
         except OSError:
             return error(request, 'Can\'t create upload directory!')
 
-    filename, extension = os.path.splitext(os.path.basename(filename))
-    download_path = settings.CML_CATALOG_FILE_DOWNLOAD_PATH[extension.lower()]
-    filename_with_ext = filename + extension
-    temp_file = SimpleUploadedFile(
-        filename_with_ext, request.read(),
-        content_type=settings.CML_TEMP_FILE_CONTENT_TYPE[extension.lower()]
-    )
-    with open(os.path.join(download_path, filename_with_ext), 'wb') as f:
-        for chunk in temp_file.chunks():
-            f.write(chunk)
+    file_limit = settings.CML_FILE_LIMIT
+    if file_limit and int(request.META.get('CONTENT_LENGTH') or 0) > file_limit:
+        return error(request, f'File part exceeds the limit of {file_limit} bytes!')
+
+    filename = os.path.basename(filename)
+    # the new file is imported by a new job
+    ImportJob.supersede(request.user, filename)
+    try:
+        if request.GET.get('type') == 'catalog':
+            # 1C sends files larger than file_limit in several requests
+            stage_request_body(request, filename)
+        else:
+            save_request_body(request, get_upload_path(filename))
+    except OSError as e:
+        return error(request, f'Can\'t save file {filename}: {repr(e)}')
     return success(request)
 
 
+def get_upload_path(filename):
+    extension = os.path.splitext(filename)[1]
+    download_path = settings.CML_CATALOG_FILE_DOWNLOAD_PATH[extension.lower()]
+    return os.path.join(download_path, filename)
+
+
+def _copy_request_body(request, f):
+    chunk_size = settings.CML_UPLOAD_CHUNK_SIZE
+    chunk = request.read(chunk_size)
+    while chunk:
+        f.write(chunk)
+        chunk = request.read(chunk_size)
+
+
+def _move_file(source_path, file_path):
+    try:
+        os.replace(source_path, file_path)
+    except OSError:
+        # e.g. images saved to MEDIA_ROOT on another file system
+        shutil.move(source_path, file_path)
+
+
+def save_request_body(request, file_path):
+    """
+    Writes the request body to a temporary file in CML_UPLOAD_ROOT in
+    chunks of CML_UPLOAD_CHUNK_SIZE bytes, then moves it to ``file_path``
+    so a partial upload never replaces a complete file.
+    """
+    fd, temp_path = make_temp_file(settings.CML_UPLOAD_ROOT, suffix='.part')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            _copy_request_body(request, f)
+        _move_file(temp_path, file_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def get_staging_path(request):
+    session_key = None
+    if hasattr(request, 'session'):
+        session_key = request.session.session_key
+    if not session_key:
+        session_key = f'user-{request.user.pk}'
+    return os.path.join(settings.CML_UPLOAD_ROOT, 'staging', session_key)
+
+
+def stage_request_body(request, filename):
+    """
+    Appends the request body to the staging file of the exchange session.
+    The offset of every completed part is kept in the session, so a part
+    retried after a failed request replaces what it had written.
+    """
+    staging_path = get_staging_path(request)
+    os.makedirs(staging_path, exist_ok=True)
+    file_path = os.path.join(staging_path, filename)
+    offsets = {}
+    if hasattr(request, 'session'):
+        offsets = request.session.get(UPLOAD_OFFSETS_SESSION_KEY, {})
+    with open(file_path, 'ab') as f:
+        offset = offsets.get(filename, f.tell())
+        f.truncate(offset)
+        _copy_request_body(request, f)
+        offsets[filename] = f.tell()
+    if hasattr(request, 'session'):
+        request.session[UPLOAD_OFFSETS_SESSION_KEY] = offsets
+
+
+def finalize_uploads(request):
+    """
+    Moves the files staged during the exchange session into place.
+    """
+    staging_path = get_staging_path(request)
+    if not os.path.isdir(staging_path):
+        return
+    for filename in os.listdir(staging_path):
+        if settings.CML_HASHED_IMAGES and is_image(filename):
+            store_image_file(filename, os.path.join(staging_path, filename))
+            continue
+        file_path = get_upload_path(filename)
+        _move_file(os.path.join(staging_path, filename), file_path)
+        if os.path.splitext(filename)[1].lower() == '.zip':
+            # documents are read from the archive by the import
+            extract_images_in_background(file_path)
+    shutil.rmtree(staging_path, ignore_errors=True)
+    if hasattr(request, 'session'):
+        request.session.pop(UPLOAD_OFFSETS_SESSION_KEY, None)
+
+
+def progress(request, progress_text=''):
+    result = (f'{settings.CML_RESPONSE_PROGRESS}\n'
+              f'{progress_text}')
+    return HttpResponse(result)
+
+
 def import_file(request):
     try:
         filename = request.GET['filename']
     except KeyError:
         return error(request, 'Need a filename param!')
 
-    file_path = os.path.join(settings.CML_UPLOAD_ROOT, filename)
-    if not os.path.exists(file_path):
-        return error(request, 'File does\'nt exists!')
-    import_manager = ImportManager(file_path, )
-
-    try:
-        import_manager.import_all()
-    except Exception as e:
-        return error(request, str(e))
-
-    if settings.CML_DELETE_FILES_AFTER_IMPORT:
+    runner = get_import_runner()
+    job = ImportJob.get_unreported(request.user, filename)
+    if job is None:
         try:
-            os.remove(file_path)
-        except OSError:
-            logger.error(f'Can\'t delete file after import: {file_path}')
-
-    Exchange.log('import', request.user, filename)
+            finalize_uploads(request)
+        except OSError as e:
+            return error(request, f'Can\'t finalize uploaded files: {repr(e)}')
+        file_path, member = get_import_source(filename)
+        if not os.path.exists(file_path):
+            return error(request, 'File does\'nt exists!')
+        job = ImportJob.objects.create(user=request.user, filename=filename)
+        try:
+            runner.submit(job)
+        except Exception as e:
+            job.set_status(ImportJob.Status.FAILURE, str(e))
+    elif not job.is_finished:
+        try:
+            runner.poll(job)
+        except Exception as e:
+            job.set_status(ImportJob.Status.FAILURE, str(e))
+    job.refresh_from_db()
+
+    if not job.is_finished:
+        timeout = timedelta(seconds=settings.CML_IMPORT_JOB_TIMEOUT)
+        if job.updated + timeout > timezone.now():
+            return progress(request)
+        job.set_status(ImportJob.Status.FAILURE, 'Import job timed out!')
+
+    job.reported = True
+    job.save(update_fields=('reported', ))
+    if job.status == ImportJob.Status.FAILURE:
+        return error(request, job.message)
     return success(request)
 
 
 def export_query(request):
-    export_manager = ExportManager()
+    content_type = f'text/xml; charset={settings.CML_DEFAULT_CHARSET}'
+    if settings.CML_EXPORT_CACHE:
+        export_manager = ExportManager(
+            since=ExportWatermark.get_exported_until(request.user))
+        return _export_cached(request, export_manager, content_type)
+    export_manager = ExportManager(since=ExportWatermark.start_export(request.user))
+    if settings.CML_STREAMING_EXPORT:
+        return StreamingHttpResponse(
+            _stream_export(request, export_manager), content_type=content_type)
     export_manager.export_all()
-    return HttpResponse(
-        export_manager.get_xml(),
-        content_type=f'text/xml; charset={settings.CML_DEFAULT_CHARSET}'
-    )
+    xml = export_manager.get_xml()
+    _keep_export_stats(request, export_manager)
+    return HttpResponse(xml, content_type=content_type)
+
+
+def _export_cached(request, export_manager, content_type):
+    f, etag, rendered = export_manager.get_cached_xml(request.user)
+    # a document rendered by an earlier query has the orders read then
+    ExportWatermark.start_export(request.user, pending=rendered)
+    _keep_export_stats(request, export_manager)
+    if_none_match = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', str()))
+    if etag in if_none_match or '*' in if_none_match:
+        f.close()
+        response = HttpResponseNotModified()
+    else:
+        response = FileResponse(f, content_type=content_type)
+    response['ETag'] = etag
+    return response
+
+
+def _stream_export(request, export_manager):
+    yield from export_manager.iter_xml()
+    # the session middleware is done with the response by now
+    _keep_export_stats(request, export_manager, save=True)
+
+
+def _keep_export_stats(request, export_manager, save=False):
+    # logged once 1C confirms the export
+    if not hasattr(request, 'session'):
+        return
+    if save and isinstance(request.session, CookieSessionStore):
+        # the cookie was sent with the headers of the response
+        logger.warning('Stats of streamed exports need a server-side session backend, '
+                       'they aren\'t kept in cookie sessions')
+        return
+    request.session[EXPORT_STATS_SESSION_KEY] = export_manager.stats.as_dict()
+    if save:
+        request.session.save()
 
 
 def export_success(request):
     export_manager = ExportManager()
-    Exchange.log('export', request.user)
     export_manager.flush()
+    query_stats = None
+    if hasattr(request, 'session'):
+        query_stats = request.session.pop(EXPORT_STATS_SESSION_KEY, None)
+    stats = merge_stats(query_stats, export_manager.stats.as_dict())
+    Exchange.log('export', request.user, stats=stats)
+    ExportWatermark.confirm_export(request.user)
     return success(request)
 
 
@@ -8,10 +8,11 @@ os.chdir(os.path.normpath(os.path.join(os.path.abspath(__file__), os.pardir)))
 
 setup(
     name='django-cml',
-    python_requires='>3.3.0',
+    python_requires='>=3.8',
     version='0.4.0',
     packages=['cml'],
-    install_requires=['Django>=2.0', 'django-appconf>=1.0.1', 'six>=1.12.0'],
+    install_requires=['Django>=4.1', 'django-appconf>=1.0.1', 'six>=1.12.0'],
+    extras_require={'lxml': ['lxml>=3.0']},
     include_package_data=True,
     license='BSD License',
     description='App for data exchange in CommerceML 2 standard..',
@@ -22,16 +23,11 @@ setup(
     classifiers=[
         'Environment :: Web Environment',
         'Framework :: Django',
-        'Framework :: Django :: 2.0',
+        'Framework :: Django :: 4.1',
         'Intended Audience :: Developers',
         'License :: OSI Approved :: BSD License',
         'Operating System :: OS Independent',
         'Programming Language :: Python',
-        'Programming Language :: Python :: 3.3',
-        'Programming Language :: Python :: 3.4',
-        'Programming Language :: Python :: 3.5',
-        'Programming Language :: Python :: 3.6',
-        'Programming Language :: Python :: 3.7',
         'Programming Language :: Python :: 3.8',
         'Programming Language :: Python :: 3.9',
         'Programming Language :: Python :: 3.10',
@@ -0,0 +1,30 @@
+from django.db import models
+
+
+class Category(models.Model):
+    cml_id = models.CharField(max_length=255, unique=True)
+    name = models.CharField(max_length=255)
+    parent = models.ForeignKey('self', null=True, on_delete=models.CASCADE)
+
+
+class Good(models.Model):
+    cml_id = models.CharField(max_length=255, unique=True)
+    name = models.CharField(max_length=255)
+    category = models.ForeignKey(Category, null=True, on_delete=models.SET_NULL)
+
+
+class GoodOffer(models.Model):
+    cml_id = models.CharField(max_length=255, unique=True)
+    name = models.CharField(max_length=255)
+    quantity = models.IntegerField(default=0)
+    good = models.ForeignKey(Good, null=True, on_delete=models.CASCADE)
+
+
+class GoodPrice(models.Model):
+    offer = models.ForeignKey(GoodOffer, on_delete=models.CASCADE)
+    price_type_id = models.CharField(max_length=255)
+    price = models.DecimalField(max_digits=12, decimal_places=2)
+    currency = models.CharField(max_length=3)
+
+    class Meta:
+        unique_together = ('offer', 'price_type_id')
@@ -0,0 +1,26 @@
+from cml.pipelines import *
+
+from .models import Category, Good, GoodOffer, GoodPrice
+
+
+class GroupPipeline(GroupModelPipeline):
+    model = Category
+    parent_field = 'parent_id'
+    delete_removed = True
+
+
+class ProductPipeline(ProductModelPipeline):
+    model = Good
+    group_field = 'category_id'
+    group_model = Category
+
+
+class GoodPricePipeline(PriceModelPipeline):
+    model = GoodPrice
+
+
+class OfferPipeline(OfferModelPipeline):
+    model = GoodOffer
+    product_field = 'good_id'
+    product_model = Good
+    price_pipeline_class = GoodPricePipeline
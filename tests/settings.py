@@ -11,7 +11,8 @@ INSTALLED_APPS = (
     'django.contrib.contenttypes',
     'django.contrib.sessions',
     'django.contrib.messages',
-    'cml'
+    'cml',
+    'tests',
 )
 
 DATABASE_ENGINE = 'sqlite3'
@@ -62,3 +63,5 @@ USE_L10N = True
 USE_TZ = True
 
 CML_PROJECT_PIPELINES = 'tests.test_utils'
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
@@ -0,0 +1,51 @@
+import base64
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from cml import auth
+
+
+@override_settings(CML_AUTH_CACHE_TIMEOUT=60)
+class BasicAuthTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = get_user_model().objects.create_user('1c', password='1c')
+        self.session = SessionStore()
+        self.view = auth.logged_in_or_basicauth()(lambda request: HttpResponse('ok'))
+
+    def request(self, password='1c'):
+        credentials = base64.b64encode(f'1c:{password}'.encode('utf-8')).decode('ascii')
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Basic {credentials}')
+        request.user = mock.Mock(is_authenticated=False)
+        request.session = self.session
+        return self.view(request)
+
+    def test_cached_login(self):
+        with mock.patch.object(auth, 'authenticate', wraps=auth.authenticate) as authenticate, \
+                mock.patch.object(auth, 'login', wraps=auth.login) as login:
+            for i in range(3):
+                self.assertEqual(self.request().status_code, 200)
+            self.assertEqual(authenticate.call_count, 1)
+            self.assertEqual(login.call_count, 1)
+            self.assertEqual(self.request(password='wrong').status_code, 401)
+
+    def test_password_change(self):
+        self.assertEqual(self.request().status_code, 200)
+        self.user.set_password('new')
+        self.user.save()
+        self.assertEqual(self.request().status_code, 401)
+        self.assertEqual(self.request(password='new').status_code, 200)
+
+    @override_settings(CML_AUTH_CACHE_TIMEOUT=0)
+    def test_disabled(self):
+        with mock.patch.object(auth, 'authenticate', wraps=auth.authenticate) as authenticate:
+            for i in range(2):
+                self.assertEqual(self.request().status_code, 200)
+            self.assertEqual(authenticate.call_count, 2)
@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+from io import BytesIO
+
+from django.test import TestCase
+
+from cml.managers import ImportManager
+from cml.utils.benchmark import run_benchmarks
+from cml.utils.generator import CommerceMLGenerator
+
+from .test_utils import CollectingItemProcessor
+
+
+class CommerceMLGeneratorTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.generator = CommerceMLGenerator(
+            groups=20, depth=3, properties=4, variants=2, products=50,
+            offers=60, price_types=3, orders=5, seed=1)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def import_items(self, write):
+        file_path = os.path.join(self.directory, 'exchange.xml')
+        write(file_path)
+        manager = ImportManager(file_path)
+        manager.item_processor = CollectingItemProcessor()
+        self.assertTrue(manager.import_all())
+        items = {}
+        for item in manager.item_processor.items:
+            items.setdefault(item.__class__.__name__, []).append(item)
+        return items
+
+    def test_deterministic(self):
+        for write in ('write_import', 'write_offers', 'write_orders'):
+            first, second = BytesIO(), BytesIO()
+            getattr(self.generator, write)(first)
+            getattr(CommerceMLGenerator(
+                groups=20, depth=3, properties=4, variants=2, products=50,
+                offers=60, price_types=3, orders=5, seed=1), write)(second)
+            self.assertEqual(first.getvalue(), second.getvalue())
+
+    def test_import(self):
+        items = self.import_items(self.generator.write_import)
+        self.assertEqual(len(items['Product']), 50)
+        self.assertEqual(len(items['Property']), 4)
+        self.assertEqual(len(items['PropertyVariant']), 8)
+
+        def count(groups, level=1):
+            if groups:
+                self.assertLessEqual(level, 3)
+            return sum(1 + count(group.groups, level + 1) for group in groups)
+        self.assertEqual(count(items['Group']), 20)
+
+        items = self.import_items(self.generator.write_offers)
+        self.assertEqual(len(items['PriceType']), 3)
+        self.assertEqual(len(items['Offer']), 60)
+        self.assertTrue(all(len(offer.prices) == 3 for offer in items['Offer']))
+
+        items = self.import_items(self.generator.write_orders)
+        orders = list(self.generator.get_orders())
+        self.assertEqual([order.id for order in items['Order']],
+                         [order.id for order in orders])
+        self.assertEqual([len(order.items) for order in items['Order']],
+                         [len(order.items) for order in orders])
+
+    def test_benchmarks(self):
+        results = run_benchmarks(self.generator, self.directory, parse_workers=2)
+        self.assertEqual(len(results), 12)
+        for result in results:
+            self.assertTrue(result.items)
+            self.assertGreater(result.peak_memory, 0)
+        items = {result.name: result.items for result in results}
+        self.assertEqual(items['import_catalogue 2 workers'], items['import_catalogue'])
+        self.assertEqual(items['import_offers_pack 2 workers'], items['import_offers_pack'])
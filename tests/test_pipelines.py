@@ -0,0 +1,147 @@
+import os
+import shutil
+import tempfile
+from decimal import Decimal
+from unittest import mock
+
+from django.test import TestCase, override_settings
+
+from cml.idmap import IdMap, SqliteIdMapStore, get_entity
+from cml.items import Offer, Price
+from cml.managers import ImportManager, ItemProcessor
+
+from .models import Category, Good, GoodOffer, GoodPrice
+from .pipelines import GroupPipeline, OfferPipeline, ProductPipeline
+
+FIXTURES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tests_fixtures')
+
+
+# the fixture documents have no namespace
+@override_settings(CML_PROJECT_PIPELINES='tests.pipelines', CML_DOC_XMLNS='')
+class BulkModelPipelineTestCase(TestCase):
+
+    def import_file(self):
+        self.assertTrue(ImportManager(os.path.join(FIXTURES_PATH, 'import.xml')).import_all())
+
+    def test_import(self):
+        self.import_file()
+        self.assertEqual(Good.objects.count(), 282)
+        # a single fixture product has no groups
+        self.assertEqual(Good.objects.filter(category=None).count(), 1)
+        self.assertTrue(Category.objects.filter(parent=None).exists())
+        self.assertTrue(Category.objects.exclude(parent=None).exists())
+        categories = Category.objects.count()
+        self.assertEqual(categories, 36)
+        good = Good.objects.first()
+        name = good.name
+        Good.objects.filter(pk=good.pk).update(name='changed')
+        self.import_file()
+        self.assertEqual(Good.objects.count(), 282)
+        self.assertEqual(Category.objects.count(), categories)
+        self.assertEqual(Good.objects.get(pk=good.pk).name, name)
+
+    def test_without_upsert(self):
+        self.import_file()
+        good = Good.objects.first()
+        Good.objects.filter(pk=good.pk).update(name='changed')
+        with mock.patch.object(ProductPipeline, 'upsert', False):
+            self.import_file()
+        self.assertEqual(Good.objects.count(), 282)
+        self.assertNotEqual(Good.objects.get(pk=good.pk).name, 'changed')
+
+    def test_upsert_without_pk_map(self):
+        with mock.patch.object(ProductPipeline, 'get_pk_map') as get_pk_map:
+            self.import_file()
+        get_pk_map.assert_not_called()
+        self.assertEqual(Good.objects.count(), 282)
+
+    def test_stale_id_map(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        with override_settings(CML_ID_MAP_STORE='cml.idmap.SqliteIdMapStore', CML_ID_MAP_ROOT=root):
+            self.import_file()
+            good = Good.objects.first()
+            # deleted outside of the imports, the stored mapping is stale
+            Good.objects.filter(pk=good.pk).delete()
+            with mock.patch.object(ProductPipeline, 'upsert', False):
+                self.import_file()
+            self.assertEqual(Good.objects.count(), 282)
+            recreated = Good.objects.get(cml_id=good.cml_id)
+            self.assertEqual(SqliteIdMapStore(root).load(get_entity(Good))[good.cml_id], recreated.pk)
+
+    def test_offers(self):
+        self.import_file()
+        product_id = Good.objects.values_list('cml_id', flat=True).first()
+        offer = Offer()
+        offer.id, offer.name, offer.quantity = f'{product_id}#1', 'offer', 5
+        price = Price()
+        price.price_type_id, price.price_for_sku, price.currency_name = 'retail', Decimal('10.50'), 'RUB'
+        offer.prices = [price]
+        pipeline = OfferPipeline()
+        pipeline.process_batch([offer])
+        offer.prices[0].price_for_sku = Decimal('12')
+        pipeline.process_batch([offer])
+        good_offer = GoodOffer.objects.get()
+        self.assertEqual(good_offer.good.cml_id, product_id)
+        self.assertEqual(good_offer.quantity, 5)
+        self.assertEqual(GoodPrice.objects.get().price, Decimal('12'))
+        self.assertEqual(GoodPrice.objects.get().offer, good_offer)
+
+    def test_removed(self):
+        self.import_file()
+        category = Category.objects.filter(parent=None).first()
+        pipeline = GroupPipeline()
+        pipeline.process_removed([category.cml_id])
+        self.assertFalse(Category.objects.filter(pk=category.pk).exists())
+
+    def test_shared_id_map(self):
+        manager = ImportManager(os.path.join(FIXTURES_PATH, 'import.xml'))
+        self.assertTrue(manager.import_all())
+        id_map = manager.item_processor.id_map
+        category_pks = id_map.get_map(get_entity(Category))
+        self.assertEqual(len(category_pks), 36)
+        self.assertEqual(len(id_map.get_map(get_entity(Good))), 282)
+        # the product pipeline resolved the groups saved by the group pipeline
+        product_pipeline = manager.item_processor._project_pipelines['Product']
+        self.assertIs(product_pipeline.id_map, id_map)
+        with self.assertNumQueries(0):
+            product_pipeline.resolve(Category, 'cml_id', list(category_pks))
+
+    def test_persisted_id_map(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        with override_settings(CML_ID_MAP_STORE='cml.idmap.SqliteIdMapStore', CML_ID_MAP_ROOT=root):
+            self.import_file()
+            item_processor = ItemProcessor()
+            pipeline = item_processor._project_pipelines['Product']
+            with self.assertNumQueries(0):
+                pks = pipeline.get_pk_map()
+            self.assertEqual(pks, dict(Good.objects.values_list('cml_id', 'pk')))
+
+            group_pipeline = item_processor._project_pipelines['Group']
+            category = Category.objects.filter(parent=None, category__isnull=False).first()
+            child_ids = list(category.category_set.values_list('cml_id', flat=True))
+            self.assertTrue(child_ids)
+            group_pipeline.get_pk_map()
+            group_pipeline.process_removed([category.cml_id])
+            item_processor.flush_batches()
+            # the rows deleted by the cascade are dropped too
+            stored = SqliteIdMapStore(root).load(get_entity(Category))
+            self.assertEqual(stored, {})
+            self.assertEqual(group_pipeline.get_pk_map(),
+                             dict(Category.objects.values_list('cml_id', 'pk')))
+            for cml_id in [category.cml_id] + child_ids:
+                self.assertNotIn(cml_id, group_pipeline.get_pk_map())
+            item_processor.flush_batches()
+            self.assertEqual(SqliteIdMapStore(root).load(get_entity(Category)),
+                             group_pipeline.get_pk_map())
+
+    def test_id_map(self):
+        id_map = IdMap()
+        id_map.update('group', [('a', 1)])
+        with self.assertNumQueries(1):
+            pks = id_map.resolve(get_entity(Category), Category.objects.all(), 'cml_id', ['x', 'y'])
+        self.assertEqual(pks, {})
+        self.assertEqual(id_map.get('group', 'a'), 1)
+        id_map.discard('group', ['a'])
+        self.assertIsNone(id_map.get('group', 'a'))
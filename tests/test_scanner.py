@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -
+from __future__ import absolute_import
+from io import BytesIO
+from xml.etree import ElementTree as ET
+
+from django.test import SimpleTestCase
+
+from cml.scanner import ElementScanner, ScanError, UnsupportedDocument
+
+NAMESPACE = 'urn:1C.ru:commerceml_2'
+
+
+def scan(data, paths, **kwargs):
+    # a tiny block size makes every search cross the buffer boundaries
+    kwargs.setdefault('block_size', 16)
+    scanner = ElementScanner(BytesIO(data), paths, **kwargs)
+    return scanner, list(scanner)
+
+
+def get_items(events):
+    return [element for event, path, data in events if event == 'items'
+            for element, end in data]
+
+
+class ElementScannerTestCase(SimpleTestCase):
+
+    def test_items(self):
+        data = (b'<?xml version="1.0" encoding="UTF-8"?>\n'
+                b'<Root a="1"><Skipped><Item>no</Item></Skipped>'
+                b'<Items><Item><Id>1</Id></Item><Item/><Item><Id>3</Id></Item></Items></Root>')
+        scanner, events = scan(data, {('Items', 'Item')}, chunk_size=2)
+        self.assertEqual([(event, path) for event, path, data in events], [
+            ('start', ('Items', )),
+            ('items', ('Items', 'Item')),
+            ('items', ('Items', 'Item')),
+            ('end', ('Items', )),
+        ])
+        self.assertEqual(get_items(events), [
+            b'<Item><Id>1</Id></Item>', b'<Item/>', b'<Item><Id>3</Id></Item>'])
+        # the offsets are those of the element ends in the document
+        for event, path, items in events:
+            if event == 'items':
+                for element, end in items:
+                    self.assertEqual(data[end - len(element):end], element)
+
+    def test_namespaces(self):
+        data = (f'<Root xmlns="{NAMESPACE}" xmlns:c="urn:other">'
+                f'<c:Items><Item>other</Item></c:Items>'
+                f'<Items><c:Item>other</c:Item><Item>1</Item></Items>'
+                f'<x:Items xmlns:x="{NAMESPACE}"><x:Item>2</x:Item></x:Items>'
+                f'</Root>').encode('utf-8')
+        path = ('{%s}Items' % NAMESPACE, '{%s}Item' % NAMESPACE)
+        scanner, events = scan(data, {path})
+        self.assertEqual(get_items(events), [b'<Item>1</Item>', b'<x:Item>2</x:Item>'])
+        # the chunks are wrapped with the declarations of their parents
+        element = ET.fromstring(scanner.wrap(b'<x:Item>2</x:Item>', [
+            f'<Root xmlns="{NAMESPACE}">'.encode('utf-8'),
+            f'<x:Items xmlns:x="{NAMESPACE}">'.encode('utf-8'),
+        ]))
+        self.assertEqual(element.find(f'{path[0]}/{path[1]}').text, '2')
+
+    def test_unbound_prefix(self):
+        with self.assertRaises(ScanError):
+            scan(b'<Root><x:Items><x:Item/></x:Items></Root>', {('Items', 'Item')})
+
+    def test_markup_with_tag_names(self):
+        data = (b'<Root>'
+                b'<Skipped><!-- </Skipped> --><![CDATA[</Skipped>]]><?pi </Skipped>?></Skipped>'
+                b'<!-- <Items><Item>comment</Item></Items> -->'
+                b'<Items><Item><![CDATA[</Item><Item>]]><!-- </Item> --></Item></Items>'
+                b'</Root>')
+        scanner, events = scan(data, {('Items', 'Item')})
+        self.assertEqual(get_items(events), [
+            b'<Item><![CDATA[</Item><Item>]]><!-- </Item> --></Item>'])
+
+    def test_nested_elements_of_the_same_name(self):
+        data = b'<Root><Items><Item><Item>nested</Item></Item><Item>2</Item></Items></Root>'
+        scanner, events = scan(data, {('Items', 'Item')})
+        self.assertEqual(get_items(events), [
+            b'<Item><Item>nested</Item></Item>', b'<Item>2</Item>'])
+
+    def test_encoding(self):
+        document = ('<?xml version="1.0" encoding="windows-1251"?>'
+                    '<Корень><Товары><Товар>Молоко</Товар></Товары></Корень>')
+        scanner, events = scan(document.encode('cp1251'), {('Товары', 'Товар')})
+        self.assertEqual(scanner.encoding, 'windows-1251')
+        element = ET.fromstring(scanner.wrap(get_items(events)[0], [
+            '<Корень>'.encode('cp1251'), '<Товары>'.encode('cp1251')]))
+        self.assertEqual(element.findtext('Товары/Товар'), 'Молоко')
+
+    def test_unsupported_documents(self):
+        document = '<?xml version="1.0" encoding="UTF-16"?><Root><Items/></Root>'
+        with self.assertRaises(UnsupportedDocument):
+            scan(document.encode('utf-16'), {('Items', 'Item')})
+        with self.assertRaises(UnsupportedDocument):
+            scan(b'<?xml version="1.0" encoding="cp500"?><Root/>', {('Items', 'Item')})
+        with self.assertRaises(UnsupportedDocument):
+            scan(b'<!DOCTYPE Root><Root/>', {('Items', 'Item')})
+
+    def test_resume(self):
+        data = (b'<Root><Groups><Group>a</Group></Groups>'
+                b'<Items><Item>1</Item><Item>2</Item><Item>3</Item></Items></Root>')
+        paths = {('Groups', 'Group'), ('Items', 'Item')}
+        scanner = ElementScanner(BytesIO(data), paths, chunk_size=1, block_size=16)
+        for event, path, items in scanner:
+            if event == 'items' and items[0][0] == b'<Item>1</Item>':
+                state = scanner.get_state(items[0][1])
+                break
+        self.assertEqual(state['stack'], ['<Root>', '<Items>'])
+        scanner, events = scan(data, paths, state=state)
+        self.assertEqual(get_items(events), [b'<Item>2</Item>', b'<Item>3</Item>'])
+        self.assertEqual(events[-1][:2], ('end', ('Items', )))
+
+    def test_errors(self):
+        with self.assertRaises(ScanError):
+            scan(b'<Root><Items></Other></Root>', {('Items', 'Item')})
+        with self.assertRaises(ScanError):
+            scan(b'<Root><Items><Item>1</Items>', {('Items', 'Item')})
@@ -1,29 +1,624 @@
 # -*- coding: utf-8 -
 from __future__ import absolute_import
+import json
 import os
+import re
+import shutil
+import tempfile
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+
 import six
 from six.moves import range
 try:
     from xml.etree import cElementTree as ET
 except ImportError:
     from xml.etree import ElementTree as ET
-from django.test import TestCase
-from cml.utils import ImportManager, ExportManager
+try:
+    import lxml
+except ImportError:
+    lxml = None
+from itertools import count
+from unittest import mock, skipUnless
+
+from django.test import TestCase, override_settings
+from cml.conf import settings
+from cml.managers import ImportManager, ExportManager, ItemProcessor
+from cml.signals import exchange_finished
 from cml.items import *
+from cml.plans import *
+from cml.utils.generator import CommerceMLGenerator
 
 FIXTURES_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), 'tests_fixtures'))
+NAMESPACE = settings.CML_DOC_XMLNS
 
 
+# the fixture documents have no namespace
+@override_settings(CML_DOC_XMLNS='')
 class ImportManagerTestCase(TestCase):
 
     def setUp(self):
-        pass
+        GroupPipeline.collected_items = []
+        ProductPipeline.collected_items = []
 
     def test_run(self):
         man = ImportManager(os.path.join(FIXTURES_PATH, 'import.xml'))
         man.import_all()
         self.assertTrue(GroupPipeline.collected_items)
 
+    def test_streaming_matches_tree(self):
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        ImportManager(file_path, streaming=False).import_all()
+        tree_products = [(item.id, item.name, item.group_ids, item.properties)
+                         for item in ProductPipeline.collected_items]
+        tree_groups = [(item.id, len(item.groups))
+                       for item in GroupPipeline.collected_items]
+        self.setUp()
+        ImportManager(file_path, streaming=True).import_all()
+        self.assertTrue(tree_products)
+        self.assertEqual(tree_products, [
+            (item.id, item.name, item.group_ids, item.properties)
+            for item in ProductPipeline.collected_items])
+        self.assertEqual(tree_groups, [
+            (item.id, len(item.groups))
+            for item in GroupPipeline.collected_items])
+
+    @override_settings(CML_DOC_XMLNS=NAMESPACE)
+    def test_namespace(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        file_path = os.path.join(root, 'import.xml')
+        with open(os.path.join(FIXTURES_PATH, 'import.xml'), encoding='utf-8-sig') as f:
+            content = f.read().replace(
+                '<КоммерческаяИнформация ', f'<КоммерческаяИнформация xmlns="{NAMESPACE}" ', 1)
+        with open(file_path, 'w', encoding='utf-8') as f:
+            f.write(content)
+        for streaming in (True, False):
+            self.setUp()
+            self.assertTrue(ImportManager(file_path, streaming=streaming).import_all())
+            self.assertEqual(len(ProductPipeline.collected_items), 282)
+            self.assertEqual(len(GroupPipeline.collected_items), 18)
+
+    def test_resume_from_checkpoint(self):
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        clock = count()
+        checkpoint = None
+        slices = 0
+        with mock.patch('cml.managers.time.monotonic', lambda: next(clock)):
+            while True:
+                man = ImportManager(file_path, streaming=True, checkpoint=checkpoint)
+                # every slice stops after 50 processed items
+                self.assertTrue(man.import_all(deadline=next(clock) + 50))
+                checkpoint = man.checkpoint
+                if checkpoint is None:
+                    break
+                slices += 1
+        self.assertEqual(slices, 6)
+        self.assertEqual(len(GroupPipeline.collected_items), 18)
+        self.assertEqual(len(set(item.id for item in ProductPipeline.collected_items)), 282)
+        self.assertEqual(len(ProductPipeline.collected_items), 282)
+
+    def _import_in_slices(self, file_path):
+        clock = count()
+        checkpoints = []
+        with mock.patch('cml.managers.time.monotonic', lambda: next(clock)):
+            while True:
+                man = ImportManager(file_path, streaming=True,
+                                    checkpoint=checkpoints[-1] if checkpoints else None)
+                self.assertTrue(man.import_all(deadline=next(clock) + 50))
+                if man.checkpoint is None:
+                    return checkpoints
+                checkpoints.append(man.checkpoint)
+
+    @override_settings(CML_PARSE_CHUNK_SIZE=10)
+    def test_resume_from_offset(self):
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        backend = ImportManager(file_path).backend
+        fromstring = backend.fromstring
+        parsed = []
+
+        def counting_fromstring(data):
+            parsed.append(len(data))
+            return fromstring(data)
+        with mock.patch.object(backend, 'fromstring', counting_fromstring):
+            checkpoints = self._import_in_slices(file_path)
+        offsets = [checkpoint['offset'] for checkpoint in checkpoints]
+        self.assertEqual(len(offsets), 6)
+        self.assertEqual(offsets, sorted(offsets))
+        # elements before a checkpoint aren't parsed again
+        self.assertLess(sum(parsed), 1.5 * os.path.getsize(file_path))
+        self.assertEqual(len(ProductPipeline.collected_items), 282)
+
+    def test_resume_with_iterparse(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        file_path = os.path.join(root, 'import.xml')
+        with open(os.path.join(FIXTURES_PATH, 'import.xml'), encoding='utf-8-sig') as f:
+            content = f.read().replace('UTF-8', 'UTF-16', 1)
+        # UTF-16 documents can't be scanned for offsets
+        with open(file_path, 'w', encoding='utf-16') as f:
+            f.write(content)
+        checkpoints = self._import_in_slices(file_path)
+        positions = [checkpoint['position'] for checkpoint in checkpoints]
+        self.assertEqual(positions[0], 50)
+        self.assertEqual(positions, sorted(positions))
+        self.assertNotIn('offset', checkpoints[0])
+        self.assertEqual(len(GroupPipeline.collected_items), 18)
+        self.assertEqual(len(ProductPipeline.collected_items), 282)
+
+    def test_fingerprints(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        tree = ET.parse(file_path)
+        products_element = tree.find('Каталог/Товары')
+        removed_element, changed_element = list(products_element)[:2]
+        products_element.remove(removed_element)
+        changed_element.find('Наименование').text = 'changed'
+        changed_file_path = os.path.join(root, 'import.xml')
+        tree.write(changed_file_path, encoding='utf-8')
+
+        with override_settings(
+                CML_FINGERPRINT_STORE='cml.fingerprints.FileFingerprintStore',
+                CML_FINGERPRINT_ROOT=os.path.join(root, 'fingerprints')):
+            ImportManager(file_path).import_all()
+            self.assertEqual(len(ProductPipeline.collected_items), 282)
+            self.setUp()
+            ImportManager(file_path).import_all()
+            self.assertEqual(ProductPipeline.collected_items, [])
+            self.assertEqual(GroupPipeline.collected_items, [])
+            man = ImportManager(changed_file_path)
+            man.import_all()
+            self.assertEqual([item.name for item in ProductPipeline.collected_items],
+                             ['changed'])
+            self.assertEqual(man.removed_ids, {
+                'Product': {removed_element.findtext('Ид')}})
+
+    def test_resumed_fingerprints(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        tree = ET.parse(file_path)
+        products_element = tree.find('Каталог/Товары')
+        removed_element = list(products_element)[0]
+        products_element.remove(removed_element)
+        changed_file_path = os.path.join(root, 'import.xml')
+        tree.write(changed_file_path, encoding='utf-8')
+
+        with override_settings(
+                CML_FINGERPRINT_STORE='cml.fingerprints.FileFingerprintStore',
+                CML_FINGERPRINT_ROOT=os.path.join(root, 'fingerprints')):
+            ImportManager(file_path).import_all()
+            clock = count()
+            checkpoint = None
+            slices = 0
+            removed_ids = {}
+            with mock.patch('cml.managers.time.monotonic', lambda: next(clock)):
+                while True:
+                    man = ImportManager(changed_file_path, streaming=True, checkpoint=checkpoint)
+                    self.assertTrue(man.import_all(deadline=next(clock) + 50))
+                    removed_ids.update(man.removed_ids)
+                    if man.checkpoint is None:
+                        break
+                    # as saved on the import job
+                    checkpoint = json.loads(json.dumps(man.checkpoint))
+                    slices += 1
+        self.assertGreater(slices, 1)
+        # the products section spans several slices
+        self.assertEqual(removed_ids, {'Product': {removed_element.findtext('Ид')}})
+
+    def test_database_fingerprint_store(self):
+        from django.db import connection
+        from cml.fingerprints import DatabaseFingerprintStore
+        store = DatabaseFingerprintStore()
+        for upsert in (True, False):
+            with mock.patch.object(connection.features,
+                                   'supports_update_conflicts_with_target', upsert):
+                store.update('Product', {'1': 'a', '2': 'b'})
+                store.update('Product', {'2': 'c', '3': 'd'})
+                store.update('Offer', {'1': 'e'})
+                self.assertEqual(store.load('Product'), {'1': 'a', '2': 'c', '3': 'd'})
+                store.delete('Product', ['1', '2', '3'])
+                store.delete('Offer', ['1'])
+                self.assertEqual(store.load('Product'), {})
+
+    def test_fingerprints_of_nested_groups(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        tree = ET.parse(file_path)
+        groups_element = tree.find('Классификатор/Группы')
+        parent_element, moved_element = list(groups_element)[:2]
+        groups_element.remove(moved_element)
+        nested_groups_element = parent_element.find('Группы')
+        nested_groups_element.append(moved_element)
+        removed_element = next(
+            element for element in nested_groups_element.iter('Группа')
+            if element.find('Группы/Группа') is None and element is not moved_element)
+        for element in parent_element.iter('Группы'):
+            if removed_element in list(element):
+                element.remove(removed_element)
+        changed_file_path = os.path.join(root, 'import.xml')
+        tree.write(changed_file_path, encoding='utf-8')
+
+        with override_settings(
+                CML_FINGERPRINT_STORE='cml.fingerprints.FileFingerprintStore',
+                CML_FINGERPRINT_ROOT=os.path.join(root, 'fingerprints')):
+            ImportManager(file_path).import_all()
+            self.setUp()
+            man = ImportManager(changed_file_path)
+            man.import_all()
+            self.assertEqual([item.id for item in GroupPipeline.collected_items],
+                             [parent_element.findtext('Ид')])
+            self.assertEqual(man.removed_ids, {'Group': {removed_element.findtext('Ид')}})
+
+            # moved back to the top level
+            self.setUp()
+            man = ImportManager(file_path)
+            man.import_all()
+            self.assertEqual(sorted(item.id for item in GroupPipeline.collected_items),
+                             sorted([parent_element.findtext('Ид'), moved_element.findtext('Ид')]))
+            self.assertEqual(man.removed_ids, {})
+
+    def test_fingerprints_of_failed_items(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        with override_settings(
+                CML_FINGERPRINT_STORE='cml.fingerprints.FileFingerprintStore',
+                CML_FINGERPRINT_ROOT=root):
+            with mock.patch.object(ProductPipeline, 'process_item', side_effect=ValueError):
+                ImportManager(file_path).import_all()
+            ImportManager(file_path).import_all()
+            self.assertEqual(len(ProductPipeline.collected_items), 282)
+            self.setUp()
+            ImportManager(file_path).import_all()
+            self.assertEqual(ProductPipeline.collected_items, [])
+
+    def test_fingerprints_of_images(self):
+        from cml.images import store_image
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        tree = ET.parse(os.path.join(FIXTURES_PATH, 'import.xml'))
+        product_element = tree.find('Каталог/Товары/Товар')
+        ET.SubElement(product_element, 'Картинка').text = 'import_files/c0/image.jpg'
+        file_path = os.path.join(root, 'import.xml')
+        tree.write(file_path, encoding='utf-8')
+
+        for workers in (0, 2):
+            with override_settings(
+                    CML_FINGERPRINT_STORE='cml.fingerprints.FileFingerprintStore',
+                    CML_FINGERPRINT_ROOT=os.path.join(root, f'fingerprints{workers}'),
+                    CML_HASHED_IMAGES=True, CML_IMAGE_ROOT=os.path.join(root, 'images'),
+                    CML_PARSE_WORKERS=workers, CML_PARSE_CHUNK_SIZE=50):
+                store_image('image.jpg', six.BytesIO(b'image'))
+                self.setUp()
+                ImportManager(file_path).import_all()
+                self.assertEqual(len(ProductPipeline.collected_items), 282)
+                self.setUp()
+                ImportManager(file_path).import_all()
+                self.assertEqual(ProductPipeline.collected_items, [])
+
+                digest, changed = store_image('image.jpg', six.BytesIO(b'new image'))
+                self.assertTrue(changed)
+                ImportManager(file_path).import_all()
+                self.assertEqual([(item.id, item.image_hash)
+                                  for item in ProductPipeline.collected_items],
+                                 [(product_element.findtext('Ид'), digest)])
+
+    @override_settings(CML_PIPELINE_BATCH_SIZE=100, CML_DEDUPLICATE_ITEMS=())
+    def test_batches(self):
+        TaxPipeline.batches = []
+        man = ImportManager(os.path.join(FIXTURES_PATH, 'import.xml'))
+        # the products would flush the taxes referenced by them
+        del man.item_processor._project_pipelines['Product']
+        man.import_all()
+        self.assertEqual([len(batch) for batch in TaxPipeline.batches],
+                         [100, 100, 60])
+
+    @override_settings(CML_PIPELINE_BATCH_SIZE=100, CML_DEDUPLICATE_ITEMS=())
+    def test_batches_before_items(self):
+        TaxPipeline.batches = []
+        pending = []
+        man = ImportManager(os.path.join(FIXTURES_PATH, 'import.xml'))
+
+        def process_item(pipeline, item):
+            pending.append(sum(map(len, man.item_processor._buffers.values())))
+
+        with mock.patch.object(ProductPipeline, 'process_item', process_item):
+            man.import_all()
+        # the taxes are saved before the products referencing them
+        self.assertEqual(pending, [0] * 282)
+        self.assertEqual(sum(len(batch) for batch in TaxPipeline.batches), 260)
+
+    def test_deduplicate_items(self):
+        TaxPipeline.batches = []
+        man = ImportManager(os.path.join(FIXTURES_PATH, 'import.xml'))
+        man.import_all()
+        taxes = [(item.name, item.value) for batch in TaxPipeline.batches for item in batch]
+        self.assertTrue(taxes)
+        self.assertEqual(len(taxes), len(set(taxes)))
+
+    @skipUnless(lxml, 'lxml is not installed')
+    @override_settings(CML_XML_BACKEND='lxml')
+    def test_lxml_backend(self):
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        ImportManager(file_path).import_all()
+        self.assertEqual(len(ProductPipeline.collected_items), 282)
+        self.assertEqual(len(GroupPipeline.collected_items), 18)
+
+    @skipUnless(lxml, 'lxml is not installed')
+    def test_lxml_iterparse_drops_other_sections(self):
+        from cml.backends import get_backend
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        paths = {('Классификатор', 'Группы', 'Группа')}
+        yielded = {}
+        for path, element in get_backend('lxml').iterparse(file_path, paths):
+            yielded.setdefault(path, []).append(len(list(element.iter())))
+        self.assertEqual(len(yielded[paths.pop()]), 18)
+        # the products were dropped as they were parsed
+        self.assertLess(yielded[('Каталог', )][0], 10)
+
+    def test_parallel_parsing(self):
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        ImportManager(file_path).import_all()
+        products = [(item.id, item.name, item.group_ids, item.properties)
+                    for item in ProductPipeline.collected_items]
+        for ordered in (True, False):
+            self.setUp()
+            with override_settings(CML_PARSE_WORKERS=2, CML_PARSE_CHUNK_SIZE=50,
+                                   CML_PARSE_ORDERED=ordered):
+                self.assertTrue(ImportManager(file_path).import_all())
+            parsed = [(item.id, item.name, item.group_ids, item.properties)
+                      for item in ProductPipeline.collected_items]
+            if not ordered:
+                products, parsed = sorted(products), sorted(parsed)
+            self.assertEqual(parsed, products)
+
+    def test_parallel_fingerprints(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        with override_settings(
+                CML_FINGERPRINT_STORE='cml.fingerprints.FileFingerprintStore',
+                CML_FINGERPRINT_ROOT=root, CML_PARSE_WORKERS=2, CML_PARSE_CHUNK_SIZE=50):
+            self.assertTrue(ImportManager(file_path).import_all())
+            self.assertEqual(len(ProductPipeline.collected_items), 282)
+            self.setUp()
+            man = ImportManager(file_path)
+            self.assertTrue(man.import_all())
+            self.assertEqual(ProductPipeline.collected_items, [])
+            self.assertEqual(man.removed_ids, {})
+
+    def test_zip_member(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        archive_path = os.path.join(directory, 'exchange.zip')
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.write(os.path.join(FIXTURES_PATH, 'import.xml'), 'files/import.xml')
+        for streaming in (True, False):
+            self.setUp()
+            manager = ImportManager(archive_path, streaming=streaming, member='files/import.xml')
+            self.assertTrue(manager.import_all())
+            self.assertEqual(len(ProductPipeline.collected_items), 282)
+            self.assertEqual(manager.stats.bytes_parsed,
+                             os.path.getsize(os.path.join(FIXTURES_PATH, 'import.xml')))
+
+    def test_stats(self):
+        file_path = os.path.join(FIXTURES_PATH, 'import.xml')
+        received = []
+
+        def receiver(sender, stats, signal, **kwargs):
+            received.append((sender, stats, kwargs))
+        exchange_finished.connect(receiver)
+        try:
+            for streaming in (True, False):
+                self.setUp()
+                manager = ImportManager(file_path, streaming=streaming)
+                manager.import_all()
+                stats = manager.stats
+                self.assertEqual(set(stats.phases), {'classifier', 'catalogue'} | (
+                    set() if streaming else {'parse'}))
+                self.assertEqual(stats.items['Product'], 282)
+                self.assertEqual(stats.pipelines[('ProductPipeline', 'process_item')][0], 282)
+                self.assertEqual(stats.bytes_parsed, os.path.getsize(file_path))
+                self.assertEqual(stats.error_count, 0)
+                self.assertEqual(received[-1], (ImportManager, stats, {
+                    'file_path': file_path, 'success': True, 'complete': True}))
+            manager = ImportManager(os.path.join(FIXTURES_PATH, 'missing.xml'))
+            self.assertFalse(manager.import_all())
+            self.assertEqual(manager.stats.errors, {'file': 1})
+            self.assertFalse(received[-1][2]['success'])
+        finally:
+            exchange_finished.disconnect(receiver)
+
+
+class CollectingItemProcessor(object):
+
+    def __init__(self):
+        self.items = []
+
+    def process_item(self, item):
+        self.items.append(item)
+
+    def process_removed(self, item_class_name, item_ids):
+        pass
+
+    def flush_batches(self):
+        pass
+
+    def pop_failed_ids(self):
+        return {}
+
+
+class PricesImportTestCase(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.generator = CommerceMLGenerator(
+            groups=5, depth=2, properties=2, variants=2, products=20,
+            offers=60, price_types=3, orders=0, seed=1)
+
+    def import_items(self, write, prices_only=False, price_matrix=False):
+        file_path = os.path.join(self.directory, 'offers.xml')
+        write(file_path)
+        manager = ImportManager(file_path, prices_only=prices_only, price_matrix=price_matrix)
+        manager.item_processor = CollectingItemProcessor()
+        self.assertTrue(manager.import_all())
+        self.removed_ids = manager.removed_ids
+        items = {}
+        for item in manager.item_processor.items:
+            items.setdefault(item.__class__.__name__, []).append(item)
+        return items
+
+    def test_prices_only(self):
+        items = self.import_items(self.generator.write_offers)
+        prices_only_items = self.import_items(self.generator.write_offers, prices_only=True)
+        self.assertEqual(sorted(prices_only_items), ['OfferPrice', 'PriceType'])
+        self.assertEqual([offer.id for offer in prices_only_items['OfferPrice']],
+                         [offer.id for offer in items['Offer']])
+        for offer_price, offer in zip(prices_only_items['OfferPrice'], items['Offer']):
+            self.assertEqual(offer_price.quantity, Decimal(offer.quantity))
+            self.assertEqual(offer_price.prices, {
+                price.price_type_id: price.price_for_sku for price in offer.prices})
+
+    def test_prices_only_fingerprints(self):
+        with override_settings(
+                CML_FINGERPRINT_STORE='cml.fingerprints.FileFingerprintStore',
+                CML_FINGERPRINT_ROOT=os.path.join(self.directory, 'fingerprints')):
+            items = self.import_items(self.generator.write_offers, prices_only=True)
+            self.assertEqual(len(items['OfferPrice']), 60)
+            items = self.import_items(self.generator.write_offers, prices_only=True)
+            self.assertNotIn('OfferPrice', items)
+            self.assertEqual(self.removed_ids, {})
+            # offers aren't skipped after their prices were imported
+            items = self.import_items(self.generator.write_offers)
+            self.assertEqual(len(items['Offer']), 60)
+            self.assertEqual(self.removed_ids, {})
+
+    def test_price_matrix(self):
+        offers = self.import_items(self.generator.write_offers)['Offer']
+        items = self.import_items(self.generator.write_offers, price_matrix=True)
+        self.assertEqual(sorted(items), ['PriceMatrix', 'PriceType'])
+        matrix, = items['PriceMatrix']
+        self.assertEqual(matrix.price_type_ids, [item.id for item in items['PriceType']])
+        self.assertEqual(matrix.currencies, ['RUB'] * 3)
+        self.assertEqual(matrix.tax_in_sum, [True] * 3)
+        rows = list(matrix.iter_rows())
+        self.assertEqual(len(rows), len(offers))
+        for (offer_id, quantity, prices), offer in zip(rows, offers):
+            self.assertEqual(offer_id, offer.id)
+            self.assertEqual(quantity, float(offer.quantity))
+            self.assertEqual(prices, {price.price_type_id: float(price.price_for_sku)
+                                      for price in offer.prices})
+        self.assertEqual(set(matrix.ratios[0]), {1.0})
+
+        price_type_id = matrix.price_type_ids[0]
+        price = matrix.get_price(offers[0].id, price_type_id)
+        matrix.convert_currency({'RUB': 0.5}, 'USD')
+        self.assertEqual(matrix.currencies, ['USD'] * 3)
+        matrix.exclude_tax(25)
+        self.assertEqual(matrix.tax_in_sum, [False] * 3)
+        self.assertAlmostEqual(matrix.get_price(offers[0].id, price_type_id), price * 0.5 * 0.8)
+
+        matrix.set_price(matrix.add_offer('new', 1.0), 'new', 2.0)
+        self.assertIsNone(matrix.get_price(offers[0].id, 'new'))
+        self.assertIsNone(matrix.get_price('new', price_type_id))
+        self.assertEqual(list(matrix.iter_rows())[-1], ('new', 1.0, {'new': 2.0}))
+
+    def test_price_matrix_fingerprints(self):
+        with override_settings(
+                CML_FINGERPRINT_STORE='cml.fingerprints.FileFingerprintStore',
+                CML_FINGERPRINT_ROOT=os.path.join(self.directory, 'fingerprints')):
+            matrix, = self.import_items(self.generator.write_offers, price_matrix=True)['PriceMatrix']
+            self.assertEqual(len(matrix), 60)
+            items = self.import_items(self.generator.write_offers, price_matrix=True)
+            self.assertNotIn('PriceMatrix', items)
+            self.assertEqual(self.removed_ids, {})
+            items = self.import_items(self.generator.write_offers)
+            self.assertEqual(len(items['Offer']), 60)
+
+        # the fingerprints of every row are dropped when the pipeline fails
+        item_processor = ItemProcessor()
+        item_processor._add_failed('PriceMatrix', [matrix])
+        self.assertEqual(item_processor.pop_failed_ids(), {'PriceMatrix': set(matrix.offer_ids)})
+
+
+class ExtractionPlanTestCase(TestCase):
+
+    def test_order(self):
+        element = ET.fromstring(
+            '<Документ><Ид>1</Ид><Курс>2.5</Курс>'
+            '<Контрагенты><Контрагент><Ид>c1</Ид></Контрагент></Контрагенты>'
+            '<Товары><Товар><Ид>p1</Ид>'
+            '<БазоваяЕдиница Код="796">шт</БазоваяЕдиница></Товар>'
+            '<Товар><Ид>p2</Ид></Товар></Товары></Документ>')
+        order = ORDER_PLAN.compile('').parse(element, lambda item: None)
+        self.assertEqual(order.id, '1')
+        self.assertEqual(order.currency_rate, '2.5')
+        self.assertEqual(order.client.id, 'c1')
+        self.assertEqual([item.id for item in order.items], ['p1', 'p2'])
+        self.assertEqual(order.items[0].sku.id, '796')
+        self.assertEqual(order.items[0].sku.name, 'шт')
+        self.assertIsNone(order.xml_element)
+        self.assertEqual(vars(order), {})
+
+    def test_offer_price(self):
+        element = ET.fromstring(
+            '<Предложение><Ид>1#2</Ид><Наименование>a</Наименование>'
+            '<Цены><Цена><ИдТипаЦены>t1</ИдТипаЦены><ЦенаЗаЕдиницу>10.50</ЦенаЗаЕдиницу></Цена>'
+            '<Цена><ИдТипаЦены>t2</ИдТипаЦены><ЦенаЗаЕдиницу>bad</ЦенаЗаЕдиницу></Цена></Цены>'
+            '<Количество>7</Количество>'
+            '<Склад ИдСклада="w1" КоличествоНаСкладе="3"/>'
+            '<Остатки><Остаток><Склад><Ид>w2</Ид><Количество>4</Количество></Склад>'
+            '</Остаток></Остатки></Предложение>')
+        offer_price = get_offer_price_parser('')(element)
+        self.assertEqual(offer_price, OfferPrice(
+            '1#2', Decimal(7), (('w1', Decimal(3)), ('w2', Decimal(4))),
+            {'t1': Decimal('10.50'), 't2': Decimal()}))
+
+    def test_first_match(self):
+        element = ET.fromstring(
+            '<Товар><Ид>1</Ид><Картинка>import_files/a.jpg</Картинка>'
+            '<Картинка>import_files/b.jpg</Картинка>'
+            '<БазоваяЕдиница Код="796">шт</БазоваяЕдиница>'
+            '<БазоваяЕдиница Код="166">кг</БазоваяЕдиница></Товар>')
+        emitted = []
+        product = PRODUCT_PLAN.compile('').parse(element, emitted.append)
+        self.assertEqual(product.image_filename, 'a.jpg')
+        self.assertEqual(product.sku_id, '796')
+        self.assertEqual([item.id for item in emitted], ['796', '1'])
+
+    def test_property_variants(self):
+        element = ET.fromstring(
+            '<Свойство><Ид>1</Ид><ТипЗначений>Справочник</ТипЗначений>'
+            '<ВариантыЗначений>'
+            '<Справочник><ИдЗначения>v1</ИдЗначения><Значение>a</Значение></Справочник>'
+            '<Строка><ИдЗначения>v2</ИдЗначения><Значение>b</Значение></Строка>'
+            '</ВариантыЗначений></Свойство>')
+        emitted = []
+        PROPERTY_PLAN.compile('').parse(element, emitted.append)
+        self.assertEqual([(item.id, getattr(item, 'property_id', None)) for item in emitted],
+                         [('1', None), ('v1', '1')])
+
+    def test_keep_element(self):
+        element = ET.fromstring('<Группа><Ид>1</Ид></Группа>')
+        group = GROUP_PLAN.compile('').parse(element, lambda item: None,
+                                             keep_element=True)
+        self.assertIs(group.xml_element, element)
+
+    def test_extend(self):
+        plan = PRODUCT_PLAN.extend(Field('Вес', 'weight'))
+        element = ET.fromstring(
+            '<Товар><Ид>1</Ид><Наименование>a</Наименование><Вес>b</Вес></Товар>')
+        emitted = []
+        product = plan.compile('').parse(element, emitted.append)
+        self.assertEqual(product.name, 'a')
+        self.assertEqual(product.weight, 'b')
+        self.assertEqual(emitted, [product])
+
 
 class ExportManagerTestCase(TestCase):
 
@@ -36,6 +631,21 @@ class ExportManagerTestCase(TestCase):
         tree = ET.fromstring(man.get_xml())
         orders_elements = tree.find('Документ')
         self.assertIsNotNone(orders_elements)
+        self.assertEqual(man.stats.items['Order'], 10)
+        self.assertEqual(man.stats.pipelines[('OrderPipeline', 'yield_item')][0], 11)
+        self.assertEqual(set(man.stats.phases), {'orders', 'serialize'})
+
+    def test_iter_xml(self):
+        man = ExportManager()
+        man.export_all()
+        xml = man.get_xml()
+        chunks = list(ExportManager().iter_xml())
+        # the header, an order per chunk and the closing tag
+        self.assertEqual(len(chunks), 12)
+        # orders are created with the current time
+        self.assertEqual(
+            re.sub(r'<Время>[^<]*</Время>', '', ET.tostring(ET.fromstring(b''.join(chunks)), 'unicode')),
+            re.sub(r'<Время>[^<]*</Время>', '', ET.tostring(ET.fromstring(xml), 'unicode')))
 
 
 class GroupPipeline(object):
@@ -46,11 +656,32 @@ class GroupPipeline(object):
         GroupPipeline.collected_items.append(item)
 
 
+class ProductPipeline(object):
+
+    collected_items = []
+
+    def process_item(self, item):
+        ProductPipeline.collected_items.append(item)
+
+
+class TaxPipeline(object):
+
+    batches = []
+
+    def process_batch(self, items):
+        TaxPipeline.batches.append(items)
+
+
 class OrderPipeline(object):
 
+    version = 0
+
     def process_item(self, item):
         pass
 
+    def get_version(self):
+        return OrderPipeline.version
+
     def yield_item(self):
         for i in range(10):
             item = Order()
@@ -0,0 +1,410 @@
+# -*- coding: utf-8 -
+from __future__ import absolute_import
+import glob
+import os
+import shutil
+import tempfile
+import zipfile
+from collections import defaultdict
+from datetime import timedelta
+from itertools import count
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.contrib.sessions.backends.signed_cookies import SessionStore as CookieSessionStore
+from django.test import RequestFactory, TestCase, override_settings
+from django.utils import timezone
+
+from cml.archives import extract_images
+from cml.images import get_image_path, store_image, store_image_file
+from cml.items import Product
+from cml.managers import ExportManager, ImportManager
+from cml.jobs import BaseImportRunner
+from cml.models import *
+from cml.views import (
+    EXPORT_STATS_SESSION_KEY, export_query, export_success, finalize_uploads, import_file, init, upload_file,
+)
+
+FIXTURES_PATH = os.path.normpath(os.path.join(os.path.dirname(__file__), 'tests_fixtures'))
+
+
+class NullRunner(BaseImportRunner):
+
+    def submit(self, job):
+        pass
+
+
+# the fixture documents have no namespace
+@override_settings(CML_DOC_XMLNS='')
+class ImportFileTestCase(TestCase):
+
+    def setUp(self):
+        self.upload_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_root)
+        shutil.copy(os.path.join(FIXTURES_PATH, 'import.xml'), self.upload_root)
+        self.user = get_user_model().objects.create_user('1c', password='1c')
+        self.factory = RequestFactory()
+
+    def import_file(self):
+        request = self.factory.get('/', {'type': 'catalog', 'mode': 'import',
+                                         'filename': 'import.xml'})
+        request.user = self.user
+        return import_file(request).content.decode().splitlines()[0]
+
+    def test_sync_runner(self):
+        with override_settings(CML_UPLOAD_ROOT=self.upload_root,
+                               CML_IMPORT_RUNNER='cml.jobs.SyncRunner'):
+            self.assertEqual(self.import_file(), 'success')
+        exchange = Exchange.objects.get(exchange_type='import')
+        self.assertEqual(exchange.status, Exchange.Status.SUCCESS)
+        self.assertEqual(exchange.item_counts['Product'], 282)
+        self.assertEqual(exchange.file_size, os.path.getsize(os.path.join(FIXTURES_PATH, 'import.xml')))
+        self.assertEqual(exchange.error_count, 0)
+        self.assertGreater(exchange.duration, 0)
+
+    def test_thread_runner_waits_for_commit(self):
+        from cml.jobs import ThreadRunner
+        job = ImportJob.objects.create(user=self.user, filename='import.xml')
+        with mock.patch.object(ThreadRunner, 'get_executor') as get_executor:
+            with self.captureOnCommitCallbacks(execute=True):
+                ThreadRunner().submit(job)
+                get_executor.assert_not_called()
+        get_executor.return_value.submit.assert_called_once_with(ThreadRunner._run, job.pk)
+
+    def test_failure(self):
+        with open(os.path.join(self.upload_root, 'import.xml'), 'w') as f:
+            f.write('<broken')
+        with override_settings(CML_UPLOAD_ROOT=self.upload_root,
+                               CML_IMPORT_RUNNER='cml.jobs.SyncRunner'):
+            self.assertEqual(self.import_file(), 'failure')
+        exchange = Exchange.objects.get(exchange_type='import')
+        self.assertEqual(exchange.status, Exchange.Status.FAILURE)
+        self.assertEqual(exchange.error_count, 1)
+
+    def test_background_job(self):
+        with override_settings(CML_UPLOAD_ROOT=self.upload_root,
+                               CML_IMPORT_RUNNER='tests.test_views.NullRunner'):
+            self.assertEqual(self.import_file(), 'progress')
+            self.assertEqual(self.import_file(), 'progress')
+            self.assertEqual(ImportJob.objects.count(), 1)
+            ImportJob.objects.update(status=ImportJob.Status.SUCCESS)
+            self.assertEqual(self.import_file(), 'success')
+            # the next exchange starts a new job
+            self.assertEqual(self.import_file(), 'progress')
+            self.assertEqual(ImportJob.objects.count(), 2)
+
+    def test_unpolled_job(self):
+        with override_settings(CML_UPLOAD_ROOT=self.upload_root,
+                               CML_IMPORT_RUNNER='tests.test_views.NullRunner'):
+            self.assertEqual(self.import_file(), 'progress')
+            # finished but never polled by 1C
+            ImportJob.objects.update(status=ImportJob.Status.SUCCESS)
+            request = self.factory.get('/', {'type': 'catalog', 'mode': 'init'})
+            request.user = self.user
+            init(request)
+            self.assertEqual(self.import_file(), 'progress')
+            self.assertEqual(ImportJob.objects.count(), 2)
+
+
+class ExportTestCase(TestCase):
+
+    def test_export_metrics(self):
+        user = get_user_model().objects.create_user('1c', password='1c')
+        session = SessionStore()
+        factory = RequestFactory()
+        for view in (export_query, export_success):
+            request = factory.get('/')
+            request.user = user
+            request.session = session
+            response = view(request)
+            if response.streaming:
+                content = b''.join(response.streaming_content)
+                self.assertTrue(content.endswith('</КоммерческаяИнформация>'.encode('cp1251')))
+        self.assertEqual(response.content.decode().splitlines()[0], 'success')
+        exchange = Exchange.objects.get(exchange_type='export')
+        self.assertEqual(exchange.item_counts, {'Order': 10})
+        self.assertGreater(exchange.file_size, 0)
+
+    def test_export_metrics_in_cookie_session(self):
+        request = RequestFactory().get('/')
+        request.user = get_user_model().objects.create_user('1c', password='1c')
+        request.session = CookieSessionStore()
+        response = export_query(request)
+        with self.assertLogs('cml.views', 'WARNING'):
+            b''.join(response.streaming_content)
+        self.assertNotIn(EXPORT_STATS_SESSION_KEY, request.session)
+
+    def test_export_watermark(self):
+        from tests.test_utils import OrderPipeline
+        user = get_user_model().objects.create_user('1c', password='1c')
+        factory = RequestFactory()
+        since_values = []
+
+        def yield_item(self, since=None):
+            since_values.append(since)
+            return iter(())
+
+        def export(view):
+            request = factory.get('/')
+            request.user = user
+            request.session = SessionStore()
+            response = view(request)
+            if response.streaming:
+                b''.join(response.streaming_content)
+
+        with mock.patch.object(OrderPipeline, 'yield_item', yield_item), \
+                override_settings(CML_STREAMING_EXPORT=False):
+            export(export_query)
+            export(export_query)
+            self.assertEqual(since_values, [None, None])
+            export(export_success)
+            watermark = ExportWatermark.objects.get(user=user)
+            self.assertIsNotNone(watermark.exported_until)
+            self.assertIsNone(watermark.pending)
+            export(export_query)
+            self.assertEqual(since_values[-1], watermark.exported_until)
+
+    def test_export_cache_watermark(self):
+        from tests.test_utils import OrderPipeline
+        cache_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_root)
+        user = get_user_model().objects.create_user('1c', password='1c')
+        factory = RequestFactory()
+
+        def export(view):
+            request = factory.get('/')
+            request.user = user
+            request.session = SessionStore()
+            response = view(request)
+            response.close()
+
+        with override_settings(CML_EXPORT_CACHE=True, CML_EXPORT_CACHE_ROOT=cache_root), \
+                mock.patch.object(OrderPipeline, 'version', 0):
+            before = timezone.now()
+            export(export_query)
+            rendered = timezone.now()
+            # served from the cache, with the orders read by the first query
+            export(export_query)
+            export(export_success)
+        exported_until = ExportWatermark.objects.get(user=user).exported_until
+        self.assertLessEqual(before - timedelta(milliseconds=1), exported_until)
+        self.assertLessEqual(exported_until, rendered)
+
+    def test_export_cache(self):
+        from tests.test_utils import OrderPipeline
+        cache_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, cache_root)
+        user = get_user_model().objects.create_user('1c', password='1c')
+        other_user = get_user_model().objects.create_user('other', password='other')
+        user_root = os.path.join(cache_root, str(user.pk))
+        session = SessionStore()
+        factory = RequestFactory()
+
+        def export(as_user=user, **headers):
+            request = factory.get('/', **headers)
+            request.user = as_user
+            request.session = session
+            return export_query(request)
+
+        with override_settings(CML_EXPORT_CACHE=True, CML_EXPORT_CACHE_ROOT=cache_root), \
+                mock.patch.object(OrderPipeline, 'version', 0):
+            response = export()
+            self.assertEqual(response.status_code, 200)
+            content = b''.join(response.streaming_content)
+            response.close()
+            self.assertTrue(content.endswith('</КоммерческаяИнформация>'.encode('cp1251')))
+            etag = response['ETag']
+            self.assertEqual(len(os.listdir(user_root)), 1)
+
+            # the documents of other users aren't evicted
+            export(other_user).close()
+            self.assertEqual(len(os.listdir(user_root)), 1)
+
+            response = export(HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response['ETag'], etag)
+
+            # the open document outlives its invalidation by another request
+            response = export()
+            self.assertEqual(response['ETag'], etag)
+            ExportManager.invalidate_cache()
+            self.assertEqual(b''.join(response.streaming_content), content)
+            response.close()
+
+            OrderPipeline.version = 1
+            response = export(HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 200)
+            response.close()
+            self.assertNotEqual(response['ETag'], etag)
+            self.assertEqual(len(os.listdir(user_root)), 1)
+            self.assertEqual(sorted(os.listdir(cache_root)),
+                             sorted([str(user.pk), str(other_user.pk)]))
+
+            request = factory.get('/')
+            request.user = user
+            request.session = session
+            export_success(request)
+            self.assertEqual(glob.glob(os.path.join(cache_root, '*', '*')), [])
+
+
+class UploadFileTestCase(TestCase):
+
+    def setUp(self):
+        self.upload_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_root)
+        self.user = get_user_model().objects.create_user('1c', password='1c')
+        self.session = SessionStore()
+        self.session.create()
+        with open(os.path.join(FIXTURES_PATH, 'import.xml'), 'rb') as f:
+            self.content = f.read()
+        settings = override_settings(
+            CML_UPLOAD_ROOT=self.upload_root,
+            CML_UPLOAD_CHUNK_SIZE=4096,
+            CML_DOC_XMLNS='',
+            CML_CATALOG_FILE_DOWNLOAD_PATH=defaultdict(lambda: self.upload_root))
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.addCleanup(os.umask, os.umask(0o027))
+
+    def get_request(self, content, exchange_type='catalog'):
+        request = RequestFactory().post(
+            f'/?type={exchange_type}&mode=file&filename=import.xml', content,
+            content_type='application/octet-stream')
+        request.user = self.user
+        request.session = self.session
+        return request
+
+    def upload_file(self, request):
+        return upload_file(request).content.decode().splitlines()[0]
+
+    def test_upload(self):
+        request = self.get_request(self.content, exchange_type='sale')
+        read_sizes = []
+        read = request.read
+
+        def chunked_read(size=None):
+            read_sizes.append(size)
+            return read(size)
+        request.read = chunked_read
+        self.assertEqual(self.upload_file(request), 'success')
+        self.assertEqual(os.listdir(self.upload_root), ['import.xml'])
+        file_path = os.path.join(self.upload_root, 'import.xml')
+        with open(file_path, 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(set(read_sizes), {4096})
+        # the temporary file gets the permissions of a file created by open()
+        self.assertEqual(os.stat(file_path).st_mode & 0o777, 0o640)
+
+    def test_chunked_upload(self):
+        parts = [self.content[i:i + 100000] for i in range(0, len(self.content), 100000)]
+        self.assertGreater(len(parts), 2)
+        self.assertEqual(self.upload_file(self.get_request(parts[0])), 'success')
+
+        # a failed request leaves a partial part behind
+        request = self.get_request(parts[1])
+        read = request.read
+        reads = count()
+
+        def failing_read(size=None):
+            if next(reads) == 3:
+                raise OSError('Connection reset')
+            return read(size)
+        request.read = failing_read
+        self.assertEqual(self.upload_file(request), 'failure')
+
+        for part in parts[1:]:
+            self.assertEqual(self.upload_file(self.get_request(part)), 'success')
+        self.assertFalse(os.path.exists(os.path.join(self.upload_root, 'import.xml')))
+
+        request = RequestFactory().get('/')
+        request.user = self.user
+        request.session = self.session
+        finalize_uploads(request)
+        with open(os.path.join(self.upload_root, 'import.xml'), 'rb') as f:
+            self.assertEqual(f.read(), self.content)
+        self.assertEqual(os.listdir(os.path.join(self.upload_root, 'staging')), [])
+
+    def test_file_limit(self):
+        with override_settings(CML_FILE_LIMIT=1000):
+            self.assertEqual(self.upload_file(self.get_request(self.content[:1000])), 'success')
+            self.assertEqual(self.upload_file(self.get_request(self.content[:1001])), 'failure')
+
+    def test_hashed_images(self):
+        image_root = os.path.join(self.upload_root, 'images')
+        with override_settings(CML_HASHED_IMAGES=True, CML_IMAGE_ROOT=image_root):
+            for content in (b'image', b'image', b'new image'):
+                request = self.get_request(content)
+                request.GET = request.GET.copy()
+                request.GET['filename'] = 'image.jpg'
+                self.assertEqual(self.upload_file(request), 'success')
+                finalize_uploads(request)
+            stored_image = StoredImage.objects.get(filename='image.jpg')
+            self.assertEqual(stored_image.size, len(b'new image'))
+            image_path = get_image_path(stored_image.digest, 'image.jpg')
+            with open(image_path, 'rb') as f:
+                self.assertEqual(f.read(), b'new image')
+            self.assertEqual(os.stat(image_path).st_mode & 0o777, 0o640)
+            self.assertEqual(sum(len(files) for path, dirs, files in os.walk(image_root)), 2)
+
+            with open(image_path, 'rb') as f:
+                self.assertEqual(store_image('image.jpg', f), (stored_image.digest, False))
+            # a file already stored is hashed in place and left alone
+            copy_path = os.path.join(self.upload_root, 'copy.jpg')
+            shutil.copy(image_path, copy_path)
+            self.assertEqual(store_image_file('image.jpg', copy_path),
+                             (stored_image.digest, False))
+            self.assertTrue(os.path.exists(copy_path))
+
+            manager = ImportManager(os.path.join(FIXTURES_PATH, 'import.xml'))
+            manager.item_processor = mock.Mock()
+            product = Product()
+            product.image_filename = 'image.jpg'
+            manager._process_item(product)
+            self.assertEqual(product.image_hash, stored_image.digest)
+            self.assertEqual(product.image_path, image_path)
+
+            # stored after the index was loaded, e.g. from an archive
+            with open(copy_path, 'wb') as f:
+                f.write(b'other image')
+            digest, changed = store_image_file('other.jpg', copy_path)
+            self.assertFalse(os.path.exists(copy_path))
+            product = Product()
+            product.image_filename = 'other.jpg'
+            manager._process_item(product)
+            self.assertEqual(product.image_hash, digest)
+
+    def test_zip_upload(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        archive_path = os.path.join(media_root, 'exchange.zip')
+        with zipfile.ZipFile(archive_path, 'w', zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr('import.xml', self.content)
+            archive.writestr('import_files/c0/image.jpg', b'image')
+        with open(archive_path, 'rb') as f:
+            content = f.read()
+        request = self.get_request(content)
+        request.GET = request.GET.copy()
+        request.GET['filename'] = 'exchange.zip'
+        self.assertEqual(self.upload_file(request), 'success')
+
+        request = RequestFactory().get('/', {'type': 'catalog', 'mode': 'import',
+                                             'filename': 'import.xml'})
+        request.user = self.user
+        request.session = self.session
+        with mock.patch('cml.views.extract_images_in_background') as extract, \
+                override_settings(CML_IMPORT_RUNNER='cml.jobs.SyncRunner'):
+            response = import_file(request)
+        self.assertEqual(response.content.decode().splitlines()[0], 'success')
+        extract.assert_called_once_with(os.path.join(self.upload_root, 'exchange.zip'))
+        exchange = Exchange.objects.get(exchange_type='import')
+        self.assertEqual(exchange.item_counts['Product'], 282)
+        # the archive isn't extracted to disk
+        self.assertEqual(sorted(os.listdir(self.upload_root)), ['exchange.zip', 'staging'])
+
+        with override_settings(CML_CATALOG_FILE_DOWNLOAD_PATH=defaultdict(
+                lambda: self.upload_root, {'.jpg': media_root})):
+            extract_images(os.path.join(self.upload_root, 'exchange.zip'))
+        with open(os.path.join(media_root, 'image.jpg'), 'rb') as f:
+            self.assertEqual(f.read(), b'image')
+        self.assertEqual(sorted(os.listdir(self.upload_root)), ['exchange.zip', 'staging'])